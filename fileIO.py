@@ -2,6 +2,8 @@
 # -------------------------------------------------------------------------------
 # Name:        fileIO.py for python 3.x
 # Purpose:     fuctions to save/load python objects to/from disk
+#              functions to save/load numpy arrays as .npy files that other processes can memory map
+#              functions to save/load feature tables (.npy + .json with the column names) and to export text views
 #
 # Author:      Claudio Piccinini
 #
@@ -12,8 +14,13 @@
 # set module path for pydoc documentation
 # sys.path.append(r'')
 
+import json
+import os
 import pickle
 
+import numpy as np
+from numpy.lib import recfunctions
+
 
 def save_object(f, ob):
     """Save an object on disk
@@ -51,4 +58,276 @@ def load_object(f):
         if a is not None:
             a.close()
         if b is not None:
-            return b
\ No newline at end of file
+            return b
+
+
+def save_array(f, data):
+    """Save a numpy array on disk as a .npy file, other processes can read it with load_array() without copying
+    the whole array in memory
+
+    the array is written to a temporary file and renamed, a reader never sees an incomplete file
+
+    :param f: file path (.npy)
+    :param data: numpy array
+    :return: the file path
+    """
+
+    tmp = f + '.tmp'
+    out = None
+    try:
+        out = open(tmp, 'wb')
+        np.save(out, np.asarray(data))
+    finally:
+        if out is not None:
+            out.close()
+    os.replace(tmp, f)
+    return f
+
+
+def load_array(f, mmap=True):
+    """Load a numpy array from a .npy file
+    :param f: file path (.npy)
+    :param mmap: memory map the file (read only) instead of reading it in memory
+    :return: the numpy array
+    """
+
+    return np.load(f, mmap_mode='r' if mmap else None)
+
+
+def save_table(f, data, columns=None):
+    """Save a feature table on disk, the values go to f.npy and the column names to f.json
+
+    :param f: file path without extension
+    :param data: 2d numpy array (rows, columns) or a numpy structured array (one field for each column)
+    :param columns: list of column names (trailing tabs are removed), for a structured array None means the field names
+    :return: the file path without extension
+    """
+
+    ncols = len(data.dtype.names) if data.dtype.names else data.shape[1]
+    if columns is None:
+        columns = list(data.dtype.names or [])
+    columns = [c.strip() for c in columns]
+    if len(columns) != ncols:
+        raise ValueError("the number of column names is different from the number of columns")
+
+    save_array(f + '.npy', data)
+    out = None
+    try:
+        out = open(f + '.json', 'w')
+        json.dump({'columns': columns, 'shape': [data.shape[0], ncols], 'dtype': str(data.dtype)}, out)
+    finally:
+        if out is not None:
+            out.close()
+    return f
+
+
+def load_table(f, mmap=True):
+    """Load a feature table saved with save_table()
+    :param f: file path without extension
+    :param mmap: memory map the values (read only) instead of reading them in memory
+    :return: the 2d numpy array (or the structured array), the list of column names
+    """
+
+    a = None
+    try:
+        a = open(f + '.json')
+        metadata = json.load(a)
+    finally:
+        if a is not None:
+            a.close()
+    return load_array(f + '.npy', mmap), metadata['columns']
+
+
+def _row_format(fmt, ncols, delimiter):
+    """ get the format string of a text row as numpy.savetxt does
+    :param fmt: a single format (e.g. '%.4f') used for all the columns, a string with one format for each column,
+                or a list of formats
+    :param ncols: number of columns
+    :param delimiter: column delimiter
+    :return: the row format string (without the newline)
+    """
+
+    if isinstance(fmt, (list, tuple)):
+        if len(fmt) != ncols:
+            raise ValueError("the number of formats is different from the number of columns")
+        return delimiter.join(fmt)
+    if fmt.count('%') == 1:
+        return delimiter.join([fmt] * ncols)
+    if fmt.count('%') != ncols:
+        raise ValueError("the number of formats is different from the number of columns")
+    return fmt
+
+
+def _table_rows(data, columns, start, stop):
+    """ get some rows and columns of a table as a 2d float64 array (the values written in the text views)
+    :param data: 2d numpy array or numpy structured array
+    :param columns: list of column indexes (not negative)
+    :param start: first row
+    :param stop: last row (excluded)
+    :return: 2d float64 numpy array
+    """
+
+    if data.dtype.names:  # structured array, the fields are converted to float64 like the legacy tables
+        return recfunctions.structured_to_unstructured(data[start:stop][[data.dtype.names[c] for c in columns]], dtype=np.float64)
+    return np.asarray(data[start:stop, columns], dtype=np.float64)
+
+
+def format_rows(data, rowfmt, newline='\n'):
+    """ format a block of rows as text with a single % operation (numpy.savetxt formats one row at a time),
+    the text is the same written by numpy.savetxt
+    :param data: 2d numpy array
+    :param rowfmt: the row format string (see _row_format())
+    :param newline: line separator
+    :return: the encoded text (bytes)
+    """
+
+    if data.shape[0] == 0:
+        return b''
+    return (((rowfmt + newline) * data.shape[0]) % tuple(data.ravel().tolist())).encode()
+
+
+def _format_table_block(f, columns, start, stop, rowfmt):
+    """ format a block of rows of a feature table, this runs in the worker processes of write_table_text()
+    :param f: file path without extension of a table saved with save_table()
+    :param columns: list of column indexes (not negative)
+    :param start: first row
+    :param stop: last row (excluded)
+    :param rowfmt: the row format string
+    :return: the encoded text (bytes)
+    """
+
+    data, names = load_table(f)
+    return format_rows(_table_rows(data, columns, start, stop), rowfmt)
+
+
+def write_table_text(f, outfile, columns=None, fmt='%.4f', delimiter='\t', header=True, chunksize=100000, workers=1,
+                     buffersize=2**24):
+    """Write some columns of a feature table as a text file, the blocks of rows are formatted in parallel by a pool
+    of processes (each process memory maps the table, only the text is sent back) and written in order through a
+    large buffer; the text is the same written by numpy.savetxt
+    :param f: file path without extension of a table saved with save_table()
+    :param outfile: output text file path
+    :param columns: list of column indexes (negative indexes are allowed), None for all the columns
+    :param fmt: numpy.savetxt format (a single format, one format for each column or a list of formats)
+    :param delimiter: column delimiter
+    :param header: write the column names in the first row?
+    :param chunksize: number of rows formatted at once
+    :param workers: number of processes formatting the rows; with 1 the rows are formatted in this process
+    :param buffersize: size in bytes of the output buffer
+    :return: the output file path
+    """
+
+    data, names = load_table(f)
+    if columns is None:
+        columns = list(range(len(names)))
+    columns = [c % len(names) for c in columns]
+    rowfmt = _row_format(fmt, len(columns), delimiter)
+    blocks = [(start, min(start + chunksize, data.shape[0])) for start in range(0, data.shape[0], chunksize)]
+
+    out = None
+    executor = None
+    try:
+        out = open(outfile, 'wb', buffering=buffersize)
+        if header:
+            out.write((delimiter.join([names[c] for c in columns]) + '\n').encode())
+
+        if workers > 1 and len(blocks) > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            executor = ProcessPoolExecutor(max_workers=workers)
+            pending = []
+            for start, stop in blocks:
+                pending.append(executor.submit(_format_table_block, f, columns, start, stop, rowfmt))
+                # keep a limited number of formatted blocks in memory, write them in order
+                if len(pending) >= 2 * workers:
+                    out.write(pending.pop(0).result())
+            for future in pending:
+                out.write(future.result())
+        else:
+            for start, stop in blocks:
+                out.write(format_rows(_table_rows(data, columns, start, stop), rowfmt))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if out is not None:
+            out.close()
+    return outfile
+
+
+def export_table_view(f, outfile, columns=None, fmt='%.4f', delimiter='\t', header=True, chunksize=100000, fast=True,
+                      workers=1):
+    """Write some columns of a feature table as a text file, rows are written by chunks to limit the memory usage
+    :param f: file path without extension of a table saved with save_table()
+    :param outfile: output text file path
+    :param columns: list of column indexes (negative indexes are allowed), None for all the columns
+    :param fmt: numpy.savetxt format
+    :param delimiter: column delimiter
+    :param header: write the column names in the first row?
+    :param chunksize: number of rows written at once
+    :param fast: use write_table_text() (same text, formatted by blocks) instead of numpy.savetxt
+    :param workers: with fast=True, number of processes formatting the rows
+    :return: the output file path
+    """
+
+    if fast:
+        return write_table_text(f, outfile, columns, fmt, delimiter, header, chunksize, workers)
+
+    data, names = load_table(f)
+    if columns is None:
+        columns = list(range(len(names)))
+    columns = [c % len(names) for c in columns]
+
+    out = None
+    try:
+        out = open(outfile, 'wb')
+        if header:
+            out.write((delimiter.join([names[c] for c in columns]) + '\n').encode())
+        for start in range(0, data.shape[0], chunksize):
+            np.savetxt(out, _table_rows(data, columns, start, start + chunksize), fmt=fmt, delimiter=delimiter)
+    finally:
+        if out is not None:
+            out.close()
+    return outfile
+
+
+def benchmark_export_table_view(f, outfile, columns=None, fmt='%.4f', delimiter='\t', workers=(1, 2, 4), repeat=1):
+    """ compare the rows/second of export_table_view() with numpy.savetxt (before) and with write_table_text()
+    for different numbers of processes (after); the outputs are checked to be the same
+
+    :param f: file path without extension of a table saved with save_table()
+    :param outfile: path to the output text file (overwritten by each run)
+    :param columns: see export_table_view()
+    :param fmt: see export_table_view()
+    :param delimiter: see export_table_view()
+    :param workers: list with the numbers of processes to measure
+    :param repeat: number of runs for each method, the best time is used
+    :return: a dictionary {method: rows/second}
+    """
+
+    import time
+    import filecmp
+
+    rows = load_table(f)[0].shape[0]
+
+    runs = [('savetxt', {'fast': False})] + [('fast %d workers' % w, {'fast': True, 'workers': w}) for w in workers]
+
+    results = {}
+    for name, kwargs in runs:
+        best = None
+        for i in range(repeat):
+            start = time.perf_counter()
+            export_table_view(f, outfile + '.' + name.replace(' ', '_'), columns, fmt, delimiter, **kwargs)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = rows / best if best else float('inf')
+
+    for name, kwargs in runs[1:]:
+        if not filecmp.cmp(outfile + '.savetxt', outfile + '.' + name.replace(' ', '_'), shallow=False):
+            raise Exception("the output of " + name + " is different from numpy.savetxt")
+    for name, kwargs in runs:
+        os.replace(outfile + '.' + name.replace(' ', '_'), outfile)
+
+    print('\nrows/second')
+    for name in results:
+        print(name, round(results[name]), 'x%.2f' % (results[name] / results['savetxt']))
+
+    return results
@@ -4,6 +4,8 @@
 # Purpose:  - describe a raster dataset
 #           - import a sinle raster band to an indexed 2D numpy array
 #           - import a multiband raster to an indexed 2D numpy array
+#           - import a multiband raster to an indexed 2D numpy array by block windows (streaming)
+#           - convert an already read multiband numpy array to an indexed 2D numpy array
 #           - import a list of rasters to an indexed 2D numpy array (only the first bands)
 #           - export a numpy array to a raster
 #           - create a a list where each element as a 1dimensional array for each raster band
@@ -146,6 +148,190 @@ def raster_dataset_to_indexed_numpy(dataset, name, maxbands=100, bandLocation="b
         raise e
 
 
+def array_to_indexed_numpy(data, nodata=-3.40282e+038, bandLocation="bycolumn"):
+    """Convert a multiband numpy array (as returned by dataset.ReadAsArray()) into an indexed array
+
+       important: the index is defined by the first band (pixels > nodata) and it is applied to all the bands
+       the bands are reshaped without copying, only the valid pixels are copied
+       (if all the pixels are valid the indexed array is a view of the input array)
+
+    :param data: 3d numpy array (bands, rows, columns) or 2d numpy array (rows, columns) for a single band
+    :param nodata: pixel no data value
+    :param bandLocation: how to store bands (possible values: "byrow" , "bycolumn")
+    :return: the index, the 2d indexed array
+    """
+
+    if not (bandLocation == "byrow" or bandLocation == "bycolumn"):
+        raise Exception("you need the specify the correct \"bandLocation\" argument!!!")
+
+    if data.ndim == 2:  # single band
+        data = data[np.newaxis]
+    nbands = data.shape[0]
+
+    # define the index with the first band
+    valid = data[0] > nodata
+    index = np.nonzero(valid)
+
+    # each row is a band, each column is a pixel
+    r_indexed = data.reshape(nbands, -1)
+    if index[0].shape[0] != valid.size:
+        r_indexed = r_indexed[:, valid.ravel()]
+
+    if bandLocation == "bycolumn":
+        # each row is a pixel, each column is a band
+        r_indexed = r_indexed.T
+
+    return index, r_indexed
+
+
+def block_windows(band):
+    """ get the native block windows of a gdal band, the last row/column of blocks may be smaller
+
+    :param band: a gdal band
+    :return: a list of windows (xoff, yoff, xcount, ycount), ordered by row of blocks
+    """
+
+    width = band.XSize
+    height = band.YSize
+    block_xsize, block_ysize = band.GetBlockSize()
+
+    windows = []
+    for yoff in range(0, height, block_ysize):
+        ycount = min(block_ysize, height - yoff)
+        for xoff in range(0, width, block_xsize):
+            xcount = min(block_xsize, width - xoff)
+            windows.append((xoff, yoff, xcount, ycount))
+    return windows
+
+
+def iter_indexed_blocks(dataset, name, maxbands=100, nodata=-3.40282e+038):
+    """Iterate a multiband raster dataset by native block windows and yield indexed blocks
+
+       important: the index is defined by the first band (pixels > nodata) and it is applied to all the bands
+
+    :param dataset: gdal raster dataset
+    :param name: the raster name
+    :param maxbands: the number of bands to import
+    :param nodata: pixel no data value
+    :return: a generator of (index, indexed block, properties)
+             - the index is a tuple (rows, columns) with the pixel positions in the full raster
+             - the indexed block is a 2d array, each row is a pixel, each column is a band
+             - the properties dictionary has the raster properties plus the block window
+               ("xoff", "yoff", "block columns", "block rows")
+    """
+
+    if maxbands < 1 : raise Exception("number of bands should be >=1!!!")
+
+    name, width, height, nbands, csystem, geotransform = describe_raster_dataset(dataset, name)
+    nbands = min(nbands, maxbands)
+
+    bands = [dataset.GetRasterBand(idx) for idx in range(1, nbands + 1)]  # gdal bands starts at 1
+    datatype = np.result_type(*[gdar.GDALTypeCodeToNumericTypeCode(band.DataType) for band in bands])
+
+    try:
+        for xoff, yoff, xcount, ycount in block_windows(bands[0]):
+
+            # define the index with the first band
+            px = gdar.BandReadAsArray(bands[0], xoff, yoff, xcount, ycount)
+            index = np.nonzero(px > nodata)
+
+            block = np.empty((index[0].shape[0], nbands), dtype=datatype)
+            block[:, 0] = px[index]
+            for i in range(1, nbands):
+                block[:, i] = gdar.BandReadAsArray(bands[i], xoff, yoff, xcount, ycount)[index]
+
+            properties = {"name": name, "columns": width, "rows": height, "nbands": nbands, "csystem": csystem,
+                          "geotransform": geotransform, "bands orientation": "bycolumn",
+                          "xoff": xoff, "yoff": yoff, "block columns": xcount, "block rows": ycount}
+
+            yield (index[0] + yoff, index[1] + xoff), block, properties
+
+    finally:
+        bands = None  # give memory control back to C++ code
+
+
+def raster_dataset_to_indexed_numpy_blocks(dataset, name, maxbands=100, bandLocation="bycolumn", nodata=-3.40282e+038):
+    """Convert a multiband raster dataset into an indexed array reading by native block windows
+
+       this returns the same data as raster_dataset_to_indexed_numpy() but the output is preallocated with the
+       raster data type and filled block by block, therefore the image is never held in memory more than once
+       the pixels are ordered by block window (the index is consistent with the indexed array)
+
+       important: the index is defined by the first band (pixels > nodata) and it is applied to all the bands
+
+    :param dataset: gdal raster dataset
+    :param name: the raster name
+    :param maxbands: the number of bands to import
+    :param bandLocation: how to store bands (possible values: "byrow" , "bycolumn")
+    :param nodata: pixel no data value
+    :return: the index, the 2d indexed array , dictionary with raster properties
+    """
+
+    if maxbands < 1 : raise Exception("number of bands should be >=1!!!")
+    if not (bandLocation == "byrow" or bandLocation == "bycolumn"):
+        raise Exception("you need the specify the correct \"bandLocation\" argument!!!")
+
+    band = None
+    try:
+        # describe the band and set a dictionary with the raster properties
+        name, width, height, nbands, csystem, geotransform = describe_raster_dataset(dataset, name)
+        properties={"name": name, "columns": width,"rows":height, "nbands": nbands,"csystem": csystem, "geotransform": geotransform, "bands orientation": bandLocation, "bands": {}}
+        properties["bands"] = {"columns": [], "rows": [], "blocksize": [], "nodatavalue": [], "datatype": []}
+
+        # set the number of bands to process
+        print("This raster has "+ str(nbands) + " bands")
+        if maxbands <= nbands:
+            nbands = maxbands
+        print("We are processing " + str(nbands) + " bands")
+
+        for idx in range(1, nbands + 1): #gdal bands starts at 1
+            band = dataset.GetRasterBand(idx)
+            properties["bands"]["columns"].append(band.XSize)
+            properties["bands"]["rows"].append(band.YSize)
+            properties["bands"]["blocksize"].append(band.GetBlockSize())
+            properties["bands"]["nodatavalue"].append(band.GetNoDataValue())
+            properties["bands"]["datatype"].append(gdar.GDALTypeCodeToNumericTypeCode(band.DataType))
+        datatype = np.result_type(*properties["bands"]["datatype"])
+
+        # first pass: count the valid pixels reading only the first band
+        band = dataset.GetRasterBand(1)
+        npixels = 0
+        for xoff, yoff, xcount, ycount in block_windows(band):
+            npixels += np.count_nonzero(gdar.BandReadAsArray(band, xoff, yoff, xcount, ycount) > nodata)
+        band = None  # give memory control back to C++ code
+
+        # preallocate the output
+        index = (np.empty(npixels, dtype=np.intp), np.empty(npixels, dtype=np.intp))
+        if bandLocation == "bycolumn":
+            # a 2darray, each row is a pixel, each column is a band
+            r_indexed = np.empty((npixels, nbands), dtype=datatype)
+        else:
+            # a 2darray, each row is a band, each column is a pixel
+            r_indexed = np.empty((nbands, npixels), dtype=datatype)
+
+        # second pass: fill the output block by block
+        start = 0
+        for (rows, cols), block, blockproperties in iter_indexed_blocks(dataset, name, nbands, nodata):
+            end = start + rows.shape[0]
+            index[0][start:end] = rows
+            index[1][start:end] = cols
+            if bandLocation == "bycolumn":
+                r_indexed[start:end] = block
+            else:
+                r_indexed[:, start:end] = block.T
+            start = end
+
+        return index, r_indexed, properties
+
+    except RuntimeError as err:
+        raise err
+    except Exception as e:
+        raise e
+    finally:
+        if band is not None:
+            band = None  # give memory control back to C++ code
+
+
 def raster_list_to_indexed_numpy(dataset, name, bandLocation="bycolumn", nodata=-3.40282e+038):
     """Convert a list of gdal datasets (single band) into in indexed array
         we get the index for the first band only (we supposed this is the same for all the bands, 
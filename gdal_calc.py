@@ -54,6 +54,10 @@ except ImportError:
     from gdalnumeric import *
 
 from optparse import OptionParser
+from concurrent.futures import ThreadPoolExecutor
+import collections
+import threading
+import queue
 import sys
 import os
 
@@ -69,253 +73,344 @@ DefaultNDVLookup={'Byte':255, 'UInt16':65535, 'Int16':-32767, 'UInt32':429496729
 #3.402823466E+38
 
 ################################################################
-def doit(opts, args):
+# streaming engine: the calculations are compiled once, each block of the inputs is read once and all the
+# calculations are evaluated on it (one output file for each calculation)
+################################################################
+
+def compile_calc(calc):
+    """ compile a calculation once, the compiled code is evaluated on each block
+    :param calc: calculation in gdalnumeric syntax (it can be quoted e.g. "((A-B)/(A+B))")
+    :return: the compiled code
+    """
+
+    calc = calc.strip()
+    # the calculation may be passed with quotes e.g. --calc="((A-B)/(A+B))"
+    while len(calc) > 1 and calc[0] == calc[-1] and calc[0] in "\"'":
+        calc = calc[1:-1].strip()
+    try:
+        return compile(calc, "<calc %s>" % calc, "eval")
+    except SyntaxError as e:
+        raise ValueError("calculation %s is not valid: %s" % (calc, e))
+
+
+def calc_block(codes, data, nodata, outnodata):
+    """ evaluate the compiled calculations on a block of the inputs
+    the inputs are cast to float32 (unsigned inputs would not allow negative outputs), the output pixels where an
+    input is nodata get the output nodata value
+
+    :param codes: list of compiled calculations (see compile_calc())
+    :param data: dictionary {letter: 2d numpy array}
+    :param nodata: dictionary {letter: nodata value or None}
+    :param outnodata: list with the output nodata value for each calculation
+    :return: list of 2d numpy arrays, one for each calculation
+    """
+
+    namespace = dict(globals())  # the numpy functions imported from gdalnumeric
+    mask = None
+    shape = None
+    for letter, values in data.items():
+        values = values.astype(numpy.float32, copy=False)
+        shape = values.shape
+        ndv = nodata.get(letter)
+        if ndv is not None:
+            isnodata = numpy.isnan(values) if numpy.isnan(ndv) else values == ndv
+            mask = isnodata if mask is None else numpy.logical_or(mask, isnodata)
+        namespace[letter] = values
+
+    results = []
+    for code, ndv in zip(codes, outnodata):
+        try:
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                result = numpy.broadcast_to(eval(code, namespace), shape)
+        except:
+            print("evaluation of calculation %s failed" % (code.co_filename[6:-1]))
+            raise
+        # propagate nodata values
+        if mask is not None:
+            result = numpy.where(mask, ndv, result)
+        results.append(result)
+
+    return results
+
+
+def block_windows(xsize, ysize, blocksize):
+    """ get the blocks to process, column by column as gdal_calc always did
+    :param xsize: raster columns
+    :param ysize: raster rows
+    :param blocksize: (block columns, block rows)
+    :return: a list of windows (xoff, yoff, xcount, ycount)
+    """
+
+    # builtin min() may be shadowed by the gdalnumeric import
+    windows = []
+    for myX in range(0, xsize, blocksize[0]):
+        nXValid = blocksize[0] if myX + blocksize[0] <= xsize else xsize - myX
+        for myY in range(0, ysize, blocksize[1]):
+            nYValid = blocksize[1] if myY + blocksize[1] <= ysize else ysize - myY
+            windows.append((myX, myY, nXValid, nYValid))
+    return windows
+
+
+def read_ahead(read, blocks, depth):
+    """ read the blocks in a background thread, at most depth blocks are read ahead of the consumer
+    :param read: function reading a block, called in the background thread only
+    :param blocks: list of blocks
+    :param depth: maximum number of blocks waiting to be consumed
+    :return: generator of (block, data)
+    """
+
+    loaded = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        # give up if the consumer has stopped
+        while not stop.is_set():
+            try:
+                loaded.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def reader():
+        try:
+            for block in blocks:
+                if not put((block, read(block), None)):
+                    return
+        except BaseException as e:
+            put((None, None, e))
+            return
+        put(None)
+
+    thread = threading.Thread(target=reader, name="gdal_calc_reader", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = loaded.get()
+            if item is None:
+                return
+            block, data, error = item
+            if error is not None:
+                raise error
+            yield block, data
+    finally:
+        stop.set()
+        thread.join()
+
+
+def calculate(inputs, calcs, outfiles, bands=None, outtype=None, nodata=None, allbands="", frmt="GTiff",
+              creation_options=(), overwrite=False, threads=1, debug=False):
+    """ raster calculator: evaluate many calculations with one pass over the inputs, each calculation is written to
+    its output file; the calculations are compiled once and evaluated on each block by a pool of threads
+
+    :param inputs: dictionary {letter A-Z: input raster path}
+    :param calcs: list of calculations in gdalnumeric syntax using the input letters
+    :param outfiles: list of output files, one for each calculation (existing files are filled if overwrite is False)
+    :param bands: dictionary {letter: band number} (default band 1)
+    :param outtype: output datatype name (default the largest type of the inputs)
+    :param nodata: output nodata value (default a datatype specific value)
+    :param allbands: process all the bands of the given input letter
+    :param frmt: GDAL format for the output files
+    :param creation_options: creation options for the output format driver
+    :param overwrite: overwrite the output files if they exist
+    :param threads: number of threads evaluating the calculations; with more than 1 thread the inputs are read ahead
+                    in a background thread and the outputs are written in order
+    :param debug: print debugging information
+    :return: list of output files
+    """
+
+    if len(calcs) != len(outfiles):
+        raise ValueError("there should be an output file for each calculation")
+    bands = bands or {}
+
+    codes = [compile_calc(c) for c in calcs]
+
+    if debug:
+        print("gdal_calc.py starting calculation %s" % (", ".join(calcs)))
+
+    myFiles = {}
+    myOuts = []
+    try:
+        ################################################################
+        # fetch details of input layers
+        ################################################################
 
-    if opts.debug:
-        print("gdal_calc.py starting calculation %s" %(opts.calc))
-
-    ################################################################
-    # fetch details of input layers
-    ################################################################
-
-    # set up some lists to store data for each band
-    myFiles=[]
-    myBands=[]
-    myAlphaList=[]
-    myDataType=[]
-    myDataTypeNum=[]
-    myNDV=[]
-    DimensionsCheck=None
-
-    # loop through input files - checking dimensions
-    for i,myI in enumerate(AlphaList[0:len(sys.argv)-1]):
-        myF = eval("opts.%s" %(myI))
-        myBand = eval("opts.%s_band" %(myI))
-        if myF:
-            myFiles.append(gdal.Open(myF, gdal.GA_ReadOnly))
+        myAlphaList = [letter for letter in AlphaList if inputs.get(letter)]
+        myBands = {}
+        myNDV = {}
+        myDataTypeNum = []
+        DimensionsCheck = None
+
+        # loop through input files - checking dimensions
+        for letter in myAlphaList:
+            myFiles[letter] = gdal.Open(inputs[letter], gdal.GA_ReadOnly)
             # check if we have asked for a specific band...
-            if myBand:
-                myBands.append(myBand)
-            else:
-                myBands.append(1)
-            myAlphaList.append(myI)
-            myDataType.append(gdal.GetDataTypeName(myFiles[i].GetRasterBand(myBands[i]).DataType))
-            myDataTypeNum.append(myFiles[i].GetRasterBand(myBands[i]).DataType)
-            myNDV.append(myFiles[i].GetRasterBand(myBands[i]).GetNoDataValue())
+            myBands[letter] = bands.get(letter) or 1
+            myBand = myFiles[letter].GetRasterBand(myBands[letter])
+            myDataTypeNum.append(myBand.DataType)
+            myNDV[letter] = myBand.GetNoDataValue()
             # check that the dimensions of each layer are the same
-            if DimensionsCheck:
-                if DimensionsCheck!=[myFiles[i].RasterXSize, myFiles[i].RasterYSize]:
-                    print("Error! Dimensions of file %s (%i, %i) are different from other files (%i, %i).  Cannot proceed" % \
-                            (myF,myFiles[i].RasterXSize, myFiles[i].RasterYSize,DimensionsCheck[0],DimensionsCheck[1]))
-                    return
-            else:
-                DimensionsCheck=[myFiles[i].RasterXSize, myFiles[i].RasterYSize]
+            dimensions = [myFiles[letter].RasterXSize, myFiles[letter].RasterYSize]
+            if DimensionsCheck and DimensionsCheck != dimensions:
+                raise ValueError("Dimensions of file %s (%i, %i) are different from other files (%i, %i).  Cannot proceed" %
+                                 (inputs[letter], dimensions[0], dimensions[1], DimensionsCheck[0], DimensionsCheck[1]))
+            DimensionsCheck = dimensions
+
+            if debug:
+                print("file %s: %s, dimensions: %s, %s, type: %s" % (letter, inputs[letter], DimensionsCheck[0],
+                      DimensionsCheck[1], gdal.GetDataTypeName(myBand.DataType)))
+
+        if not myAlphaList:
+            raise ValueError("no input files")
+
+        # process allBands option
+        allBandsLetter = None
+        allBandsCount = 1
+        if allbands:
+            if allbands not in myAlphaList:
+                raise ValueError("allBands option was given but Band %s not found.  Cannot proceed" % allbands)
+            allBandsCount = myFiles[allbands].RasterCount
+            if allBandsCount > 1:
+                allBandsLetter = allbands
 
-            if opts.debug:
-                print("file %s: %s, dimensions: %s, %s, type: %s" %(myI,myF,DimensionsCheck[0],DimensionsCheck[1],myDataType[i]))
+        ################################################################
+        # set up output files
+        ################################################################
 
-    # process allBands option
-    allBandsIndex=None
-    allBandsCount=1
-    if opts.allBands:
-        try:
-            allBandsIndex=myAlphaList.index(opts.allBands)
-        except ValueError:
-            print("Error! allBands option was given but Band %s not found.  Cannot proceed" % (opts.allBands))
-            return
-        allBandsCount=myFiles[allBandsIndex].RasterCount
-        if allBandsCount <= 1:
-            allBandsIndex=None
-
-    ################################################################
-    # set up output file
-    ################################################################
-
-    # open output file exists
-    if os.path.isfile(opts.outF) and not opts.overwrite:
-        if allBandsIndex is not None:
-            print("Error! allBands option was given but Output file exists, must use --overwrite option!")
-            return
-        if opts.debug:
-            print("Output file %s exists - filling in results into file" %(opts.outF))
-        myOut=gdal.Open(opts.outF, gdal.GA_Update)
-        if [myOut.RasterXSize,myOut.RasterYSize] != DimensionsCheck:
-            print("Error! Output exists, but is the wrong size.  Use the --overwrite option to automatically overwrite the existing file")
-            return
-        myOutB=myOut.GetRasterBand(1)
-        myOutNDV=myOutB.GetNoDataValue()
-        myOutType=gdal.GetDataTypeName(myOutB.DataType)
+        myOutNDV = []
+        for outfile in outfiles:
+            # open output file exists
+            if os.path.isfile(outfile) and not overwrite:
+                if allBandsLetter is not None:
+                    raise ValueError("allBands option was given but Output file exists, must use --overwrite option!")
+                if debug:
+                    print("Output file %s exists - filling in results into file" % outfile)
+                myOut = gdal.Open(outfile, gdal.GA_Update)
+                if [myOut.RasterXSize, myOut.RasterYSize] != DimensionsCheck:
+                    raise ValueError("Output exists, but is the wrong size.  Use the --overwrite option to automatically overwrite the existing file")
+                myOutNDV.append(myOut.GetRasterBand(1).GetNoDataValue())
 
-    else:
-        # remove existing file and regenerate
-        if os.path.isfile(opts.outF):
-            os.remove(opts.outF)
-        # create a new file
-        if opts.debug:
-            print("Generating output file %s" %(opts.outF))
-
-        # find data type to use
-        if not opts.type:
-            # use the largest type of the input files
-            myOutType=gdal.GetDataTypeName(max(myDataTypeNum))
-        else:
-            myOutType=opts.type
+            else:
+                # remove existing file and regenerate
+                if os.path.isfile(outfile):
+                    os.remove(outfile)
+                if debug:
+                    print("Generating output file %s" % outfile)
+
+                # find data type to use, the largest type of the input files
+                myOutType = outtype if outtype else gdal.GetDataTypeName(max(myDataTypeNum))
+
+                # create file
+                myOutDrv = gdal.GetDriverByName(frmt)
+                myOut = myOutDrv.Create(outfile, DimensionsCheck[0], DimensionsCheck[1], allBandsCount,
+                                        gdal.GetDataTypeByName(myOutType), list(creation_options))
+
+                # set output geo info based on first input layer
+                myOut.SetGeoTransform(myFiles[myAlphaList[0]].GetGeoTransform())
+                myOut.SetProjection(myFiles[myAlphaList[0]].GetProjection())
+
+                ndv = nodata if nodata is not None else DefaultNDVLookup[myOutType]
+                for i in range(1, allBandsCount+1):
+                    myOut.GetRasterBand(i).SetNoDataValue(ndv)
+                myOutNDV.append(ndv)
+
+            if debug:
+                print("output file: %s, dimensions: %s, %s, type: %s" % (outfile, myOut.RasterXSize, myOut.RasterYSize,
+                      gdal.GetDataTypeName(myOut.GetRasterBand(1).DataType)))
+            myOuts.append(myOut)
 
-        # create file
-        myOutDrv = gdal.GetDriverByName(opts.format)
-        myOut = myOutDrv.Create(
-            opts.outF, DimensionsCheck[0], DimensionsCheck[1], allBandsCount,
-            gdal.GetDataTypeByName(myOutType), opts.creation_options)
+        ################################################################
+        # loop through the blocks, use the block size of the first layer to read efficiently
+        ################################################################
 
-        # set output geo info based on first input layer
-        myOut.SetGeoTransform(myFiles[0].GetGeoTransform())
-        myOut.SetProjection(myFiles[0].GetProjection())
+        myBlockSize = myFiles[myAlphaList[0]].GetRasterBand(myBands[myAlphaList[0]]).GetBlockSize()
+        windows = block_windows(DimensionsCheck[0], DimensionsCheck[1], myBlockSize)
+
+        if debug:
+            print("using blocksize %s x %s" % (myBlockSize[0], myBlockSize[1]))
+
+        # variables for displaying progress
+        ProgressCt = 0
+        ProgressMk = -1
+        ProgressEnd = len(windows) * allBandsCount
+
+        def write(bandNo, window, results):
+            nonlocal ProgressCt, ProgressMk
+            for myOut, myResult in zip(myOuts, results):
+                BandWriteArray(myOut.GetRasterBand(bandNo), myResult, xoff=window[0], yoff=window[1])
+            ProgressCt += 1
+            if 10 * ProgressCt // ProgressEnd != ProgressMk and ProgressCt < ProgressEnd:
+                ProgressMk = 10 * ProgressCt // ProgressEnd
+                print("%d.." % (10 * ProgressMk), end=" ")
+
+        def read(block):
+            # fetch data for each input layer
+            bandNo, window = block
+            data = {}
+            for letter in myAlphaList:
+                myBandNo = bandNo if letter == allBandsLetter else myBands[letter]
+                data[letter] = BandReadAsArray(myFiles[letter].GetRasterBand(myBandNo), xoff=window[0],
+                                               yoff=window[1], win_xsize=window[2], win_ysize=window[3])
+            return data
+
+        blocks = [(bandNo, window) for bandNo in range(1, allBandsCount+1) for window in windows]
+
+        if threads <= 1:
+            for block in blocks:
+                write(block[0], block[1], calc_block(codes, read(block), myNDV, myOutNDV))
 
-        if opts.NoDataValue!=None:
-            myOutNDV=opts.NoDataValue
         else:
-            myOutNDV=DefaultNDVLookup[myOutType]
-
-        for i in range(1,allBandsCount+1):
-            myOutB=myOut.GetRasterBand(i)
-            myOutB.SetNoDataValue(myOutNDV)
-            # write to band
-            myOutB=None
-
-    if opts.debug:
-        print("output file: %s, dimensions: %s, %s, type: %s" %(opts.outF,myOut.RasterXSize,myOut.RasterYSize,gdal.GetDataTypeName(myOutB.DataType)))
-
-    ################################################################
-    # find block size to chop grids into bite-sized chunks 
-    ################################################################
-
-    # use the block size of the first layer to read efficiently
-    myBlockSize=myFiles[0].GetRasterBand(myBands[0]).GetBlockSize();
-    # store these numbers in variables that may change later
-    nXValid = myBlockSize[0]
-    nYValid = myBlockSize[1]
-    # find total x and y blocks to be read
-    nXBlocks = (int)((DimensionsCheck[0] + myBlockSize[0] - 1) / myBlockSize[0]);
-    nYBlocks = (int)((DimensionsCheck[1] + myBlockSize[1] - 1) / myBlockSize[1]);
-    myBufSize = myBlockSize[0]*myBlockSize[1]
-
-    if opts.debug:
-        print("using blocksize %s x %s" %(myBlockSize[0], myBlockSize[1]))
-
-    # variables for displaying progress
-    ProgressCt=-1
-    ProgressMk=-1
-    ProgressEnd=nXBlocks*nYBlocks*allBandsCount
-    
-    ################################################################
-    # start looping through each band in allBandsCount
-    ################################################################
-
-    for bandNo in range(1,allBandsCount+1):
+            # the inputs are read ahead by a background thread, the blocks are evaluated by the pool (numpy releases
+            # the GIL) and the results are written in order by this thread
+            executor = ThreadPoolExecutor(max_workers=threads)
+            pending = collections.deque()
+            try:
+                for block, data in read_ahead(read, blocks, 2 * threads):
+                    pending.append((block, executor.submit(calc_block, codes, data, myNDV, myOutNDV)))
+                    if len(pending) >= 2 * threads:
+                        block, future = pending.popleft()
+                        write(block[0], block[1], future.result())
+
+                while pending:
+                    block, future = pending.popleft()
+                    write(block[0], block[1], future.result())
+            finally:
+                for block, future in pending:
+                    future.cancel()
+                executor.shutdown()
+
+        print("100 - Done")
+        return list(outfiles)
+
+    finally:
+        # give control back to C++ to free memory (and flush the outputs to disk)
+        myFiles = None
+        myOuts = None
 
-        ################################################################
-        # start looping through blocks of data
-        ################################################################
 
-        # loop through X-lines
-        for X in range(0,nXBlocks):
-
-            # in the rare (impossible?) case that the blocks don't fit perfectly
-            # change the block size of the final piece
-            if X==nXBlocks-1:
-                nXValid = DimensionsCheck[0] - X * myBlockSize[0]
-                myBufSize = nXValid*nYValid
-
-            # find X offset
-            myX=X*myBlockSize[0]
-
-            # reset buffer size for start of Y loop
-            nYValid = myBlockSize[1]
-            myBufSize = nXValid*nYValid
-
-            # loop through Y lines
-            for Y in range(0,nYBlocks):
-                ProgressCt+=1
-                if 10*ProgressCt/ProgressEnd%10!=ProgressMk:
-                    ProgressMk=10*ProgressCt/ProgressEnd%10
-                    from sys import version_info
-                    if version_info >= (3,0,0):
-                        exec('print("%d.." % (10*ProgressMk), end=" ")')
-                    else:
-                        exec('print 10*ProgressMk, "..",')
-
-                # change the block size of the final piece
-                if Y==nYBlocks-1:
-                    nYValid = DimensionsCheck[1] - Y * myBlockSize[1]
-                    myBufSize = nXValid*nYValid
-
-                # find Y offset
-                myY=Y*myBlockSize[1]
-
-                # create empty buffer to mark where nodata occurs
-                myNDVs=numpy.zeros(myBufSize)
-                myNDVs.shape=(nYValid,nXValid)
-
-                # fetch data for each input layer
-                for i,Alpha in enumerate(myAlphaList):
-
-                    # populate lettered arrays with values
-                    if allBandsIndex is not None and allBandsIndex==i:
-                        myBandNo=bandNo
-                    else:
-                        myBandNo=myBands[i]
-                    myval=BandReadAsArray(myFiles[i].GetRasterBand(myBandNo),
-                                          xoff=myX, yoff=myY,
-                                          win_xsize=nXValid, win_ysize=nYValid)
-
-
-                    ####I added this to be sure that the input is not unsigned (that would not allow negative index values)
-                    myval = myval.astype( numpy.float32 , copy=False)
-
-                    # fill in nodata values
-                    myNDVs=1*numpy.logical_or(myNDVs==1, myval==myNDV[i])
-
-                    # create an array of values for this block
-                    exec("%s=myval" %Alpha)
-                    myval=None
-                    #print(eval('Alpha'),end=' ')
-                print()
-                # try the calculation on the array blocks
-                try:
-                    myResult = eval(opts.calc) ; #print(myResult)
-                except:
-                    print("evaluation of calculation %s failed" %(opts.calc))
-                    raise
-                print("**************************************************")
-                print("1*(myNDVs==0)")
-                print(numpy.min(((1*(myNDVs==0)))),numpy.max(((1*(myNDVs==0)))))
-                print("a")
-                print(numpy.min(eval('A')), numpy.max(eval('A')))
-                print("b")
-                print(numpy.min(eval('B')), numpy.max(eval('B')))
-                print("a-b/a+b")
-                print(numpy.min(eval(myResult)),numpy.max(eval(myResult)))
-                print("myOutNDV")
-                print(numpy.min(myOutNDV), numpy.max(myOutNDV))
-                print("myNDVs")
-                print(numpy.min(myNDVs), numpy.max(myNDVs))
-
-                # propogate nodata values 
-                # (set nodata cells to zero then add nodata value to these cells)
-                #myResult = ((1*(myNDVs==0))*myResult) + (myOutNDV*myNDVs)   ####THIS WASN'T WORKING
-                myResult = ((1*(myNDVs==0))*eval(myResult)) + (myOutNDV*myNDVs)
-
-                print('result')
-                print(numpy.min(myResult), numpy.max(myResult))
-
-                # write data block to the output file
-                myOutB=myOut.GetRasterBand(bandNo)
-                BandWriteArray(myOutB, myResult, xoff=myX, yoff=myY)
-
-    print("100 - Done")
-    #print("Finished - Results written to %s" %opts.outF)
-
-    return
+################################################################
+def doit(opts, args):
+    """ run the calculations of the command line options, each --calc is written to the --outfile in the same position
+    """
+
+    inputs = {}
+    bands = {}
+    for myI in AlphaList[0:len(sys.argv)-1]:
+        inputs[myI] = getattr(opts, myI)
+        bands[myI] = getattr(opts, myI + "_band")
+
+    calcs = opts.calc
+    outfiles = opts.outF or ['gdal_calc.tif']
+    if len(outfiles) != len(calcs):
+        print("Error! %d calculations and %d output files, use one --outfile for each --calc" % (len(calcs), len(outfiles)))
+        return
+
+    try:
+        calculate(inputs, calcs, outfiles, bands, opts.type, opts.NoDataValue, opts.allBands, opts.format,
+                  opts.creation_options, opts.overwrite, opts.threads, opts.debug)
+    except ValueError as e:
+        print("Error! %s" % e)
+        return
 
 ################################################################
 def main():
@@ -323,13 +418,13 @@ def main():
     parser = OptionParser(usage)
 
     # define options
-    parser.add_option("--calc", dest="calc", help="calculation in gdalnumeric syntax using +-/* or any numpy array functions (i.e. logical_and())")
+    parser.add_option("--calc", dest="calc", action="append", help="calculation in gdalnumeric syntax using +-/* or any numpy array functions (i.e. logical_and()); repeat --calc and --outfile to compute many outputs with one pass over the inputs")
     # hack to limit the number of input file options close to required number
     for myAlpha in AlphaList[0:len(sys.argv)-1]:
         eval('parser.add_option("-%s", dest="%s", help="input gdal raster file, note you can use any letter A-Z")' %(myAlpha, myAlpha))
         eval('parser.add_option("--%s_band", dest="%s_band", default=0, type=int, help="number of raster band for file %s (default 0)")' %(myAlpha, myAlpha, myAlpha))
 
-    parser.add_option("--outfile", dest="outF", default='gdal_calc.tif', help="output file to generate or fill")
+    parser.add_option("--outfile", dest="outF", action="append", help="output file to generate or fill (default gdal_calc.tif), one for each --calc")
     parser.add_option("--NoDataValue", dest="NoDataValue", type=float, help="set output nodata value (Defaults to datatype specific value)")
     parser.add_option("--type", dest="type", help="output datatype, must be one of %s" % list(DefaultNDVLookup.keys()))
     parser.add_option("--format", dest="format", default="GTiff", help="GDAL format for output file (default 'GTiff')")
@@ -340,6 +435,7 @@ def main():
         "creation options for each format.")
     parser.add_option("--allBands", dest="allBands", default="", help="process all bands of given raster (A-Z)")
     parser.add_option("--overwrite", dest="overwrite", action="store_true", help="overwrite output file if it already exists")
+    parser.add_option("--threads", dest="threads", default=1, type=int, help="number of threads evaluating the blocks, the inputs are read ahead and the outputs written in order (default 1)")
     parser.add_option("--debug", dest="debug", action="store_true", help="print debugging information")
 
     (opts, args) = parser.parse_args()
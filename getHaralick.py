@@ -2,14 +2,32 @@
 # -------------------------------------------------------------------------------
 # Name:        getHaralick.py
 # Purpose:      compute Haralick, advanced and higher order texture features on every pixel in the selected channel
-#                need to have Orfeo toolbox on your system https://www.orfeo-toolbox.org/
+#                need to have Orfeo toolbox on your system https://www.orfeo-toolbox.org/ for engine="otb";
+#                engine="numpy" computes the textures in process with haralickTexture (no Orfeo needed)
+#                the jobs run on a pool of processes, the completed jobs are recorded in a manifest and an
+#                interrupted run can be started again (see run_haralick_jobs)
 #
 # Author:      claudio piccinini
 #
 # -------------------------------------------------------------------------------
 import os
 import sys
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from osgeo import gdal
+
 import utility
+import haralickTexture
+
+
+def otb_params_to_dict(params):
+    """ convert a list of otb parameters to a dictionary {"-parameter name": value}
+    :param params: list of parameters, the first item is the otb executable
+    :return: a dictionary
+    """
+    return {params[k]: params[k + 1] for k in range(1, len(params) - 1, 2)}
 
 
 def compute_haralick(params, debug=False):
@@ -44,6 +62,265 @@ def compute_haralick(params, debug=False):
         print(msg)
     return msg, err
 
+def average_otb_offsets(outdir, channel, texture, xyoff, prefix=""):
+    """ average the Orfeo outputs of the offsets for a channel, the offset images are kept
+    :param outdir: the directory with the Orfeo outputs
+    :param channel: the channel (starts at 1)
+    :param texture: "simple", "advanced" or "higher"
+    :param xyoff: list of (x,y) offsets
+    :param prefix: prefix for the output names
+    :return: the averaged image path
+    """
+
+    inputs = [haralickTexture.haralick_output_name(outdir, channel, texture, offset, prefix) for offset in xyoff]
+    output = haralickTexture.haralick_output_name(outdir, channel, texture, None, prefix)
+    print("averaging haralick offsets for channel " + str(channel))
+    return haralickTexture.average_offsets(inputs, output)
+
+
+################################################################
+# job runner: each (image, channel, texture set) job -- (image, channel, texture set, offset) with the Orfeo
+# toolbox -- runs on a pool of processes; completed jobs are recorded in a manifest and skipped when the
+# outputs are still valid, therefore an interrupted run can be started again
+################################################################
+
+MANIFEST_NAME = "haralick_manifest.json"
+
+# the otb parameters that change the outputs (the image min/max are computed by each job)
+SIGNATURE_PARAMETERS = ["-texture", "-parameters.xrad", "-parameters.yrad", "-parameters.nbbin"]
+
+
+def haralick_tilesize(ram, nbbin=8, minsize=32, maxsize=2048):
+    """ get the haralickTexture tile size for a RAM budget
+    the co-occurrence matrices and the features of a tile take about 40 bytes for each pixel and grey level pair
+    :param ram: RAM budget for a job in MB
+    :param nbbin: number of grey levels
+    :param minsize: minimum tile size
+    :param maxsize: maximum tile size
+    :return: the tile size (columns and rows)
+    """
+    size = int((ram * 2 ** 20 / (40.0 * nbbin * nbbin)) ** 0.5) // 16 * 16
+    return max(minsize, min(maxsize, size))
+
+
+def haralick_jobs(inputimage, outdir, params, xyoff, channels, engine="numpy", prefix="", average=False,
+                  textures=None):
+    """ get the haralick jobs for an image
+    with engine="numpy" all the offsets of a channel are one job (they are computed in one pass), with
+    engine="otb" each offset is a job (but the offsets are one job when average is True)
+
+    :param inputimage: input image path
+    :param outdir: output directory
+    :param params: list of otb parameters (see compute_haralick)
+    :param xyoff: list of (x,y) offsets
+    :param channels: list of channels (starts at 1)
+    :param engine: "numpy" (haralickTexture) or "otb" (Orfeo toolbox)
+    :param prefix: prefix for the output names
+    :param average: output the features averaged over the offsets (rotation invariant)?
+    :param textures: list of texture sets, default is the params -texture
+    :return: a list of job dictionaries
+    """
+
+    p = otb_params_to_dict(params)
+    if textures is None:
+        textures = [p.get("-texture", "simple")]
+
+    # the outputs are computed again when the input image changes
+    stat = os.stat(inputimage)
+
+    jobs = []
+    for channel in channels:
+        for texture in textures:
+            if engine == "numpy" or average:
+                groups = [list(xyoff)]
+            else:
+                groups = [[offset] for offset in xyoff]
+            for offsets in groups:
+                if average:
+                    outputs = [haralickTexture.haralick_output_name(outdir, channel, texture, None, prefix)]
+                else:
+                    outputs = [haralickTexture.haralick_output_name(outdir, channel, texture, offset, prefix)
+                               for offset in offsets]
+                key = inputimage + "|" + str(channel) + "|" + texture + "|" + \
+                    ";".join(str(x) + "," + str(y) for x, y in offsets) + ("|average" if average else "")
+                signature = json.dumps([engine, texture, {k: p.get(k) for k in SIGNATURE_PARAMETERS},
+                                        stat.st_size, stat.st_mtime])
+                jobs.append({"key": key, "signature": signature, "image": inputimage, "channel": channel,
+                             "texture": texture, "offsets": [list(o) for o in offsets], "outputs": outputs,
+                             "outdir": outdir, "prefix": prefix, "engine": engine, "params": list(params),
+                             "average": average})
+    return jobs
+
+
+def run_haralick_job(job, ram=None, debug=False):
+    """ run a haralick job (see haralick_jobs), this is executed by the process pool
+    :param job: job dictionary
+    :param ram: RAM budget for the job in MB (the otb -ram parameter, the tile size with engine="numpy")
+    :param debug: output all the messages?
+    :return: the job outputs
+    """
+
+    p = otb_params_to_dict(job["params"])
+    offsets = [tuple(o) for o in job["offsets"]]
+
+    # get image min and max
+    mn, mx = utility.get_minmax(job["image"], job["channel"])
+
+    if job["engine"] == "numpy":
+        nbbin = int(p.get("-parameters.nbbin", 8))
+        tilesize = haralick_tilesize(ram, nbbin) if ram else 256
+        haralickTexture.haralick_band(job["image"], job["channel"], job["outdir"], offsets, job["texture"],
+                                      int(p.get("-parameters.xrad", 2)), int(p.get("-parameters.yrad", 2)),
+                                      mn, mx, nbbin, tilesize, job["prefix"], job["average"])
+        return job["outputs"]
+
+    params = list(job["params"])
+    params[2] = job["image"]
+    params[4] = str(job["channel"])
+    params[6] = job["texture"]
+    params[8] = str(mn)
+    params[10] = str(mx)
+    if ram:
+        if "-ram" in params:
+            params[params.index("-ram") + 1] = str(ram)
+        else:
+            params += ["-ram", str(ram)]
+
+    for x, y in offsets:
+        newparams = params + ['-parameters.xoff', str(x), '-parameters.yoff', str(y)]
+        newparams[12] = haralickTexture.haralick_output_name(job["outdir"], job["channel"], job["texture"], (x, y),
+                                                             job["prefix"])
+        msg, err = compute_haralick(newparams, debug)
+        if err and err.strip():
+            raise Exception("haralick for " + job["image"] + " channel " + str(job["channel"]) + " offset " +
+                            str((x, y)) + " failed: " + err)
+
+    if job["average"]:
+        average_otb_offsets(job["outdir"], job["channel"], job["texture"], offsets, job["prefix"])
+    return job["outputs"]
+
+
+def raster_size(path):
+    """ get the columns and rows of a raster
+    :param path: raster path
+    :return: (columns, rows)
+    """
+    ds = None
+    try:
+        ds = gdal.Open(path)
+        return ds.RasterXSize, ds.RasterYSize
+    finally:
+        ds = None
+
+
+def valid_output(path, xsize, ysize, nbands):
+    """ check that a haralick output can be opened and has the expected size
+    :param path: raster path
+    :param xsize: expected columns
+    :param ysize: expected rows
+    :param nbands: expected number of bands
+    :return: True or False
+    """
+
+    if not os.path.isfile(path):
+        return False
+    ds = None
+    try:
+        ds = gdal.Open(path)
+        return ds is not None and (ds.RasterXSize, ds.RasterYSize, ds.RasterCount) == (xsize, ysize, nbands)
+    except Exception:
+        return False
+    finally:
+        ds = None
+
+
+def load_manifest(manifest):
+    """ load the manifest of the completed haralick jobs
+    :param manifest: manifest path
+    :return: a dictionary {job key: {"signature":..., "outputs":..., "seconds":...}}
+    """
+    if not os.path.isfile(manifest):
+        return {}
+    try:
+        with open(manifest) as f:
+            return json.load(f)
+    except ValueError:
+        print("the haralick manifest " + manifest + " is not valid, all the jobs will be executed")
+        return {}
+
+
+def save_manifest(manifest, done):
+    """ save the manifest of the completed haralick jobs (the file is replaced, a crash does not corrupt it)
+    :param manifest: manifest path
+    :param done: dictionary {job key: {"signature":..., "outputs":..., "seconds":...}}
+    """
+    with open(manifest + ".tmp", "w") as f:
+        json.dump(done, f, indent=1)
+    os.replace(manifest + ".tmp", manifest)
+
+
+def run_haralick_jobs(jobs, manifest, processes=None, ram=None, debug=False):
+    """ run the haralick jobs on a pool of processes, the jobs completed in a previous run are skipped when their
+    outputs are valid; a failed job does not stop the other jobs
+
+    :param jobs: list of jobs (see haralick_jobs)
+    :param manifest: path of the manifest of the completed jobs
+    :param processes: max number of parallel processes (default is the number of cpus)
+    :param ram: total RAM budget in MB, each running job gets ram/processes
+    :param debug: output all the messages?
+    :return: a list with the failed jobs
+    """
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+    jobram = max(ram // processes, 64) if ram else None
+
+    done = load_manifest(manifest)
+
+    # skip the completed jobs, the outputs of an interrupted job are not in the manifest
+    sizes = {}
+    todo = []
+    for job in jobs:
+        entry = done.get(job["key"])
+        if entry is not None and entry["signature"] == job["signature"]:
+            if job["image"] not in sizes:
+                sizes[job["image"]] = raster_size(job["image"])
+            xsize, ysize = sizes[job["image"]]
+            nbands = len(haralickTexture.TEXTURES[job["texture"]])
+            if all(valid_output(o, xsize, ysize, nbands) for o in job["outputs"]):
+                if debug:
+                    print("skipping haralick job " + job["key"])
+                continue
+        todo.append(job)
+
+    print(str(len(jobs) - len(todo)) + " haralick jobs already completed, " + str(len(todo)) + " to run")
+
+    failed = []
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {}
+        for job in todo:
+            futures[executor.submit(run_haralick_job, job, jobram, debug)] = (job, time.time())
+
+        for future in as_completed(futures):
+            job, start = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                print("haralick job " + job["key"] + " failed")
+                print(e)
+                failed.append(job)
+                continue
+
+            done[job["key"]] = {"signature": job["signature"], "outputs": job["outputs"],
+                                "seconds": round(time.time() - start, 1)}
+            save_manifest(manifest, done)
+            print("haralick job " + job["key"] + " completed")
+
+    if failed:
+        print(str(len(failed)) + " haralick jobs failed, run again to retry them")
+    return failed
+
+
 def scale_image(rootpath, inputimage, exact= True, debug=False):
     """
     :param rootpath:
@@ -84,41 +361,29 @@ def scale_image(rootpath, inputimage, exact= True, debug=False):
     return scaledout
 
 
-def heralick_from_image(input, outdir, params,xyoff,nbands=8, debug = False):
-    """
+def heralick_from_image(input, outdir, params,xyoff,nbands=8, debug = False, engine="numpy", average=False,
+                        processes=None, ram=None):
+    """ compute haralick for the image bands, the jobs run in parallel and the completed jobs are recorded in the
+    outdir manifest (a run that was interrupted can be started again)
     :param input:
     :param outdir:
     :param params:
     :param xyoff:
     :param nbands:
     :param debug:
-    :return:
+    :param engine: "numpy" (haralickTexture) or "otb" (Orfeo toolbox)
+    :param average: output the features averaged over the offsets (rotation invariant)? with engine="otb" the
+                    offset images are averaged after they are computed
+    :param processes: max number of parallel jobs (default is the number of cpus)
+    :param ram: total RAM budget in MB (the otb -ram parameter is ram/processes)
+    :return: a list with the failed jobs
     """
 
-    if not os._exists(outdir):
+    if not os.path.exists(outdir):
         os.mkdir(outdir)
 
-    for i in range(1, nbands + 1):
-        params[4] = str(i)  # set the channel
-
-        # get image min and max
-        min, max = utility.get_minmax(inputimage, i)
-        print(min, max)
-
-        params[8] = str(min)
-        params[10] = str(max)
-
-        # update parameters with the offset angle
-        for x, y in xyoff:
-            newparams = params + ['-parameters.xoff', str(x), '-parameters.yoff', str(y)]
-            newparams[12] = outdir + '/HaralickChannel' + newparams[4] + newparams[6] + 'xoff' + newparams[
-                14] + 'yoff' + newparams[16] + '.tif'  # set output
-            print("computing haralick for " + newparams[2] + "\n" + "channel " + newparams[4] + " wait for a few hours :D ")
-            msg, err = compute_haralick(newparams, debug)
-            if err:
-                if not (err == "\r\n" or err == "\r" or err == "\n"):  # windows, oldmac, unix
-                    print(" some heraick from the image could not be created , script is stopping")
-                    sys.exit(1)
+    jobs = haralick_jobs(input, outdir, params, xyoff, list(range(1, nbands + 1)), engine, average=average)
+    return run_haralick_jobs(jobs, outdir + '/' + MANIFEST_NAME, processes, ram, debug)
 
 
 def scale_ndvi(path,inimgfrmt = ['.tif'], debug = False):
@@ -160,15 +425,22 @@ def scale_ndvi(path,inimgfrmt = ['.tif'], debug = False):
             sys.exit(1)
 
 
-def heralick_NDI(rootpath, ndipath, params, xyoff,  inimgfrmt = ['.tif'], debug=False):
-    """
+def heralick_NDI(rootpath, ndipath, params, xyoff,  inimgfrmt = ['.tif'], debug=False, engine="numpy", average=False,
+                 processes=None, ram=None):
+    """ compute haralick for the NDI images, the jobs of all the images run in parallel and the completed jobs are
+    recorded in the haralick/NDI manifest (a run that was interrupted can be started again)
     :param rootpath:
     :param ndipath:
     :param params:
     :param xyoff:
     :param inimgfrmt:
     :param debug:
-    :return:
+    :param engine: "numpy" (haralickTexture) or "otb" (Orfeo toolbox)
+    :param average: output the features averaged over the offsets (rotation invariant)? with engine="otb" the
+                    offset images are averaged after they are computed
+    :param processes: max number of parallel jobs (default is the number of cpus)
+    :param ram: total RAM budget in MB (the otb -ram parameter is ram/processes)
+    :return: a list with the failed jobs
     """
 
     imgs = os.listdir(ndipath)
@@ -178,41 +450,14 @@ def heralick_NDI(rootpath, ndipath, params, xyoff,  inimgfrmt = ['.tif'], debug=
         os.mkdir(rootpath + "haralick/NDI")
 
     outdir = rootpath + "haralick/NDI"
+    jobs = []
     for i in imgs:
         if os.path.isfile(ndipath + '/' + i) and (os.path.splitext(ndipath + '/' + i)[-1] in inimgfrmt):
-            params[2] = ndipath + '/' + i
-            params[4] = '1'
-
-            # get image min and max
-            min, max = utility.get_minmax(ndipath + '/' + i)
-            print(min, max)
-
-            params[8] = str(min)
-            params[10] = str(max)
+            jobs += haralick_jobs(ndipath + '/' + i, outdir, params, xyoff, [1], engine, prefix=i, average=average)
 
-            # update parameters with the offset angle
-            for x, y in xyoff:
-                newparams = params + ['-parameters.xoff', str(x), '-parameters.yoff', str(y)]
-                newparams[12] = outdir + '/' + i + 'HaralickChannel' + newparams[4] + newparams[6] \
-                                + 'xoff' + newparams[14] + 'yoff' + newparams[16] + '.tif'  # set output
-                print("computing haralick for " + params[2] + "\n" + "channel " + params[4]
-                      + " wait for a few hours :D ")
+    return run_haralick_jobs(jobs, outdir + '/' + MANIFEST_NAME, processes, ram, debug)
 
-                if debug:
-                    import datetime as time
-                    starttime = time.datetime.now()
-
-                msg, err = compute_haralick(newparams, debug)
-                if debug:
-                    endtime = time.datetime.now()
-                    print('elapsed time')
-                    print(endtime - starttime)  # about 2h 25 minutes
-                if err:
-                    if not (err == "\r\n" or err == "\r" or err == "\n"):  # windows, oldmac, unix
-                        print(" some NDI heralick images could not be created , script is stopping")
-                        sys.exit(1)
-
-def workflow(rootpath, inputimage, scaleimage, exactscale, heralickimage,herafolder, scalendi, heralickNDI, heralickimagedict=None, heralickNDIdict = None,herabands=8,debug = False):
+def workflow(rootpath, inputimage, scaleimage, exactscale, heralickimage,herafolder, scalendi, heralickNDI, heralickimagedict=None, heralickNDIdict = None,herabands=8,debug = False, engine="numpy", average=False, processes=None, ram=None):
     """ Execute a complete workflow, starting from the original image
     :param rootpath: root directory where original image and NDI images are located
     :param inputimage: path to the input multiband image
@@ -226,9 +471,15 @@ def workflow(rootpath, inputimage, scaleimage, exactscale, heralickimage,herafol
     :param heralickNDIdict: dictionary with params and xyoff keys
     :param herabands: number of image bands for heralick calculation
     :param debug: complete messages?
-    :return: None
+    :param engine: haralick engine, "numpy" (haralickTexture) or "otb" (Orfeo toolbox)
+    :param average: output the haralick features averaged over the offsets (rotation invariant)?
+    :param processes: max number of parallel haralick jobs (default is the number of cpus)
+    :param ram: total RAM budget for the haralick jobs in MB
+    :return: a list with the failed haralick jobs (see run_haralick_jobs)
     """
 
+    failed = []
+
     ###########SCALING IMAGE######################
 
     if scaleimage:
@@ -237,7 +488,8 @@ def workflow(rootpath, inputimage, scaleimage, exactscale, heralickimage,herafol
     ##################haralick for the multiband image################################
 
     if heralickimage:
-        heralick_from_image(scaledout,herafolder,  heralickimagedict[0], heralickimagedict[1], debug=debug)
+        failed += heralick_from_image(scaledout,herafolder,  heralickimagedict[0], heralickimagedict[1], nbands=herabands, debug=debug,
+                            engine=engine, average=average, processes=processes, ram=ram)
 
     ##############scale pixel values of the NDI images###############################
     if scalendi:  # a "indexes/scaled" directory is created if it does not exist
@@ -251,7 +503,10 @@ def workflow(rootpath, inputimage, scaleimage, exactscale, heralickimage,herafol
             ndipath = rootpath + "indexes"
 
         # a "haralik/NDI" directory is created if it does not exist
-        heralick_NDI(rootpath, ndipath, heralickNDIdict[0], heralickNDIdict[1], debug=debug)
+        failed += heralick_NDI(rootpath, ndipath, heralickNDIdict[0], heralickNDIdict[1], debug=debug, engine=engine,
+                     average=average, processes=processes, ram=ram)
+
+    return failed
 
 
 if __name__ == "__main__":
@@ -285,4 +540,7 @@ if __name__ == "__main__":
     heralickNDIdict[1] = [(0, 1), (1, 1), (1, 0), (1, -1)]
 
 
-    workflow(rootpath, inputimage, scaleimage, True, heralickimage,rootpath + "haralick", scalendi, heralickNDI, heralickimagedict, heralickNDIdict,herabands=8,debug=debug)
\ No newline at end of file
+    failed = workflow(rootpath, inputimage, scaleimage, True, heralickimage,rootpath + "haralick", scalendi, heralickNDI, heralickimagedict, heralickNDIdict,herabands=8,debug=debug)
+    if failed:
+        print(str(len(failed)) + " haralick jobs failed, run the script again to complete them")
+        sys.exit(1)
@@ -2,6 +2,8 @@
 #-------------------------------------------------------------------------------
 # Name:        getNDI.py
 # Purpose:      calculate NDI (A-B)/(A+B) for different band combinations
+#               compute_NDI runs gdal_calc.py for each combination
+#               compute_all_NDI reads each image block once and computes all the combinations in process
 #
 # Author:      claudio piccinini
 #
@@ -10,8 +12,16 @@
 
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from osgeo import gdal
+from osgeo import gdal_array as gdar
+
 import utility
 
+gdal.UseExceptions()  # allow gdal exceptions
+
 def compute_NDI(img,  bands, outdir= None,outname = 'NDI', debug = False):
     """ get the NDV for different band combinations, result is saved in the out dir; file names are like NDI1_2
 
@@ -81,13 +91,159 @@ def compute_NDI(img,  bands, outdir= None,outname = 'NDI', debug = False):
     return ok  #return true or false depending on the result
 
 
-def workflow(rootpath, inputimage, outdir, nbands,debug ):
+def _ndi_windows(band, nbands, ncombinations, memory=64):
+    """ get the windows to process a band; tiled images use the native blocks, striped images
+     use full width strips (a multiple of the native block rows) sized to fit the memory budget
+    :param band: a gdal band
+    :param nbands: number of input bands read for each window
+    :param ncombinations: number of band combinations computed for each window
+    :param memory: memory budget in MB for the arrays of one strip
+    :return: a list of windows (xoff, yoff, xcount, ycount)
+    """
+
+    xsize = band.XSize
+    ysize = band.YSize
+    block_xsize, block_ysize = band.GetBlockSize()
+
+    if block_xsize < xsize:  # tiled
+        windows = []
+        for yoff in range(0, ysize, block_ysize):
+            for xoff in range(0, xsize, block_xsize):
+                windows.append((xoff, yoff, min(block_xsize, xsize - xoff), min(block_ysize, ysize - yoff)))
+        return windows
+
+    # bytes for each pixel of a strip: the input bands plus, for each combination, the float32 A, B, A+B,
+    # NDI and the NDI of the previous strip being written, and the boolean invalid mask
+    itemsize = np.dtype(gdar.GDALTypeCodeToNumericTypeCode(band.DataType)).itemsize
+    pixelbytes = nbands * itemsize + ncombinations * (5 * np.dtype(np.float32).itemsize + 1)
+    maxrows = int(memory * 1024 * 1024 // (xsize * pixelbytes))
+    striprows = max(1, maxrows // block_ysize) * block_ysize
+    return [(0, yoff, xsize, min(striprows, ysize - yoff)) for yoff in range(0, ysize, striprows)]
+
+
+def ndi_block(data, bands, nodata=None, outnodata=3.402823466e+38):
+    """ compute all the NDI (A-B)/(A+B) for a block in one vectorized pass
+    :param data: dictionary {band number: 2d numpy array}
+    :param bands: a list of tuples (bandA, bandB)
+    :param nodata: input nodata value (or None), pixels where A or B are nodata get outnodata
+    :param outnodata: output value for nodata and for A+B == 0
+    :return: a float32 3d numpy array (combinations, rows, columns)
+    """
+
+    a = np.array([data[bandA] for bandA, bandB in bands], dtype=np.float32)
+    b = np.array([data[bandB] for bandA, bandB in bands], dtype=np.float32)
+
+    denominator = a + b
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ndi = (a - b) / denominator
+
+    invalid = np.logical_or(denominator == 0, ~np.isfinite(ndi))
+    if nodata is not None:
+        invalid |= np.logical_or(a == nodata, b == nodata)
+    ndi[invalid] = outnodata
+
+    return ndi
+
+
+def compute_all_NDI(img, bands, outdir=None, outname='NDI', stack=False, outnodata=3.402823466e+38, workers=4,
+                    memory=64, debug=False):
+    """ get the NDI for different band combinations in process; each image block is read once and all the
+    combinations are computed together; the outputs are written by a pool of threads while the next block is read
+
+    :param img: image path
+    :param bands: a list of tuples where each tuple is the band combination (you can use utility.combination_count())
+    :param outdir: the output directory path
+    :param outname: the prefix for the file name (file names are like NDI1_2); with stack=True the output is outname.tif
+    :param stack: save a single multiband raster with one band for each combination (band descriptions are like NDI1_2)?
+    :param outnodata: output nodata value (the gdal_calc default for Float32)
+    :param workers: number of threads writing the outputs
+    :param memory: memory budget in MB for each strip of a striped image (the strip height is derived from the
+                   number of columns, bands and combinations)
+    :param debug: output all messages?
+    :return: list of output paths
+    """
+
+    if outdir:
+        outdir = outdir + "/"
+    else:
+        outdir = ""
+
+    bands = [(int(bandA), int(bandB)) for bandA, bandB in bands]
+    used = sorted(set([bnd for pair in bands for bnd in pair]))
+
+    in_ds = None
+    in_bands = None
+    out_ds = []
+    try:
+        in_ds = gdal.Open(img)
+        in_bands = {i: in_ds.GetRasterBand(i) for i in used}
+        xsize = in_ds.RasterXSize
+        ysize = in_ds.RasterYSize
+        nodata = in_bands[used[0]].GetNoDataValue()
+
+        driver = gdal.GetDriverByName("GTiff")
+        if stack:
+            outputs = [outdir + outname + ".tif"]
+            specs = [(outputs[0], len(bands))]
+        else:
+            outputs = [outdir + outname + str(bandA) + "_" + str(bandB) + ".tif" for bandA, bandB in bands]
+            specs = [(path, 1) for path in outputs]
+
+        for path, nbands in specs:
+            ds = driver.Create(path, xsize, ysize, nbands, gdal.GDT_Float32)
+            ds.SetProjection(in_ds.GetProjection())
+            ds.SetGeoTransform(in_ds.GetGeoTransform())
+            for k in range(nbands):
+                ds.GetRasterBand(k + 1).SetNoDataValue(outnodata)
+                if stack:
+                    ds.GetRasterBand(k + 1).SetDescription(outname + str(bands[k][0]) + "_" + str(bands[k][1]))
+            out_ds.append(ds)
+
+        def write(ds, ndi, x, y):
+            for k in range(ndi.shape[0]):
+                ds.GetRasterBand(k + 1).WriteArray(ndi[k], x, y)
+
+        print('calculating ' + str(len(bands)) + ' NDI for ' + img)
+        pending = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for x, y, cols, rows in _ndi_windows(in_bands[used[0]], len(used), len(bands), memory):
+                if debug:
+                    print("block x,y: %d %d / size cols,rows: %d %d" % (x, y, cols, rows))
+
+                # read each band once
+                data = {i: gdar.BandReadAsArray(in_bands[i], x, y, cols, rows) for i in used}
+                ndi = ndi_block(data, bands, nodata, outnodata)
+
+                # the previous block must be written before writing to the same datasets
+                for future in pending:
+                    future.result()
+
+                if stack:
+                    pending = [executor.submit(write, out_ds[0], ndi, x, y)]
+                else:
+                    pending = [executor.submit(write, ds, ndi[k:k + 1], x, y) for k, ds in enumerate(out_ds)]
+
+            for future in pending:
+                future.result()
+
+        return outputs
+
+    finally:
+        # give control back to C++ to free memory (and flush the outputs to disk)
+        in_bands = None
+        in_ds = None
+        out_ds = None
+
+
+def workflow(rootpath, inputimage, outdir, nbands,debug, inprocess=True, stack=False):
     """
     :param rootpath: directory with input/output
     :param inputimage: image name
     :param outdir: directory name for the output
     :param nbands: number of band combinations
     :param debug: complete messages?
+    :param inprocess: compute all the NDI in process with compute_all_NDI (otherwise use gdal_calc.py)
+    :param stack: with inprocess save a single multiband NDI raster?
     :return: None
     """
 
@@ -102,6 +258,10 @@ def workflow(rootpath, inputimage, outdir, nbands,debug ):
     end = (len(bands[1])/2)
     bands = bands[1][0: int(end)]
 
+    if inprocess:
+        compute_all_NDI(rootpath+inputimage, bands, rootpath+outdir, outname='NDI', stack=stack, debug=debug)
+        return
+
     ok = compute_NDI(rootpath+inputimage, bands, rootpath+outdir, outname='NDI', debug=debug)
     if not ok:
         print(" there were some errors, some NDI images may not have been created , check the output")
@@ -8,29 +8,78 @@
 # Created:     11/09/2015
 #-------------------------------------------------------------------------------
 
+import hashlib
 import math
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 from osgeo import gdal
 from osgeo import ogr
 from osgeo import osr
 from osgeo import gdalconst
-import rasterstats
+from osgeo import gdal_array
 import numpy as np
 import numpy.random
+from numpy.lib import recfunctions
 
+import fileIO
 import utility
 
 ogr.UseExceptions()
 gdal.UseExceptions()
 
 
-def getSinglePixelValues(shapes, inraster, fieldname,rastermask=None, combinations='*', subset=None, returnsubset = False):
+def _single_pixel_output(nbands, combinations, comb_column_names, polygonID, id, values, label, uniqueLabels,
+                         legacy, returnsubset, subset, subsetcollection):
+    """ assemble the getSinglePixelValues() output from the gathered pixels
+    :param nbands: number of raster bands
+    :param combinations: '*', [], None or [(),()] (see getSinglePixelValues())
+    :param comb_column_names: the band combinations used for '*'
+    :param polygonID: 1d array, polygon ID of each pixel
+    :param id: 1d array, unique pixel id
+    :param values: 2d array (pixels, bands)
+    :param label: 1d array, label of each pixel
+    :param uniqueLabels: set with the unique labels
+    :param legacy: return the float64 2d numpy array?
+    :param returnsubset: return the subset datastructure?
+    :param subset: the subset parameter of getSinglePixelValues()
+    :param subsetcollection: the subset datastructure built for an integer subset
+    :return: see getSinglePixelValues()
+    """
+
+    # store the field names
+    columnNames = ["polyID\t", "id\t"]
+    for i in range(nbands):
+        columnNames.append("band" + str(i+1)+"\t")
+    # if we want the normalized indexes we need additional columns to the outputdata
+    if combinations == '*':  #this is when we want all the combinations
+        combinations = comb_column_names
+    elif not combinations:
+        combinations = []
+
+    columnNames += utility.column_names_to_string(combinations)
+    columnNames.append("label")
+
+    # assemble the output and calculate the NDI for the band combinations
+    if combinations:
+        print("calculating NDI for "+str(len(combinations)) + " columns")
+    outdata = _pixel_table(columnNames, polygonID, id, [values], label, combinations, legacy)
+
+    if returnsubset:
+        if type(subset) == int:
+            return (outdata, uniqueLabels, columnNames, subsetcollection)
+        else: #if the subset was already a datasturecture we just return it
+            return (outdata, uniqueLabels, columnNames, subset)
+    return (outdata, uniqueLabels, columnNames)
+
+
+def getSinglePixelValues(shapes, inraster, fieldname,rastermask=None, combinations='*', subset=None, returnsubset = False, singlepass=False, legacy=False):
     """intersect polygons/multipolygons with multiband rasters
         IMPORTANT:
         polygons and raster must have the same coordinate system!!!
         feature falling partially or totally outside the raster will not be considered
         when passing the subset as a dictionary be sure to use the same rastermask options used for the subset source
+        (and the same singlepass option, the two modes can select slightly different pixels on the polygon borders)
 
     :param shapes: polygons/multipolygons shapefile
     :param inraster: multiband raster
@@ -49,7 +98,13 @@ def getSinglePixelValues(shapes, inraster, fieldname,rastermask=None, combinatio
                     - a dictionary { polygonID: numpy.ndarray} where the numpy.ndarray is used to apply fancy index
                     to filter the polygon with ID == polygonID
     :param  returnsubset: bool, if true a subset datastructure { polygonID: numpy.ndarray} is returned
-    :return: 1) a 2d numpy array
+    :param singlepass: bool, if true all the polygons are rasterized at once on the raster grid (burning the polygonID)
+                    and the pixels are gathered with numpy indexing; this is much faster with many polygons
+                    if false each polygon is rasterized separately
+                    note: with singlepass overlapping polygons will assign the shared pixels to the last polygon
+    :param legacy: bool, if true return the float64 2d numpy array, otherwise a compact structured array
+                    (see _pixel_table(), use pixelTableToMatrix() to get the 2d array)
+    :return: 1) a numpy structured array with one field for each column name, or with legacy=True a 2d numpy array
             --if combinations was [] or None: each row contains the polygonID column, the unique id column, the apixel
                    values for each raster band plus a column with the label:
                    the array shape is (numberpixels, nbands + 3)
@@ -95,7 +150,7 @@ def getSinglePixelValues(shapes, inraster, fieldname,rastermask=None, combinatio
     target_ds = None
     outDataSet = None
     outLayer = None
-    outdata = []
+    outdata = None
 
     try:
 
@@ -151,6 +206,19 @@ def getSinglePixelValues(shapes, inraster, fieldname,rastermask=None, combinatio
             pixelmask = gdal.Open(rastermask,gdalconst.GA_ReadOnly)
 
 
+        # the band values keep the raster data type
+        datatype = gdal_array.GDALTypeCodeToNumericTypeCode(raster.GetRasterBand(1).DataType)
+
+        if singlepass:
+            polygonID, id, label, values, subsetcollection = _single_pass_pixel_values(raster, lyr, fieldname, pixelmask, subset)
+            return _single_pixel_output(nbands, combinations, comb_column_names if combinations else None, polygonID,
+                                        id, values, label, uniqueLabels, legacy, returnsubset, subset, subsetcollection)
+
+        # the pixels of each polygon are written in growable buffers, no per polygon temporary tables
+        buffers = {"polyID": np.empty(0, dtype=np.int32), "id": np.empty(0, dtype=np.int64),
+                   "values": np.empty((0, nbands), dtype=datatype), "label": np.empty(0)}
+        used = 0
+
         for feat in lyr:
 
             numfeature +=1
@@ -204,7 +272,7 @@ def getSinglePixelValues(shapes, inraster, fieldname,rastermask=None, combinatio
             ycount = int((ymax - ymin)/pixelWidth)+1
 
             # Create memory target multiband raster
-            target_ds = gdal.GetDriverByName("MEM").Create('', xcount, ycount, nbands, gdalconst.GDT_UInt16)
+            target_ds = gdal.GetDriverByName("MEM").Create('', xcount, ycount, 1, gdalconst.GDT_UInt16)
             target_ds.SetGeoTransform((
                 xmin, pixelWidth, 0,
                 ymax, 0, pixelHeight,
@@ -233,83 +301,53 @@ def getSinglePixelValues(shapes, inraster, fieldname,rastermask=None, combinatio
 
             # Rasterize zone polygon to raster
             # outputraster, list of bands to update, input layer, list of values to burn
-            gdal.RasterizeLayer(target_ds, list(range(1, nbands+1)), outLayer, burn_values=[label]*nbands)
+            gdal.RasterizeLayer(target_ds, [1], outLayer, burn_values=[label])
 
-            # Read rasters as arrays
-            dataraster = raster.ReadAsArray(xoff, yoff, xcount, ycount).astype(np.float)
-            datamask = target_ds.ReadAsArray(0, 0, xcount, ycount).astype(np.float)
+            # Read rasters as arrays, the pixel values keep the raster data type
+            dataraster = raster.ReadAsArray(xoff, yoff, xcount, ycount)
+            if dataraster.ndim == 2:  # single band raster
+                dataraster = dataraster[np.newaxis]
+            datamask = target_ds.ReadAsArray(0, 0, xcount, ycount) > 0
 
             if rastermask: #if we have a mask (e.g trees)
-                pixelmasker = pixelmask.ReadAsArray(xoff, yoff, xcount, ycount).astype(np.float)
-                datamask = datamask * pixelmasker
-
-
-            # extract the data for each band
-            data = []
-            for i in range(nbands):
-                data.append(dataraster[i][datamask[i]>0])
+                pixelmasker = pixelmask.ReadAsArray(xoff, yoff, xcount, ycount)
+                datamask = datamask & (pixelmasker > 0)
 
-            # define label data for this polygon
-            label = (np.zeros(data[0].shape[0]) + label).reshape(data[0].shape[0],1)
-            polygonID = (np.zeros(data[0].shape[0]) + polygonID).reshape(data[0].shape[0],1)
+            # extract the data for all the bands (bands, pixels)
+            data = dataraster[:, datamask]
+            npixels = data.shape[1]
 
-            id = np.arange(idcounter,(data[0].shape[0])+idcounter ).reshape(data[0].shape[0],1) # +1 is there to avoid first polygon different from 0
+            id = np.arange(idcounter, npixels + idcounter) # +1 is there to avoid first polygon different from 0
 
             # update the starting id for the next polygon
-            idcounter += data[0].shape[0]
+            idcounter += npixels
 
-            vstackdata = np.vstack(data).T
-
-            #calculate once indexes for subsetting polygons; we will use this in the next "if combinations"
+            #calculate once indexes for subsetting polygons
             if subset:
                 if type(subset) == int: #if the subset was a percentage we need to define the fancy indexer
-                    subsize = int((polygonID.shape[0]) * subset/100)
-                    idxsubsize = np.array(range(0, polygonID.shape[0]))
+                    subsize = int(npixels * subset/100)
+                    idxsubsize = np.array(range(0, npixels))
                     numpy.random.shuffle(idxsubsize)
                     idxsubsize = idxsubsize[:subsize]
-                    #print(idxsubsize.shape)
 
                     if returnsubset: #if we want to return the subset datastructure we need add a key:value
-                        subsetcollection[int(polygonID[0,0])] = idxsubsize
+                        subsetcollection[int(polygonID)] = idxsubsize
 
                 else: #if the subset was a dictionary we extract the correct fancy indexer by key
-                    #print(int(polygonID[0,0]))
-                    idxsubsize = subset[int(polygonID[0,0])]
-                    #print(idxsubsize)
-
-
-            if combinations:  #  '*'  or [(),(),...]  -> all combinations or specific combinations
-
-                if combinations == '*':  #all band combinations in the output
-                    if subset:
-                        # multi band samples and labels : shape -> num. subsetted pixels * (8 bands+ all number of band combinations + 3)
-                        # use numpy fancy indexing to subset polygons
-                        outdata.append(np.hstack((polygonID[idxsubsize], id[idxsubsize],  np.hstack((vstackdata, np.zeros((vstackdata.shape[0],numberCombinations))))[idxsubsize],label[idxsubsize])))
-
-                    else: #no suset
-                        # multi band samples and labels : shape -> num.pixels * (8 bands+ all number of band combinations + 3)
-                        outdata.append(np.hstack((polygonID, id,  np.hstack((vstackdata, np.zeros((vstackdata.shape[0],numberCombinations)))),label)))
-
-                else:  # specific band combinations
-                    if subset:
-                        # multi band samples and labels : shape -> num. subsetted pixels * (8 bands+ custom band combinations + 3)
-                        # use numpy fancy indexing to subset polygons
-                        outdata.append(np.hstack((polygonID[idxsubsize], id[idxsubsize],  np.hstack((vstackdata, np.zeros((vstackdata.shape[0],len(combinations)))))[idxsubsize],label[idxsubsize])))
-                    else: #no suset
-                        # multi band samples and labels : shape -> num.pixels * (8 bands+ custom band combinations + 3)
-                        outdata.append(np.hstack((polygonID, id,  np.hstack((vstackdata, np.zeros((vstackdata.shape[0],len(combinations))))),label)))
-
-            elif not combinations or combinations is None:  # [] or None  -> no band combinations in the output
-
-                if subset:
-                    # multi band samples and labels : shape -> num. subsetted pixels * (8 bands+3)
-                    # use numpy fancy indexing to subset polygons
-                    outdata.append(np.hstack((polygonID[idxsubsize], id[idxsubsize],  vstackdata[idxsubsize], label[idxsubsize])))
-                else: #no suset
-                    # multi band samples and labels : shape -> num.pixels * (8 bands+3)
-                    outdata.append(np.hstack((polygonID, id,  vstackdata, label)))
+                    idxsubsize = subset[int(polygonID)]
 
+                # use numpy fancy indexing to subset polygons
+                data = data[:, idxsubsize]
+                id = id[idxsubsize]
 
+            # write the polygon pixels directly in the output buffers
+            n = id.shape[0]
+            buffers = _reserve(buffers, used, n)
+            buffers["polyID"][used:used + n] = polygonID
+            buffers["id"][used:used + n] = id
+            buffers["values"][used:used + n] = data.T
+            buffers["label"][used:used + n] = label
+            used += n
 
             # Mask zone of raster
             #zoneraster = np.ma.masked_array(dataraster,  np.logical_not(datamask))
@@ -321,56 +359,15 @@ def getSinglePixelValues(shapes, inraster, fieldname,rastermask=None, combinatio
             outLayer = None
             outDataSet = None
 
-        # id = np.arange(1,(data[0].shape[0])+1).reshape(data[0].shape[0],1)
-
-        # define the output data
-        outdata = np.vstack(outdata)
-
-        # store the field names
-        columnNames = ["polyID\t", "id\t"]
-        for i in range(nbands):
-            columnNames.append("band" + str(i+1)+"\t")
-        # if we want the normalized indexes we need additional columns to the outputdata
-        if combinations == '*':  #this is when we want all the combinations
-
-            columnNames += utility.column_names_to_string(comb_column_names)
+        # the filled part of the output buffers
+        polygonID = buffers["polyID"][:used]
+        id = buffers["id"][:used]
+        values = buffers["values"][:used]
+        label = buffers["label"][:used]
 
-            # calculate the NDI for all the band combinations
-            print("calculating NDI for "+str(numberCombinations) + " columns, it will take some time")
-            for i in comb_column_names:
-                #get column index  ->  i[0]-i[1]/i[0]+i[1]
-
-                #which column we want to update? # the 2 is there because the first 2 columns are the polygonid/id
-                idx = comb_column_names.index(i)+ nbands + 2
-                #calculate index  # the +1 is there because the first two columns are polyid and id
-                outdata[:, idx] = (outdata[:, i[0]+1] - outdata[:, i[1]+1]) / (outdata[:, i[0]+1] + outdata[:, i[1]+1])
-                print(".", end="")
-            print()
-
-        elif all([combinations ,combinations is not None]): # this is when we want specific combinations -> [(),(),...]
-
-            columnNames += utility.column_names_to_string(combinations)
-
-            # calculate the NDI for all the band combinations
-            print("calculating NDI for "+str(len(combinations)) + " columns, it will take some time")
-            for i in combinations:
-                # get column index  ->  i[0]-i[1]/i[0]+i[1]
-
-                # which column we want to update? # the 2 is there because the first 2 columns are the polygonid/id
-                idx = combinations.index(i)+ nbands + 2
-                # calculate index  # the +1 is there because the first two columns are polyid and id
-                outdata[:,idx] = (outdata[:, i[0]+1] - outdata[:, i[1]+1]) / (outdata[:, i[0]+1] + outdata[:, i[1]+1])
-                print(".", end="")
-            print()
-
-        columnNames.append("label")
-
-        if returnsubset:
-            if type(subset) == int:
-                return (outdata, uniqueLabels, columnNames, subsetcollection)
-            else: #if the subset was already a datasturecture we just return it
-                return (outdata, uniqueLabels, columnNames, subset)
-        return (outdata, uniqueLabels, columnNames)
+        return _single_pixel_output(nbands, combinations, comb_column_names if combinations else None, polygonID, id,
+                                    values, label, uniqueLabels, legacy, returnsubset, subset,
+                                    subsetcollection if returnsubset else None)
 
     finally:
 
@@ -710,14 +707,175 @@ def getGeneralSinglePixelValues_filter(shapes, folderpath, fieldname, inimgfrmt
             band = None
 
 
-def getGeneralSinglePixelValues(shapes, folderpath, fieldname, images, rastermask=None, subset=None, returnsubset = False):
+def _polygon_windows(raster, lyr, fieldname, pixelmask=None):
+    """ rasterize each polygon once and get the window plan shared by all the rasters with the same grid
+        feature falling partially or totally outside the raster will not be considered
+
+    :param raster: gdal raster dataset that defines the grid
+    :param lyr: ogr layer with polygons/multipolygons
+    :param fieldname: vector fieldname that contains the labelvalue
+    :param pixelmask: gdal raster dataset where value 0 is the mask (or None)
+    :return: a list of tuples (polygonID, label, (xoff, yoff, xcount, ycount), 2d boolean array with the polygon pixels)
+    """
+
+    sourceSR = lyr.GetSpatialRef()
+    featureCount = lyr.GetFeatureCount()
+
+    # we need to get the raster datatype for later use (assumption:every band has the same data type)
+    raster_data_type = raster.GetRasterBand(1).DataType
+
+    # Get raster georeference info
+    width = raster.RasterXSize
+    height = raster.RasterYSize
+
+    transform = raster.GetGeoTransform()
+    xOrigin = minx = transform[0]
+    yOrigin = maxy = transform[3]
+    miny = transform[3] + width*transform[4] + height*transform[5]
+    maxx = transform[0] + width*transform[1] + height*transform[2]
+    pixelWidth = transform[1]
+    pixelHeight = transform[5]
+
+    raster_srs = osr.SpatialReference()
+    raster_srs.ImportFromWkt(raster.GetProjectionRef())
+
+    drv = ogr.GetDriverByName("ESRI Shapefile")
+    target_ds = None
+    outDataSet = None
+    outLayer = None
+    plan = []
+
+    try:
+        numfeature = 0
+        lyr.ResetReading()
+        for feat in lyr:
+
+            numfeature += 1
+            print("rasterizing feature %d of %d" % (numfeature, featureCount))
+
+            #get the label and the polygon ID
+            label = feat.GetField(fieldname)
+            polygonID = feat.GetFID() + 1  #I add one to avoid the first polygonID==0
+
+            #  Get extent of feature
+            geom = feat.GetGeometryRef()
+            if geom.GetGeometryName() not in ("POLYGON", "MULTIPOLYGON"):
+                raise Exception("ERROR: Geometry needs to be either Polygon or Multipolygon")
+
+            # the extent of the outer rings
+            pointsX = []
+            pointsY = []
+            for geomInner in ([geom] if geom.GetGeometryName() == "POLYGON" else geom):
+                ring = geomInner.GetGeometryRef(0)
+                for p in range(ring.GetPointCount()):
+                    lon, lat, z = ring.GetPoint(p)
+                    pointsX.append(lon)
+                    pointsY.append(lat)
+
+            xmin = min(pointsX)
+            xmax = max(pointsX)
+            ymin = min(pointsY)
+            ymax = max(pointsY)
+
+            #check if this feature is completely inside the raster, if not skip it
+            if any([xmin < minx, xmax > maxx, ymin < miny, ymax > maxy]):
+                print('feature with id = %d is falling outside the raster and will not be considered'%feat.GetFID())
+                continue
+
+            # Specify offset and rows and columns to read
+            xoff = int((xmin - xOrigin)/pixelWidth)
+            yoff = int((yOrigin - ymax)/pixelWidth)
+            xcount = int((xmax - xmin)/pixelWidth)+1
+            ycount = int((ymax - ymin)/pixelWidth)+1
+
+            # Create memory target raster, with the same datatype as the input raster
+            target_ds = gdal.GetDriverByName("MEM").Create("", xcount, ycount, 1, raster_data_type)
+            target_ds.SetGeoTransform((
+                xmin, pixelWidth, 0,
+                ymax, 0, pixelHeight,
+            ))
+            target_ds.SetProjection(raster_srs.ExportToWkt())
+
+            #create in memory vector layer that contains the feature
+            outDataSet = drv.CreateDataSource("/vsimem/memory.shp")
+            outLayer = outDataSet.CreateLayer("memoryshp", srs=sourceSR, geom_type=lyr.GetGeomType())
+            outFeature = ogr.Feature(lyr.GetLayerDefn())
+            outFeature.SetGeometry(geom)
+            outLayer.CreateFeature(outFeature)
+
+            # Rasterize zone polygon to raster
+            gdal.RasterizeLayer(target_ds, [1], outLayer, burn_values=[label])
+            datamask = target_ds.ReadAsArray(0, 0, xcount, ycount).astype(np.float64)
+
+            if pixelmask is not None: #if we have a mask (e.g trees)
+                datamask = datamask * pixelmask.ReadAsArray(xoff, yoff, xcount, ycount).astype(np.float64)
+
+            plan.append((polygonID, label, (xoff, yoff, xcount, ycount), datamask > 0))
+
+            #give control back to c++ to free memory
+            target_ds = None
+            outLayer = None
+            outDataSet = None
+
+        lyr.ResetReading()
+        return plan
+
+    finally:
+
+        #give control back to c++ to free memory
+        if target_ds: target_ds = None
+        if outLayer: outLayer = None
+        if outDataSet:
+            outDataSet = None
+            drv.DeleteDataSource("/vsimem/memory.shp")
+
+
+def _read_windows(inraster, grid, windows, positions):
+    """ read the polygon windows of a raster, the dataset is opened once
+
+    :param inraster: raster path
+    :param grid: the raster grid of the window plan (geotransform, columns, rows)
+    :param windows: list of windows (xoff, yoff, xcount, ycount)
+    :param positions: list of 1d arrays, the flat positions of the selected pixels in each window
+    :return: a 2d numpy array (numberpixels, nbands) with the raster data type
+    """
+
+    raster = None
+    try:
+        raster = gdal.Open(inraster, gdalconst.GA_ReadOnly)
+
+        if (raster.RasterXSize, raster.RasterYSize) != grid[1:] or not np.allclose(raster.GetGeoTransform(), grid[0]):
+            raise ValueError("raster " + inraster + " does not have the same grid of the first raster")
+
+        nbands = raster.RasterCount
+        datatype = gdal_array.GDALTypeCodeToNumericTypeCode(raster.GetRasterBand(1).DataType)
+        out = np.empty((sum([p.shape[0] for p in positions]), nbands), dtype=datatype)
+
+        start = 0
+        for (xoff, yoff, xcount, ycount), pos in zip(windows, positions):
+            data = raster.ReadAsArray(xoff, yoff, xcount, ycount)
+            out[start:start + pos.shape[0]] = data.reshape(nbands, -1)[:, pos].T
+            start += pos.shape[0]
+
+        return out
+
+    finally:
+        #give control back to c++ to free memory
+        if raster: raster = None
+
+
+def getGeneralSinglePixelValues(shapes, folderpath, fieldname, images, rastermask=None, subset=None, returnsubset = False, workers=4, legacy=False):
     """ general function to intersect polygons/multipolygons with a group of multiband rasters
         IMPORTANT
         polygons and raster must have the same coordinate system!!!
+        the rasters must have the same grid (e.g. the haralick outputs of the same image)
         the bands of a raster must have the same data type
         feature falling partially or totally outside the raster will not be considered
         when passing the subset as a dictionary be sure to use the same rastermask options used for the subset source
 
+        each polygon is rasterized once on the grid of the first raster, the resulting window plan is shared by all
+        the rasters; each raster is opened once and its windows are read by a pool of threads
+
     :param shapes: polygons/multipolygons shapefile
     :param folderpath: folder with multiband rasters
     :param fieldname: vector fieldname that contains the labelvalue
@@ -728,7 +886,10 @@ def getGeneralSinglePixelValues(shapes, folderpath, fieldname, images, rastermas
                     - a dictionary { polygonID: numpy.ndarray} where the numpy.ndarray is used to apply fancy index
                     to filter the polygon with ID == polygonID
     :param  returnsubset: bool, if true a subset datastructure { polygonID: numpy.ndarray} is returned
-    :return: 1) a 2d numpy array,
+    :param workers: number of threads reading the rasters
+    :param legacy: bool, if true return the float64 2d numpy array, otherwise a compact structured array
+                    (see _pixel_table(), use pixelTableToMatrix() to get the 2d array)
+    :return: 1) a numpy structured array with one field for each column name, or with legacy=True a 2d numpy array,
                 each row contains the polygonID column, the unique id column, the pixel
                 values for each raster band plus a column with the label:
                 the array shape is (numberpixels, numberofrasters*nbands + 3)
@@ -750,266 +911,95 @@ def getGeneralSinglePixelValues(shapes, folderpath, fieldname, images, rastermas
     elif type(subset) == dict and not type(next(iter(subset.values()))) == np.ndarray:
         raise ValueError('subset should be a dictionary of ndarrays')
 
-
     subsetcollection = {}
 
-
     raster = None
     shp = None
     lyr = None
-    target_ds = None
-    outDataSet = None
-    outLayer = None
-    band = None
     pixelmask = None
-    outdata = []
 
     try:
 
         shp = ogr.Open(shapes)
         lyr = shp.GetLayer()
 
-        sourceSR = lyr.GetSpatialRef()
-
-        # get number of features; get number of bands
-        featureCount = lyr.GetFeatureCount()
-
         # iterate features and extract unique labels
-        classValues = []
-        for feature in lyr:
-            classValues.append(feature.GetField(fieldname))
-        # get the classes unique values
-        uniqueLabels = set(classValues)
+        uniqueLabels = set([feature.GetField(fieldname) for feature in lyr])
         # reset the iterator
         lyr.ResetReading()
-        # get the content of the images directory
-        ########imgs= os.listdir(folderpath)
-
-        imgcounter = 0  #keep track of the image number
-        label = None
-        columnNames = []
-        labels = []  #this will store all the labels
-
-        # iterate all the files and keep only the ones with the correct extension
-        for i in images:
-
-
-            ##### filter content, we want files with the correct extension
-            #####if os.path.isfile(folderpath+'/'+i) and (os.path.splitext(folderpath+'/'+i)[-1] in inimgfrmt) :
-
-            # increase the image counter and open raster data
-            imgcounter += 1
-            raster = gdal.Open(folderpath+'/'+i,gdalconst.GA_ReadOnly)
-            nbands = raster.RasterCount
-
-            # we need to get the raster datatype for later use (assumption:every band has the same data type)
-            band = raster.GetRasterBand(1)
-            raster_data_type = band.DataType
-
-            # Get raster georeference info
-
-            width = raster.RasterXSize
-            height = raster.RasterYSize
-
-            transform = raster.GetGeoTransform()
-            xOrigin = minx = transform[0]
-            yOrigin = maxy =  transform[3]
-            miny = transform[3] + width*transform[4] + height*transform[5]
-            maxx = transform[0] + width*transform[1] + height*transform[2]
-            pixelWidth = transform[1]
-            pixelHeight = transform[5]
-
-            numfeature = 0
-
-            # keep trak of the number of ids, necessary to assign id to subsequent polygons
-            idcounter = 1
-
-            # reset the iterator
-            lyr.ResetReading()
-
-            intermediatedata = []
-
-
-            if rastermask:
-                pixelmask = gdal.Open(rastermask,gdalconst.GA_ReadOnly)
-
-            for feat in lyr:
-
-                numfeature += 1
-                print("working on feature %d of %d, raster %s" % (numfeature, featureCount, i))
-
-                #get the label and the polygon ID
-                label = feat.GetField(fieldname)
-                polygonID = feat.GetFID() + 1  #I add one to avoid the first polygonID==0
-
-                #  Get extent of feature
-                geom = feat.GetGeometryRef()
-                if geom.GetGeometryName() == "MULTIPOLYGON":
-                    count = 0
-                    pointsX = []; pointsY = []
-                    for polygon in geom:
-                        geomInner = geom.GetGeometryRef(count)
-                        ring = geomInner.GetGeometryRef(0)
-                        numpoints = ring.GetPointCount()
-                        for p in range(numpoints):
-                            lon, lat, z = ring.GetPoint(p)
-                            pointsX.append(lon)
-                            pointsY.append(lat)
-                        count += 1
-                elif geom.GetGeometryName() == "POLYGON":
-                    ring = geom.GetGeometryRef(0)
-                    numpoints = ring.GetPointCount()
-                    pointsX = []
-                    pointsY = []
-                    for p in range(numpoints):
-                        lon, lat, z = ring.GetPoint(p)
-                        pointsX.append(lon)
-                        pointsY.append(lat)
-
-                else:
-                    raise Exception("ERROR: Geometry needs to be either Polygon or Multipolygon")
-
-                xmin = min(pointsX)
-                xmax = max(pointsX)
-                ymin = min(pointsY)
-                ymax = max(pointsY)
-
-                #check if this feature is completely inside the raster, if not skip it
-                if any([xmin < minx, xmax > maxx, ymin < miny, ymax > maxy]):
-                    print('feature with id = %d is falling outside the raster and will not be considered'%feat.GetFID())
-                    continue
-
-                # Specify offset and rows and columns to read
-                xoff = int((xmin - xOrigin)/pixelWidth)
-                yoff = int((yOrigin - ymax)/pixelWidth)
-                xcount = int((xmax - xmin)/pixelWidth)+1
-                ycount = int((ymax - ymin)/pixelWidth)+1
-
-                # Create memory target multiband raster, with the same nbands and datatype as the input raster
-                target_ds = gdal.GetDriverByName("MEM").Create("", xcount, ycount, nbands, raster_data_type)
-                target_ds.SetGeoTransform((
-                    xmin, pixelWidth, 0,
-                    ymax, 0, pixelHeight,
-                ))
-
-                # Create for target raster the same projection as for the value raster
-                raster_srs = osr.SpatialReference()
-                raster_srs.ImportFromWkt(raster.GetProjectionRef())
-                target_ds.SetProjection(raster_srs.ExportToWkt())
-
-                #create in memory vector layer that contains the feature
-                drv = ogr.GetDriverByName("ESRI Shapefile")
-                outDataSet = drv.CreateDataSource("/vsimem/memory.shp")
-                outLayer = outDataSet.CreateLayer("memoryshp", srs=sourceSR, geom_type=lyr.GetGeomType())
-
-                # set the output layer's feature definition
-                outLayerDefn = lyr.GetLayerDefn()
-                # create a new feature
-                outFeature = ogr.Feature(outLayerDefn)
-                # set the geometry and attribute
-                outFeature.SetGeometry(geom)
-                # add the feature to the shapefile
-                outLayer.CreateFeature(outFeature)
-
-                # Rasterize zone polygon to raster
-                # outputraster, list of bands to update, input layer, list of values to burn
-                gdal.RasterizeLayer(target_ds, list(range(1,nbands+1)), outLayer, burn_values=[label]*nbands)
-
-                # Read rasters as arrays
-                dataraster = raster.ReadAsArray(xoff, yoff, xcount, ycount).astype(np.float)
-                datamask = target_ds.ReadAsArray(0, 0, xcount, ycount).astype(np.float)
-
-                if rastermask: #if we have a mask (e.g trees)
-                    pixelmasker = pixelmask.ReadAsArray(xoff, yoff, xcount, ycount).astype(np.float)
-                    datamask = datamask * pixelmasker
-
-                #extract the data for each band
-                data = []
-                for j in range(nbands):
-                    data.append(dataraster[j][datamask[j]>0])
-
-                if imgcounter == 1:
-                    #define label data for this polygon
-                    label = (np.zeros(data[0].shape[0]) + label).reshape(data[0].shape[0],1)
-                    polygonIDarray = (np.zeros(data[0].shape[0]) + polygonID).reshape(data[0].shape[0],1)
-                    # fill in the list with all the labels, this will be the last column in the final output
-
-                id = np.arange(idcounter,(data[0].shape[0]) + idcounter).reshape(data[0].shape[0], 1) #+1 is there to avoid first polygon different from 0
-
-                # update the starting id for the next polygon
-                idcounter += data[0].shape[0]
-                vstackdata = np.vstack(data).T
 
+        if rastermask:
+            pixelmask = gdal.Open(rastermask,gdalconst.GA_ReadOnly)
 
-                #if subset we need to define the correct fancy indexing
-                if subset:
+        # the window plan is computed on the grid of the first raster
+        raster = gdal.Open(folderpath+'/'+images[0], gdalconst.GA_ReadOnly)
+        grid = (raster.GetGeoTransform(), raster.RasterXSize, raster.RasterYSize)
+        plan = _polygon_windows(raster, lyr, fieldname, pixelmask)
+        raster = None
 
-                    #if the subset was a percentage we need to define the fancy indexer
-                    #we can get it only for the first image
-                    if type(subset) == int and imgcounter == 1:
-                        subsize = int((polygonIDarray.shape[0]) * subset/100)
-                        idxsubsize = np.array(range(0, polygonIDarray.shape[0]))
-                        numpy.random.shuffle(idxsubsize)
-                        idxsubsize = idxsubsize[:subsize]
-                        #print(idxsubsize.shape)
+        # the selected pixels of each polygon and the polyID, id, label columns
+        windows = []
+        positions = []
+        polygonIDs = []
+        ids = []
+        labels = []
 
-                        #we store the fancy index for this polygon
-                        subsetcollection[int(polygonID)] = idxsubsize
+        # keep trak of the number of ids, necessary to assign id to subsequent polygons
+        idcounter = 1
 
-                    #if this is not the first image we get the correct fancy index from the collection
-                    elif type(subset) == int:
-                        idxsubsize = subsetcollection[int(polygonID)]
+        for polygonID, label, window, polygonmask in plan:
 
-                    else: #if the subset was a dictionary we extract the correct fancy indexer by key
-                        print(int(polygonID))
-                        idxsubsize = subset[int(polygonID)]
-                        #print(idxsubsize)
+            pos = np.flatnonzero(polygonmask)
+            npixels = pos.shape[0]
 
-                    # and we apply the fancy indexing
-                    if imgcounter == 1:
-                        intermediatedata.append(np.hstack((polygonIDarray, id,  vstackdata))[idxsubsize])
-                        labels.append(label[idxsubsize])
-                    else:
-                        intermediatedata.append(vstackdata[idxsubsize])
+            id = np.arange(idcounter, npixels + idcounter) #+1 is there to avoid first polygon different from 0
+            # update the starting id for the next polygon
+            idcounter += npixels
 
-                else: #there is no subset to apply, take all
-                    if imgcounter == 1:
-                        intermediatedata.append(np.hstack((polygonIDarray, id,  vstackdata)))
-                        labels.append(label)
-                    else:
-                        intermediatedata.append(vstackdata)
+            #if subset we need to define the correct fancy indexing
+            if subset:
+                #if the subset was a percentage we need to define the fancy indexer
+                if type(subset) == int:
+                    subsize = int(npixels * subset/100)
+                    idxsubsize = np.array(range(0, npixels))
+                    numpy.random.shuffle(idxsubsize)
+                    idxsubsize = idxsubsize[:subsize]
 
-                # Mask zone of raster
-                #zoneraster = np.ma.masked_array(dataraster,  np.logical_not(datamask))
-                # Calculate statistics of zonal raster
-                #return np.average(zoneraster),np.mean(zoneraster),np.median(zoneraster),np.std(zoneraster),np.var(zoneraster)
+                    #we store the fancy index for this polygon
+                    subsetcollection[int(polygonID)] = idxsubsize
 
-                #give control back to c++ to free memory
-                target_ds = None
-                outLayer = None
-                outDataSet = None
+                else: #if the subset was a dictionary we extract the correct fancy indexer by key
+                    idxsubsize = subset[int(polygonID)]
 
-            #########END for feat in lyr
+                pos = pos[idxsubsize]
+                id = id[idxsubsize]
 
+            windows.append(window)
+            positions.append(pos)
+            polygonIDs.append(np.full(pos.shape[0], polygonID))
+            ids.append(id)
+            labels.append(np.full(pos.shape[0], label))
 
-            #store the field names
-            if imgcounter == 1:
-                columnNames += ["polyID\t","id\t"]
-            for k in range(nbands):
+        # read the windows of each raster, each thread opens its raster once
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_read_windows, folderpath+'/'+i, grid, windows, positions) for i in images]
+            data = []
+            for i, future in zip(images, futures):
+                data.append(future.result())
+                print("read %d windows of raster %s" % (len(windows), i))
+
+        #store the field names
+        columnNames = ["polyID\t","id\t"]
+        for i, values in zip(images, data):
+            for k in range(values.shape[1]):
                 columnNames.append(i + "_b" + str(k+1)+"\t")
-
-            # stack vertically the output of each feature class
-            outdata.append (np.vstack(intermediatedata))
-
-        ########## END for i in imgs
-
-        # stack horizontally
-        outdata = np.hstack(outdata)
-        # finally append the lables at the end
-        outdata = np.hstack((outdata, np.vstack(labels)))
-
         columnNames.append("label")
 
+        # stack horizontally, finally append the lables at the end
+        def column(parts):
+            return np.concatenate(parts) if parts else np.zeros(0)
+        outdata = _pixel_table(columnNames, column(polygonIDs), column(ids), data, column(labels), legacy=legacy)
+
         if returnsubset:
             if type(subset) == int:
                 return (outdata, uniqueLabels, columnNames, subsetcollection)
@@ -1024,31 +1014,25 @@ def getGeneralSinglePixelValues(shapes, folderpath, fieldname, images, rastermas
             raster = None
         if pixelmask:
             pixelmask = None
-        if shp:
-            shp = None
         if lyr:
             lyr = None
-        if target_ds:
-            target_ds = None
-        if outLayer:
-            outLayer = None
-        if outDataSet:
-            outDataSet = None
-        if band:
-            band = None
-
-
+        if shp:
+            shp = None
 
 
-def getMeanPixelValues(shapes, inraster, fieldname, combinations ='*', nodatavalue=None):
+def getMeanPixelValues(shapes, inraster, fieldname, combinations ='*', nodatavalue=None, stats=("mean",)):
     """intersect shapefile with multiband rasters
 
         shapefile and raster must have the same coordinate system!!!
 
-        feature falling partially or totally outside the raster will output nodatavalue for all bands and combinations
+        feature falling totally outside the raster will output nodatavalue for all bands and combinations
+        (feature falling partially outside the raster get the average of the pixels inside the raster)
 
         a nodatavalue == 0 is not allowed because it will crash
 
+        the average values (and the other statistics) are computed with getZonalStatistics(), the polygons are
+        rasterized once for all the bands and statistics
+
     :param shapes: shapefile
     :param inraster: multiband raster
     :param fieldname: vector fieldname that contains the labelvalue
@@ -1063,6 +1047,10 @@ def getMeanPixelValues(shapes, inraster, fieldname, combinations ='*', nodataval
 
     :param nodatavalue: the nodatavalue to assign when polygons falls outside the raster;
                         if None it will get the nodatavalue from the raster
+    :param stats: list of zonal statistics (see getZonalStatistics()), e.g. ["mean", "std", "median", "p10", "p90",
+                        "min", "max", "count"]; the average values are always in the output (the NDI are computed
+                        from the average values), the other statistics are added after the average values with
+                        column names like band1_std
 
     :return: - a 2d numpy array,
                 -if bandcombination was False: each row contains the polygonID column, the unique id column, the average pixel
@@ -1071,6 +1059,7 @@ def getMeanPixelValues(shapes, inraster, fieldname, combinations ='*', nodataval
                 -if bandcombination was True: each row contains the polygonID column, the unique id column, the average pixel
                 values for each raster band, the NDI bands, plus a column with the label:
                    the array shape is (numberfeatures, nbands + number of band combinations +3)
+                -the other statistics are after the average values: |polyID, id, mean bands, stats bands, NDI, label|
             - a set with the labels
             - a list with column names
     """
@@ -1086,7 +1075,7 @@ def getMeanPixelValues(shapes, inraster, fieldname, combinations ='*', nodataval
     if nodatavalue == 0:
         raise  ValueError("a nodatavalue == 0.0 is not allowed")
     dataset = None
-    layer = None
+    band = None
     try:
         # open image
         # import the NDVI raster and get number of bands
@@ -1101,46 +1090,27 @@ def getMeanPixelValues(shapes, inraster, fieldname, combinations ='*', nodataval
             if nodatavalue == 0:
                 raise  ValueError("the raster has a nodatavalue == 0.0, but this is not allowed,"
                                   " please rerun the code with a custom nodatavalue argument")
-        #print(nodatavalue)
 
         print(nbands)
 
         dataset = None # destroy dataset
 
-        # use rasterstat to get the average pixel values
-        # also collect the polygon IDs
-        meanValues = []
-        polygonIDs = []
+        # get the average pixel values (and the other statistics) and the polygon IDs
+        stats = ["mean"] + [stat for stat in stats if stat != "mean"]
+        print("getting %s values for %d bands" % (", ".join(stats), nbands))
+        polygonIDs, classValues, zonal = getZonalStatistics(shapes, inraster, fieldname, stats=stats)
 
         # store the field names
         columnNames = ["polyID\t", "id\t"]
+        for stat in stats:
+            for i in range(nbands):
+                columnNames.append("band" + str(i+1) + ("" if stat == "mean" else "_" + stat) + "\t")
 
-
-        for i in range(nbands):
-            print("getting mean values for band %d" % (i+1))
-            crossing = rasterstats.zonal_stats( shapes, inraster, stats=["mean"], band_num =i+1, geojson_out=True)
-            #print (crossing)
-            meanValues.append([j["properties"]["mean"] for j in crossing ])
-            # we get the polygons ID only once because they are the same for the 8 bands
-            if i == 0:
-                polygonIDs.append([int(j["id"])+1 for j in crossing])
-            columnNames.append("band" + str(i+1) + "\t")
-
-        #print(meanValues)
-
-        #create samples as a numpy array
-
-        #define samples
-        samples = np.array(meanValues).T
-
-        #get rid of the rows with None values(this is where the polygon is outside the raster) and assign nodatavalue
-        #samplesShape = samples.shape
-        #print(samplesShape)
-        #print(len(polygonIDs))
-        mask = (samples == np.array(None))
-        samples[mask] = nodatavalue
-        #samples = samples[mask].reshape(-1,samples.shape[1])
-
+        #define samples, the polygons outside the raster get the nodatavalue
+        samples = zonal["mean"]
+        if nodatavalue is not None:
+            for stat in stats:
+                zonal[stat][np.isnan(zonal[stat])] = nodatavalue
 
         #if we want the band combinations, add columns to the samples
         if combinations: #'*'  or [(),(),...]  -> all combinations or specific combinations
@@ -1160,59 +1130,921 @@ def getMeanPixelValues(shapes, inraster, fieldname, combinations ='*', nodataval
                 numberCombinations = len(combinations)
 
 
-            #add columns to store th normalized indexes
-            samples = np.hstack((samples, np.zeros((samples.shape[0], numberCombinations))))
             #add column names
             columnNames += utility.column_names_to_string(combColumnNames)
-            #calculate the NDI for all the band combinations
+            #calculate the NDI for all the band combinations, nodata and A+B == 0 get nodatavalue
             print("calculating NDI for " + str(numberCombinations) + " columns")
-
-            for i in combColumnNames:
-                #get column index  ->  i[0]-i[1]/i[0]+i[1]
-                #which column we want to update?
-                idx = combColumnNames.index(i)+ nbands
-                #calculate index  # the -1 is there because the numpy array index starts from 0
-                samples[:, idx] = np.where( (samples[:, i[0]-1] - samples[:, i[1]-1]) == 0.0, nodatavalue,(samples[:, i[0]-1] - samples[:, i[1]-1]) / (samples[:, i[0]-1] + samples[:, i[1]-1]))
-                #samples[:, idx] = (samples[:, i[0]-1] - samples[:, i[1]-1]) / (samples[:, i[0]-1] + samples[:, i[1]-1])
-                print(".", end="")
-            print()
+            ndi = utility.normalized_difference(samples, combColumnNames, nodata=nodatavalue,
+                                                zerodenominator=nodatavalue,
+                                                out=np.empty((samples.shape[0], int(numberCombinations))))
+            #add columns to store th normalized indexes
+            samples = np.hstack([samples] + [zonal[stat] for stat in stats[1:]] + [ndi])
+        else:
+            samples = np.hstack([samples] + [zonal[stat] for stat in stats[1:]])
 
         columnNames.append("label")
 
         #define a column with the polygons id
-        polygonIDs = np.array(polygonIDs).T
+        polygonIDs = polygonIDs.reshape(-1, 1).astype(np.float64)
         id = polygonIDs
 
-        #now we define the unique classes
-        dataset = ogr.Open(shapes)
-        layer = dataset.GetLayer()
-
-        count = layer.GetFeatureCount()
+        count = polygonIDs.shape[0]
         print("there are %d shapes" % count)
 
-        #iterate features and extract labels
-        print("getting feature labels...")
-        classValues = []
-        for feature in layer:
-            classValues.append(feature.GetField(fieldname))
-            print(".", end="")
-            print()
-
-        #give control back to c++ to free memory
-        layer = None
-        dataset = None
-
         #get the labels unique values
-        print("filering feature labels...")
         uniqueLabels = set(classValues)
 
         #create classes as a numpy array
         labels = np.array(classValues).reshape(count, 1)
 
-        return (np.hstack((polygonIDs, id, samples, labels.reshape(count,1))), uniqueLabels, columnNames)
+        return (np.hstack((polygonIDs, id, samples, labels)), uniqueLabels, columnNames)
 
     finally:
-        if layer:
-            layer = None
+        if band:
+            band = None
         if dataset:
-            dataset = None
\ No newline at end of file
+            dataset = None
+
+
+################################################################################
+# zonal statistics: the polygons are rasterized once, the statistics of all the bands are accumulated by strips
+
+# the percentiles are "pNN" (e.g. "p10", "p97.5")
+ZONAL_STATISTICS = ("mean", "std", "count", "min", "max", "median")
+
+
+def _zonal_percentile(stat):
+    """ get the percentile of an order statistic
+    :param stat: "median" or "pNN"
+    :return: the percentile (0-100) or None if stat is not an order statistic
+    """
+
+    if stat == "median":
+        return 50.0
+    if stat.startswith("p"):
+        try:
+            q = float(stat[1:])
+        except ValueError:
+            return None
+        if 0 <= q <= 100:
+            return q
+    return None
+
+
+def getZonalStatistics(shapes, inraster, fieldname, stats=("mean",), stripsize=512):
+    """ get the zonal statistics of each polygon for all the raster bands
+        the polygons are rasterized once on the raster grid (burning the polygonID, only the pixels whose center is
+        inside the polygon are considered) and all the statistics are computed in the same pass over the raster:
+        mean, std and count are accumulated with numpy.bincount, min and max with numpy.minimum.at/maximum.at,
+        for median and percentiles the polygon pixels are kept and sorted once by (band, polygon, value)
+        the raster nodata pixels are not considered
+        IMPORTANT:
+        polygons and raster must have the same coordinate system!!!
+        overlapping polygons will assign the shared pixels to the last polygon
+        feature falling totally outside the raster get numpy.nan (0 for count)
+        median and percentiles keep in memory the values of all the polygon pixels
+
+    :param shapes: polygons/multipolygons shapefile
+    :param inraster: multiband raster
+    :param fieldname: vector fieldname that contains the labelvalue
+    :param stats: list of statistics, possible values "mean", "std" (population standard deviation), "count",
+                  "min", "max", "median", "pNN" (percentile NN with linear interpolation, e.g. "p10", "p90")
+    :param stripsize: number of raster rows processed at once
+    :return: 1) a 1d array with the polygonIDs (FID + 1) in the layer order
+             2) a list with the label for each polygon
+             3) a dictionary {statistic: 2d numpy array (numberfeatures, nbands)}
+    """
+
+    for stat in stats:
+        if stat not in ZONAL_STATISTICS and _zonal_percentile(stat) is None:
+            raise ValueError("statistic " + str(stat) + " is not available, use one of " + str(ZONAL_STATISTICS) +
+                             " or a percentile pNN")
+    percentiles = [stat for stat in stats if _zonal_percentile(stat) is not None]
+
+    raster = None
+    shp = None
+    lyr = None
+    drv = ogr.GetDriverByName("ESRI Shapefile")
+    zoneDataSet = None
+    zoneLayer = None
+    target_ds = None
+
+    try:
+        # Open data
+        raster = gdal.Open(inraster, gdalconst.GA_ReadOnly)
+        shp = ogr.Open(shapes)
+        lyr = shp.GetLayer()
+
+        nbands = raster.RasterCount
+        nodata = [raster.GetRasterBand(b+1).GetNoDataValue() for b in range(nbands)]
+
+        # Get raster georeference info
+        width = raster.RasterXSize
+        height = raster.RasterYSize
+
+        transform = raster.GetGeoTransform()
+        xOrigin = transform[0]
+        yOrigin = transform[3]
+        pixelWidth = transform[1]
+        pixelHeight = transform[5]
+
+        # create in memory vector layer that contains the features, the zone field is the polygonID
+        zoneDataSet = drv.CreateDataSource("/vsimem/zonalstats.shp")
+        zoneLayer = zoneDataSet.CreateLayer("zones", srs=lyr.GetSpatialRef(), geom_type=lyr.GetGeomType())
+        zoneLayer.CreateField(ogr.FieldDefn("zone", ogr.OFTInteger))
+        zoneLayerDefn = zoneLayer.GetLayerDefn()
+
+        polygonIDs = []
+        labels = []
+        extent = None  # the extent of all the features
+
+        lyr.ResetReading()
+        for feat in lyr:
+
+            geom = feat.GetGeometryRef()
+            if geom.GetGeometryName() not in ("POLYGON", "MULTIPOLYGON"):
+                raise Exception("ERROR: Geometry needs to be either Polygon or Multipolygon")
+
+            polygonID = feat.GetFID() + 1  # I add one to avoid the first polygonID==0
+            polygonIDs.append(polygonID)
+            labels.append(feat.GetField(fieldname))
+
+            zoneFeature = ogr.Feature(zoneLayerDefn)
+            zoneFeature.SetGeometry(geom)
+            zoneFeature.SetField("zone", polygonID)
+            zoneLayer.CreateFeature(zoneFeature)
+            zoneFeature = None
+
+            xmin, xmax, ymin, ymax = geom.GetEnvelope()
+            if extent is None:
+                extent = [xmin, xmax, ymin, ymax]
+            else:
+                extent = [min(extent[0], xmin), max(extent[1], xmax), min(extent[2], ymin), max(extent[3], ymax)]
+        lyr.ResetReading()
+
+        polygonIDs = np.array(polygonIDs, dtype=np.int64)
+        nzones = int(polygonIDs.max()) + 1 if polygonIDs.shape[0] else 1
+
+        # the accumulators for all the bands, the bincount index is band * nzones + polygonID
+        counts = np.zeros(nbands * nzones)
+        sums = np.zeros(nbands * nzones)
+        sumsq = np.zeros(nbands * nzones)
+        mins = np.full(nbands * nzones, np.inf)
+        maxs = np.full(nbands * nzones, -np.inf)
+        # the values are shifted by a value of each band to compute the variance without loss of precision
+        shift = None
+        # the polygon pixels for the order statistics
+        collectedindex = []
+        collectedvalues = []
+
+        if extent is not None:
+            # the raster window that contains all the features
+            xoff = max(int((extent[0] - xOrigin)/pixelWidth), 0)
+            yoff = max(int((yOrigin - extent[3])/-pixelHeight), 0)
+            xend = min(int(math.ceil((extent[1] - xOrigin)/pixelWidth)) + 1, width)
+            yend = min(int(math.ceil((yOrigin - extent[2])/-pixelHeight)) + 1, height)
+            xcount = xend - xoff
+
+        if extent is not None and xend > xoff and yend > yoff:
+
+            for y0 in range(yoff, yend, stripsize):
+                ycount = min(stripsize, yend - y0)
+                print("zonal statistics for rows %d-%d of %d" % (y0, y0 + ycount, height))
+
+                # Create memory target raster for this strip, aligned to the raster grid
+                target_ds = gdal.GetDriverByName("MEM").Create('', xcount, ycount, 1, gdalconst.GDT_Int32)
+                target_ds.SetGeoTransform((
+                    xOrigin + xoff*pixelWidth, pixelWidth, 0,
+                    yOrigin + y0*pixelHeight, 0, pixelHeight,
+                ))
+                target_ds.SetProjection(raster.GetProjectionRef())
+
+                # rasterize only the features intersecting the strip
+                zoneLayer.SetSpatialFilterRect(xOrigin + xoff*pixelWidth, yOrigin + (y0 + ycount)*pixelHeight,
+                                               xOrigin + xend*pixelWidth, yOrigin + y0*pixelHeight)
+                gdal.RasterizeLayer(target_ds, [1], zoneLayer, options=["ATTRIBUTE=zone"])
+                zone = target_ds.ReadAsArray(0, 0, xcount, ycount)
+                target_ds = None
+
+                r, c = np.nonzero(zone)
+                if r.shape[0] == 0:
+                    continue
+
+                data = raster.ReadAsArray(xoff, y0, xcount, ycount)
+                if data.ndim == 2:  # single band raster
+                    data = data[np.newaxis]
+                values = data[:, r, c].astype(np.float64)
+
+                # the raster nodata pixels are not considered
+                valid = ~np.isnan(values)
+                for b in range(nbands):
+                    if nodata[b] is not None:
+                        valid[b] &= values[b] != nodata[b]
+
+                if shift is None:
+                    shift = np.array([values[b][valid[b]][0] if valid[b].any() else 0.0 for b in range(nbands)])
+
+                index = (np.arange(nbands)[:, np.newaxis] * nzones + zone[r, c])[valid]
+                values = values[valid]
+
+                if "min" in stats:
+                    np.minimum.at(mins, index, values)
+                if "max" in stats:
+                    np.maximum.at(maxs, index, values)
+                if percentiles:
+                    collectedindex.append(index)
+                    collectedvalues.append(values)
+
+                values = values - shift[index // nzones]
+                counts += np.bincount(index, minlength=nbands * nzones)
+                sums += np.bincount(index, weights=values, minlength=nbands * nzones)
+                if "std" in stats:
+                    sumsq += np.bincount(index, weights=values * values, minlength=nbands * nzones)
+
+            zoneLayer.SetSpatialFilter(None)
+
+        if shift is None:
+            shift = np.zeros(nbands)
+
+        out = {}
+
+        # order statistics: sort the values by (band, polygon, value), each (band, polygon) is a segment
+        if percentiles:
+            if collectedindex:
+                index = np.concatenate(collectedindex)
+                values = np.concatenate(collectedvalues)
+                collectedindex = collectedvalues = None
+                order = np.lexsort((values, index))
+                values = values[order]
+                start = np.searchsorted(index[order], np.arange(nbands * nzones))
+            else:
+                values = np.zeros(1)
+                start = np.zeros(nbands * nzones, dtype=np.int64)
+
+            for stat in percentiles:
+                # linear interpolation between the closest ranks (numpy.percentile default)
+                rank = np.maximum(counts - 1, 0) * _zonal_percentile(stat) / 100
+                low = np.floor(rank).astype(np.int64)
+                high = np.ceil(rank).astype(np.int64)
+                lowvalues = values[np.minimum(start + low, values.shape[0] - 1)]
+                highvalues = values[np.minimum(start + high, values.shape[0] - 1)]
+                percentile = lowvalues + (highvalues - lowvalues) * (rank - low)
+                percentile[counts == 0] = np.nan
+                out[stat] = percentile.reshape(nbands, nzones)[:, polygonIDs].T
+
+        if "min" in stats:
+            mins[counts == 0] = np.nan
+            out["min"] = mins.reshape(nbands, nzones)[:, polygonIDs].T
+        if "max" in stats:
+            maxs[counts == 0] = np.nan
+            out["max"] = maxs.reshape(nbands, nzones)[:, polygonIDs].T
+
+        # from (band, zone) to (feature, band)
+        counts = counts.reshape(nbands, nzones)[:, polygonIDs].T
+        sums = sums.reshape(nbands, nzones)[:, polygonIDs].T
+        sumsq = sumsq.reshape(nbands, nzones)[:, polygonIDs].T
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = sums / counts
+            mean[counts == 0] = np.nan
+            if "mean" in stats:
+                out["mean"] = mean + shift
+            if "std" in stats:
+                out["std"] = np.sqrt(np.maximum(sumsq / counts - mean * mean, 0))
+            if "count" in stats:
+                out["count"] = counts
+
+        return polygonIDs, labels, out
+
+    finally:
+
+        #give control back to c++ to free memory
+        if target_ds: target_ds = None
+        if zoneLayer: zoneLayer = None
+        if zoneDataSet:
+            zoneDataSet = None
+            drv.DeleteDataSource("/vsimem/zonalstats.shp")
+        if raster: raster = None
+        if lyr: lyr = None
+        if shp: shp = None
+
+
+def _reserve(buffers, used, needed, minsize=65536):
+    """ grow the output buffers when they can not store other rows, the capacity is doubled to limit the copies
+
+    :param buffers: dictionary {column name: numpy array}, the first dimension is the number of rows
+    :param used: number of rows already filled
+    :param needed: number of rows to add
+    :param minsize: minimum number of rows of the buffers
+    :return: the buffers (new arrays with the filled rows if they were too small)
+    """
+
+    capacity = next(iter(buffers.values())).shape[0]
+    if used + needed <= capacity:
+        return buffers
+
+    capacity = max(used + needed, 2 * capacity, minsize)
+    grown = {}
+    for k, b in buffers.items():
+        grown[k] = np.empty((capacity,) + b.shape[1:], dtype=b.dtype)
+        grown[k][:used] = b[:used]
+    return grown
+
+
+################################################################################
+# output tables: compact structured arrays (native band dtype, int32 ids, small int labels, float32 NDI)
+# or the legacy float64 matrix
+
+
+def _label_dtype(label):
+    """ get the smallest data type for the labels
+    :param label: 1d array with the labels
+    :return: the smallest integer data type if all the labels are integers, otherwise float64
+    """
+
+    label = np.asarray(label)
+    if not np.issubdtype(label.dtype, np.number):
+        return label.dtype
+    if label.shape[0] == 0:
+        return np.dtype(np.int16)
+    if np.all(np.mod(label, 1) == 0):
+        return np.result_type(np.min_scalar_type(int(label.min())), np.min_scalar_type(int(label.max())))
+    return np.dtype(np.float64)
+
+
+def _pixel_table(columnNames, polygonID, id, values, label, combinations=None, legacy=False):
+    """ assemble the extracted pixels and compute the NDI
+
+    :param columnNames: list with all the column names (polyID, id, bands, NDI, label)
+    :param polygonID: 1d array with the polygonID of each pixel
+    :param id: 1d array with the unique id of each pixel
+    :param values: a list of 2d arrays (pixels, bands) with the pixel values, one for each raster
+    :param label: 1d array with the label of each pixel
+    :param combinations: a list of tuples (bandA, bandB) for the NDI (the bands of all the rasters are numbered
+                        in the column order) or None
+    :param legacy: if true return a float64 2d array, otherwise a compact numpy structured array
+    :return: a structured array with one field for each column name (without the tab), the bands keep the raster
+             data type, polyID and id are int32, the NDI are float32 and label the smallest type for the labels;
+             with legacy=True a 2d float64 array (numberpixels, numbercolumns)
+    """
+
+    names = [c.strip() for c in columnNames]
+    combinations = combinations if combinations else []
+    npixels = np.asarray(id).shape[0]
+    nbands = sum([v.shape[1] for v in values])
+
+    if legacy:
+        outdata = np.zeros((npixels, len(names)))
+        outdata[:, 0] = polygonID
+        outdata[:, 1] = id
+        start = 2
+        for v in values:
+            outdata[:, start:start + v.shape[1]] = v
+            start += v.shape[1]
+        outdata[:, -1] = label
+        if combinations:
+            utility.normalized_difference(outdata[:, 2:nbands + 2], combinations,
+                                          out=outdata[:, nbands + 2:nbands + 2 + len(combinations)])
+        return outdata
+
+    dtypes = [np.int32, np.int32]
+    for v in values:
+        dtypes += [v.dtype] * v.shape[1]
+    dtypes += [np.float32] * len(combinations) + [_label_dtype(label)]
+
+    table = np.empty(npixels, dtype=list(zip(names, dtypes)))
+    table[names[0]] = polygonID
+    table[names[1]] = id
+    k = 2
+    for v in values:
+        for b in range(v.shape[1]):
+            table[names[k]] = v[:, b]
+            k += 1
+    if combinations:
+        samples = values[0] if len(values) == 1 else np.hstack(values)
+        ndi = utility.normalized_difference(samples, combinations)
+        for c in range(len(combinations)):
+            table[names[k]] = ndi[:, c]
+            k += 1
+    table[names[-1]] = label
+
+    return table
+
+
+def pixelTableToMatrix(table):
+    """ convert a compact pixel table (structured array) to the legacy float64 2d array
+    :param table: a structured array returned by the pixel extraction functions
+    :return: a 2d float64 numpy array (numberpixels, numbercolumns)
+    """
+
+    if table.dtype.names is None:
+        return np.asarray(table, dtype=np.float64)
+    return recfunctions.structured_to_unstructured(table, dtype=np.float64)
+
+
+################################################################################
+# single pass extraction: all the polygons are rasterized at once on the raster grid
+
+
+def _polygon_pixel_index(raster, lyr, fieldname, pixelmask=None, stripsize=512):
+    """ rasterize all the polygons at once (burning the polygonID) on the raster grid and get the pixel locations
+        the zone raster is created by strips of rows to keep the memory usage low
+        feature falling partially or totally outside the raster will not be considered
+
+    :param raster: gdal raster dataset
+    :param lyr: ogr layer with polygons/multipolygons
+    :param fieldname: vector fieldname that contains the labelvalue
+    :param pixelmask: gdal raster dataset where value 0 is the mask (or None)
+    :param stripsize: number of raster rows rasterized at once
+    :return: a dictionary with
+                "polyID": 1d array with the polygonIDs (FID + 1) in ascending order
+                "label": list with the label for each polygonID
+                "start": 1d array, index of the first pixel of each polygon in "rows" and "cols"
+                "count": 1d array, the number of pixels for each polygon
+                "rows", "cols": 1d arrays with the pixel coordinates sorted by polygon, row, column
+                "zone": 1d array with the polygonID of each pixel, used to check the subset selection
+                        (getPolygonPixelIndex() removes it)
+    """
+
+    width = raster.RasterXSize
+    height = raster.RasterYSize
+
+    transform = raster.GetGeoTransform()
+    xOrigin = minx = transform[0]
+    yOrigin = maxy = transform[3]
+    miny = transform[3] + width*transform[4] + height*transform[5]
+    maxx = transform[0] + width*transform[1] + height*transform[2]
+    pixelWidth = transform[1]
+    pixelHeight = transform[5]
+
+    drv = ogr.GetDriverByName("ESRI Shapefile")
+    zoneDataSet = None
+    zoneLayer = None
+    target_ds = None
+
+    try:
+        # create in memory vector layer that contains the features inside the raster, the zone field is the polygonID
+        zoneDataSet = drv.CreateDataSource("/vsimem/zones.shp")
+        zoneLayer = zoneDataSet.CreateLayer("zones", srs=lyr.GetSpatialRef(), geom_type=lyr.GetGeomType())
+        zoneLayer.CreateField(ogr.FieldDefn("zone", ogr.OFTInteger))
+        zoneLayerDefn = zoneLayer.GetLayerDefn()
+
+        labels = {}
+        extent = None  # the extent of all the features inside the raster
+
+        lyr.ResetReading()
+        for feat in lyr:
+
+            geom = feat.GetGeometryRef()
+            if geom.GetGeometryName() not in ("POLYGON", "MULTIPOLYGON"):
+                raise Exception("ERROR: Geometry needs to be either Polygon or Multipolygon")
+
+            xmin, xmax, ymin, ymax = geom.GetEnvelope()
+
+            #check if this feature is completely inside the raster, if not skip it
+            if any([xmin < minx, xmax > maxx, ymin < miny, ymax > maxy]):
+                print('feature with id = %d is falling outside the raster and will not be considered'%feat.GetFID())
+                continue
+
+            polygonID = feat.GetFID() + 1  # I add one to avoid the first polygonID==0
+            labels[polygonID] = feat.GetField(fieldname)
+
+            zoneFeature = ogr.Feature(zoneLayerDefn)
+            zoneFeature.SetGeometry(geom)
+            zoneFeature.SetField("zone", polygonID)
+            zoneLayer.CreateFeature(zoneFeature)
+            zoneFeature = None
+
+            if extent is None:
+                extent = [xmin, xmax, ymin, ymax]
+            else:
+                extent = [min(extent[0], xmin), max(extent[1], xmax), min(extent[2], ymin), max(extent[3], ymax)]
+        lyr.ResetReading()
+
+        rows = []
+        cols = []
+        zones = []
+
+        if extent is not None:
+
+            # the raster window that contains all the features
+            xoff = max(int((extent[0] - xOrigin)/pixelWidth), 0)
+            yoff = max(int((yOrigin - extent[3])/-pixelHeight), 0)
+            xend = min(int(math.ceil((extent[1] - xOrigin)/pixelWidth)) + 1, width)
+            yend = min(int(math.ceil((yOrigin - extent[2])/-pixelHeight)) + 1, height)
+            xcount = xend - xoff
+
+            for y0 in range(yoff, yend, stripsize):
+                ycount = min(stripsize, yend - y0)
+
+                # Create memory target raster for this strip, aligned to the raster grid
+                target_ds = gdal.GetDriverByName("MEM").Create('', xcount, ycount, 1, gdalconst.GDT_Int32)
+                target_ds.SetGeoTransform((
+                    xOrigin + xoff*pixelWidth, pixelWidth, 0,
+                    yOrigin + y0*pixelHeight, 0, pixelHeight,
+                ))
+                target_ds.SetProjection(raster.GetProjectionRef())
+
+                # rasterize only the features intersecting the strip
+                zoneLayer.SetSpatialFilterRect(xOrigin + xoff*pixelWidth, yOrigin + (y0 + ycount)*pixelHeight,
+                                               xOrigin + xend*pixelWidth, yOrigin + y0*pixelHeight)
+                gdal.RasterizeLayer(target_ds, [1], zoneLayer, options=["ATTRIBUTE=zone"])
+                zone = target_ds.ReadAsArray(0, 0, xcount, ycount)
+
+                if pixelmask is not None: #if we have a mask (e.g trees)
+                    zone[pixelmask.ReadAsArray(xoff, y0, xcount, ycount) <= 0] = 0
+
+                r, c = np.nonzero(zone)
+                rows.append(r + y0)
+                cols.append(c + xoff)
+                zones.append(zone[r, c])
+
+                # give control back to c++ to free memory
+                target_ds = None
+
+            zoneLayer.SetSpatialFilter(None)
+
+        if rows:
+            rows = np.concatenate(rows)
+            cols = np.concatenate(cols)
+            zones = np.concatenate(zones)
+        else:
+            rows = cols = zones = np.zeros(0, dtype=np.int32)
+
+        # sort by polygon, the stable sort keeps the row/column order inside each polygon
+        order = np.argsort(zones, kind="stable")
+        polyIDs, count = np.unique(zones, return_counts=True)
+        # the polygons share the raster rows, the first pixel of each polygon is its offset in the sorted arrays
+        start = np.concatenate(([0], np.cumsum(count)[:-1])).astype(np.int64)
+
+        return {"polyID": polyIDs.astype(np.int32),
+                "label": [labels[int(i)] for i in polyIDs],
+                "start": start,
+                "count": count,
+                "rows": rows[order].astype(np.int32),
+                "cols": cols[order].astype(np.int32),
+                "zone": zones[order].astype(np.int32)}
+
+    finally:
+
+        #give control back to c++ to free memory
+        if target_ds: target_ds = None
+        if zoneLayer: zoneLayer = None
+        if zoneDataSet:
+            zoneDataSet = None
+            drv.DeleteDataSource("/vsimem/zones.shp")
+
+
+def _gather_pixels(raster, rows, cols, stripsize=512):
+    """ read the pixel values for a list of pixel locations, the raster is read by strips of rows
+
+    :param raster: gdal raster dataset
+    :param rows: 1d array with the pixel rows
+    :param cols: 1d array with the pixel columns
+    :param stripsize: number of raster rows read at once
+    :return: a 2d numpy array (numberpixels, nbands) with the raster data type
+    """
+
+    nbands = raster.RasterCount
+    datatype = gdal_array.GDALTypeCodeToNumericTypeCode(raster.GetRasterBand(1).DataType)
+    out = np.empty((rows.shape[0], nbands), dtype=datatype)
+    if rows.shape[0] == 0:
+        return out
+
+    # sort the pixels by row to find the pixels in each strip
+    order = np.argsort(rows, kind="stable")
+    sortedrows = rows[order]
+
+    xoff = int(cols.min())
+    xcount = int(cols.max()) - xoff + 1
+    lastrow = int(sortedrows[-1])
+
+    for y0 in range(int(sortedrows[0]), lastrow + 1, stripsize):
+        ycount = min(stripsize, lastrow + 1 - y0)
+        first, last = np.searchsorted(sortedrows, [y0, y0 + ycount])
+        if first == last:
+            continue
+        idx = order[first:last]
+
+        data = raster.ReadAsArray(xoff, y0, xcount, ycount)
+        if data.ndim == 2:  # single band raster
+            data = data[np.newaxis]
+        out[idx] = data[:, rows[idx] - y0, cols[idx] - xoff].T
+
+    return out
+
+
+def _subset_selection(pixelindex, subset):
+    """ get the fancy indexer to subset the pixels of each polygon
+
+    :param pixelindex: the dictionary returned by _polygon_pixel_index()
+    :param  subset: integer or dictionary
+                    - integer percentage (> 0; <100) deciding how much of each polygon you want to consider
+                    - a dictionary { polygonID: numpy.ndarray} where the numpy.ndarray is used to apply fancy index
+                    to filter the polygon with ID == polygonID
+    :return: a 1d array with the selected pixels, the subset datastructure { polygonID: numpy.ndarray}
+    """
+
+    subsetcollection = {}
+    selection = []
+    sizes = []
+
+    for polygonID, start, count in zip(pixelindex["polyID"], pixelindex["start"], pixelindex["count"]):
+
+        if type(subset) == int: #if the subset was a percentage we need to define the fancy indexer
+            subsize = int(count * subset/100)
+            idxsubsize = numpy.random.permutation(count)[:subsize]
+            subsetcollection[int(polygonID)] = idxsubsize
+
+        else: #if the subset was a dictionary we extract the correct fancy indexer by key
+            idxsubsize = subset[int(polygonID)]
+
+        if len(idxsubsize) and (np.min(idxsubsize) < 0 or np.max(idxsubsize) >= count):
+            raise ValueError('the subset for polygon %d is outside its %d pixels' % (polygonID, count))
+        selection.append(idxsubsize + start)
+        sizes.append(len(idxsubsize))
+
+    if selection:
+        selection = np.concatenate(selection)
+    else:
+        selection = np.zeros(0, dtype=np.int64)
+
+    # every selected pixel must belong to the polygon it is attributed to
+    zones = pixelindex.get("zone")
+    if zones is None:
+        zones = np.repeat(pixelindex["polyID"], pixelindex["count"])
+    if not np.array_equal(zones[selection], np.repeat(pixelindex["polyID"], sizes)):
+        raise Exception("the pixel index is not valid, the subset selects pixels of other polygons")
+
+    if type(subset) == int:
+        return selection, subsetcollection
+    return selection, subset
+
+
+def _single_pass_pixel_values(raster, lyr, fieldname, pixelmask, subset):
+    """ single pass version of the getSinglePixelValues() feature loop
+
+    :param raster: gdal raster dataset
+    :param lyr: ogr layer with polygons/multipolygons
+    :param fieldname: vector fieldname that contains the labelvalue
+    :param pixelmask: gdal raster dataset where value 0 is the mask (or None)
+    :param subset: integer, dictionary or None (see getSinglePixelValues())
+    :return: the polyID, id, label 1d arrays, the 2d array with the band values (raster data type),
+             the subset datastructure (None if there is no subset)
+    """
+
+    pixelindex = _polygon_pixel_index(raster, lyr, fieldname, pixelmask)
+    values = _gather_pixels(raster, pixelindex["rows"], pixelindex["cols"])
+
+    # the unique id is the pixel position in the full (not subsetted) output
+    polygonID = np.repeat(pixelindex["polyID"], pixelindex["count"])
+    label = np.repeat(np.asarray(pixelindex["label"]), pixelindex["count"])
+    id = np.arange(1, values.shape[0] + 1)
+
+    subsetcollection = None
+    if subset:
+        selection, subsetcollection = _subset_selection(pixelindex, subset)
+        polygonID = polygonID[selection]
+        label = label[selection]
+        id = id[selection]
+        values = values[selection]
+
+    return polygonID, id, label, values, subsetcollection
+
+
+################################################################################
+# pixel index: the polygons are rasterized once, the pixel locations are reused to sample any aligned raster
+
+
+# change this when the pixel index content changes, the cached indexes will be computed again
+PIXEL_INDEX_VERSION = 2
+
+
+def _pixel_index_key(shapes, raster, fieldname, rastermask=None, subset=None, blocksize=2**23):
+    """ get the cache key of a pixel index; the key changes when the shapefile content, the raster grid
+    (geotransform, size, projection), the mask file or the subset change
+
+    :param shapes: polygons/multipolygons shapefile
+    :param raster: gdal raster dataset that defines the pixel grid
+    :param fieldname: vector fieldname that contains the labelvalue
+    :param rastermask: raster where value 0 is the mask (the path, size and modification time are used)
+    :param subset: integer, dictionary or None (see getPolygonPixelIndex())
+    :param blocksize: bytes read at once when hashing the shapefile
+    :return: the hexadecimal sha1 key
+    """
+
+    h = hashlib.sha1()
+    h.update(repr((PIXEL_INDEX_VERSION, fieldname)).encode())
+
+    # the shapefile content (all the files that define the geometries and the attributes)
+    base = os.path.splitext(shapes)[0]
+    for ext in ('.shp', '.shx', '.dbf', '.prj', '.cpg'):
+        if os.path.exists(base + ext):
+            h.update(ext.encode())
+            with open(base + ext, 'rb') as f:
+                for block in iter(lambda: f.read(blocksize), b''):
+                    h.update(block)
+
+    # the raster grid
+    h.update(repr((tuple(raster.GetGeoTransform()), raster.RasterXSize, raster.RasterYSize)).encode())
+    h.update(raster.GetProjectionRef().encode())
+
+    if rastermask:
+        stat = os.stat(rastermask)
+        h.update(repr((os.path.abspath(rastermask), stat.st_size, stat.st_mtime)).encode())
+
+    if type(subset) == dict:
+        for polygonID in sorted(subset):
+            h.update(repr(polygonID).encode())
+            h.update(np.ascontiguousarray(subset[polygonID]).tobytes())
+    else:
+        h.update(repr(subset).encode())
+
+    return h.hexdigest()
+
+
+def getPolygonPixelIndex(shapes, inraster, fieldname, rastermask=None, subset=None, cachedir=None):
+    """ get the pixel locations of each polygon on the raster grid (respecting the mask and the subset),
+        the index can be saved with fileIO.save_object() and passed to samplePixelIndex() to sample any raster
+        aligned with inraster without rasterizing the polygons again
+        IMPORTANT:
+        polygons and raster must have the same coordinate system!!!
+        feature falling partially or totally outside the raster will not be considered
+        the pixels are selected as in getSinglePixelValues(singlepass=True)
+
+    :param shapes: polygons/multipolygons shapefile
+    :param inraster: raster that defines the pixel grid
+    :param fieldname: vector fieldname that contains the labelvalue
+    :param rastermask: raster where value 0 is the mask
+    :param  subset: integer or dictionary
+                    - integer percentage (> 0; <100) deciding how much of each polygon you want to consider
+                    - a dictionary { polygonID: numpy.ndarray} where the numpy.ndarray is used to apply fancy index
+                    to filter the polygon with ID == polygonID
+    :param cachedir: folder where the pixel indexes are cached (None for no cache); the index is loaded from the cache
+                    if the shapefile content, the raster grid, the mask and the subset did not change
+                    note: with a percentage subset the cached random subset is reused
+    :return: a dictionary with
+                "polyID", "label", "start", "count", "rows", "cols": the polygon pixel locations
+                    (see _polygon_pixel_index())
+                "selection": 1d array with the positions of the subsetted pixels in "rows" and "cols"
+                    (None if there is no subset)
+                "subset": the subset datastructure { polygonID: numpy.ndarray} (None if there is no subset)
+                "uniqueLabels": a set with the unique labels
+                "geotransform", "size": the raster grid (geotransform, (columns, rows))
+    """
+
+    if all([type(subset) != int, type(subset) != dict, subset is not None]):
+        raise TypeError('subset should be an integer, a dictionary, or None')
+    elif type(subset) == int and not(0 < subset < 100):
+        raise ValueError('subset should be more than 0 and less than 100 ')
+    elif type(subset) == dict and not subset:
+        raise ValueError('subset dictionary should not be empty')
+
+    raster = None
+    pixelmask = None
+    shp = None
+    lyr = None
+
+    try:
+        # Open data
+        raster = gdal.Open(inraster, gdalconst.GA_ReadOnly)
+
+        cachefile = None
+        if cachedir:
+            cachefile = os.path.join(cachedir, _pixel_index_key(shapes, raster, fieldname, rastermask, subset) + '.pkl')
+            if os.path.exists(cachefile):
+                print("loading the pixel index from " + cachefile)
+                return fileIO.load_object(cachefile)
+
+        shp = ogr.Open(shapes)
+        lyr = shp.GetLayer()
+        if rastermask:
+            pixelmask = gdal.Open(rastermask, gdalconst.GA_ReadOnly)
+
+        # get the classes unique values
+        uniqueLabels = set([feature.GetField(fieldname) for feature in lyr])
+        lyr.ResetReading()
+
+        pixelindex = _polygon_pixel_index(raster, lyr, fieldname, pixelmask)
+
+        pixelindex["selection"] = None
+        pixelindex["subset"] = None
+        if subset:
+            pixelindex["selection"], pixelindex["subset"] = _subset_selection(pixelindex, subset)
+        # the zones are used only to check the selection, they are not saved
+        pixelindex.pop("zone", None)
+
+        pixelindex["uniqueLabels"] = uniqueLabels
+        pixelindex["geotransform"] = tuple(raster.GetGeoTransform())
+        pixelindex["size"] = (raster.RasterXSize, raster.RasterYSize)
+
+        print("%d pixels in %d polygons" % (pixelindex["rows"].shape[0], pixelindex["polyID"].shape[0]))
+
+        if cachefile:
+            # write to a temporary file and rename, a concurrent reader never sees an incomplete index
+            os.makedirs(cachedir, exist_ok=True)
+            fileIO.save_object(cachefile + '.' + str(os.getpid()) + '.tmp', pixelindex)
+            os.replace(cachefile + '.' + str(os.getpid()) + '.tmp', cachefile)
+
+        return pixelindex
+
+    finally:
+
+        #give control back to c++ to free memory
+        if raster: raster = None
+        if pixelmask: pixelmask = None
+        if lyr: lyr = None
+        if shp: shp = None
+
+
+def samplePixelIndex(pixelindex, rasters, prefixes=None, combinations=None, subset=True, legacy=False):
+    """ read the pixel values of the polygons from rasters aligned with the raster used to build the pixel index,
+        only the image strips with polygon pixels are read
+
+    :param pixelindex: the dictionary returned by getPolygonPixelIndex()
+    :param rasters: a list of raster paths, each raster must have the same grid of the pixel index raster
+    :param prefixes: a list with the column name prefix for each raster, the column names are prefix + band number
+                    if None the prefix is "band" for a single raster (as in getSinglePixelValues()) and
+                    "rastername_b" for many rasters (as in getGeneralSinglePixelValues())
+    :param combinations: possible values '*', [], None, [(),()] (see getSinglePixelValues())
+                    the NDI are computed for the bands of the first raster, this is possible only with a single raster
+    :param subset: bool, if true only the subsetted pixels are sampled
+    :param legacy: bool, if true return the float64 2d numpy array, otherwise a compact structured array
+                    (see _pixel_table(), use pixelTableToMatrix() to get the 2d array)
+    :return: 1) a numpy structured array (or with legacy=True a 2d numpy array), each row contains the polygonID
+                column, the unique id column, the pixel values for each raster band, the NDI bands, plus a column
+                with the label
+            2) a set with the unique labels
+            3) a list with column names
+    """
+
+    if all([combinations != '*', type(combinations) != list, combinations is not None]):
+        raise TypeError("combinations should be '*' or [] or None or [(),()] ")
+    elif type(combinations) == list and len(combinations) > 0:
+        if type(combinations[0]) != tuple:
+            raise TypeError("combinations format should be [(),(),...] ")
+    if combinations and len(rasters) != 1:
+        raise ValueError("the band combinations are possible only with a single raster")
+
+    if prefixes is None:
+        if len(rasters) == 1:
+            prefixes = ["band"]
+        else:
+            prefixes = [os.path.basename(r) + "_b" for r in rasters]
+    if len(prefixes) != len(rasters):
+        raise ValueError("there should be a prefix for each raster")
+
+    rows = pixelindex["rows"]
+    cols = pixelindex["cols"]
+
+    # the unique id is the pixel position in the full (not subsetted) output
+    polygonID = np.repeat(pixelindex["polyID"], pixelindex["count"])
+    label = np.repeat(np.asarray(pixelindex["label"]), pixelindex["count"])
+    id = np.arange(1, rows.shape[0] + 1)
+
+    if subset and pixelindex["selection"] is not None:
+        selection = pixelindex["selection"]
+        rows = rows[selection]
+        cols = cols[selection]
+        polygonID = polygonID[selection]
+        label = label[selection]
+        id = id[selection]
+
+    values = []
+    columnNames = ["polyID\t", "id\t"]
+
+    for inraster, prefix in zip(rasters, prefixes):
+        raster = None
+        try:
+            raster = gdal.Open(inraster, gdalconst.GA_ReadOnly)
+
+            if (raster.RasterXSize, raster.RasterYSize) != tuple(pixelindex["size"]) or \
+                    not np.allclose(raster.GetGeoTransform(), pixelindex["geotransform"]):
+                raise ValueError("raster " + inraster + " is not aligned with the pixel index grid")
+
+            print("sampling %d pixels from %s" % (rows.shape[0], inraster))
+            values.append(_gather_pixels(raster, rows, cols))
+            columnNames += [prefix + str(k+1) + "\t" for k in range(raster.RasterCount)]
+
+        finally:
+            #give control back to c++ to free memory
+            if raster: raster = None
+
+    nbands = sum([v.shape[1] for v in values])
+
+    # the NDI columns
+    if combinations == '*':
+        numberCombinations, comb_column_names = utility.combination_count(nbands)
+        # the pixel value of ndi A/B is just the inverse of ndi B/A; therefore we get only the first half of the combinations
+        combinations = comb_column_names[0: int(numberCombinations/2)]
+    elif not combinations:
+        combinations = []
+
+    columnNames += utility.column_names_to_string(combinations)
+    columnNames.append("label")
+
+    if combinations:
+        print("calculating NDI for "+str(len(combinations)) + " columns")
+    outdata = _pixel_table(columnNames, polygonID, id, values, label, combinations, legacy)
+
+    return outdata, pixelindex["uniqueLabels"], columnNames
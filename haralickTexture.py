@@ -0,0 +1,498 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------------------
+# Name:        haralickTexture.py
+# Purpose:      compute Haralick (simple), advanced and higher order texture features on every pixel
+#               of a raster band with numpy (no Orfeo toolbox needed)
+#                    - quantize a band
+#                    - grey level co-occurrence matrices for a sliding window (all the offsets in one pass)
+#                    - grey level run length matrices for a sliding window
+#                    - simple, advanced and higher order features
+#                    - optionally the features averaged over the offsets (rotation invariant)
+#                    - tiled processing of a raster band
+#
+#               the texture sets follow the Orfeo HaralickTextureExtraction application:
+#               simple:   energy, entropy, correlation, inverse difference moment, inertia, cluster shade,
+#                         cluster prominence, haralick correlation
+#               advanced: mean, variance, dissimilarity, sum average, sum variance, sum entropy,
+#                         difference of entropies, difference of variances, IC1, IC2
+#               higher:   short run emphasis, long run emphasis, grey level nonuniformity, run length nonuniformity,
+#                         low grey level run emphasis, high grey level run emphasis, short run low grey level emphasis,
+#                         short run high grey level emphasis, long run low grey level emphasis,
+#                         long run high grey level emphasis
+#
+#               the co-occurrence matrices are symmetric (each pair is counted in both directions)
+#               pixels outside [min, max] or equal to nodata are ignored
+#
+# Author:      claudio piccinini
+#
+# -------------------------------------------------------------------------------
+
+import numpy as np
+from osgeo import gdal
+from osgeo import gdal_array as gdar
+
+gdal.UseExceptions()  # allow gdal exceptions
+
+# names of the output bands for each texture set
+TEXTURES = {
+    "simple": ["energy", "entropy", "correlation", "idm", "inertia", "clustershade", "clusterprominence",
+               "haralickcorrelation"],
+    "advanced": ["mean", "variance", "dissimilarity", "sumaverage", "sumvariance", "sumentropy",
+                 "differenceentropy", "differencevariance", "ic1", "ic2"],
+    "higher": ["sre", "lre", "gln", "rln", "lgre", "hgre", "srlge", "srhge", "lrlge", "lrhge"]
+}
+
+# the default offsets (x, y) -> (0, 45, 90, 135 degrees)
+OFFSETS = [(0, 1), (1, 1), (1, 0), (1, -1)]
+
+
+def quantize(data, vmin, vmax, nbbin=8, nodata=None):
+    """ quantize pixel values into nbbin grey levels
+    :param data: numpy array
+    :param vmin: image minimum
+    :param vmax: image maximum
+    :param nbbin: number of grey levels
+    :param nodata: pixel no data value (or None)
+    :return: an int16 array with the grey levels (0 to nbbin-1), pixels to ignore are -1
+    """
+
+    data = np.asarray(data, dtype=np.float64)
+
+    if vmax > vmin:
+        q = np.floor((data - vmin) / (vmax - vmin) * nbbin)
+    else:
+        q = np.zeros(data.shape)
+    q = np.clip(q, 0, nbbin - 1)
+
+    # ignore the pixels outside the range and the nodata
+    ignore = np.logical_or(data < vmin, data > vmax)
+    ignore |= np.isnan(data)
+    if nodata is not None:
+        ignore |= (data == nodata)
+    q[ignore] = -1
+
+    return q.astype(np.int16)
+
+
+def _shift(a, dx, dy, fill=-1):
+    """ shift a 2d array, out[y, x] = a[y + dy, x + dx]
+    :param a: 2d array
+    :param dx: column offset
+    :param dy: row offset
+    :param fill: value for the positions falling outside the array
+    :return: the shifted array
+    """
+
+    out = np.full(a.shape, fill, dtype=a.dtype)
+    rows, cols = a.shape
+    if abs(dy) >= rows or abs(dx) >= cols:
+        return out
+    out[max(0, -dy):rows - max(0, dy), max(0, -dx):cols - max(0, dx)] = \
+        a[max(0, dy):rows - max(0, -dy), max(0, dx):cols - max(0, -dx)]
+    return out
+
+
+def _box_sum(onehot, rows, cols, r0, r1, c0, c1):
+    """ sliding window sums with integral images
+
+    for each output pixel (i, j) sum the input over rows [i + r0, i + r1] and columns [j + c0, j + c1]
+
+    :param onehot: 3d array (cells, padded rows, padded columns)
+    :param rows: output rows
+    :param cols: output columns
+    :param r0, r1, c0, c1: window limits relative to the output pixel (in padded coordinates)
+    :return: 3d array (cells, rows, cols)
+    """
+
+    if r1 < r0 or c1 < c0:  # the offset is larger than the window
+        return np.zeros((onehot.shape[0], rows, cols), dtype=np.int32)
+
+    integral = np.zeros((onehot.shape[0], onehot.shape[1] + 1, onehot.shape[2] + 1), dtype=np.int32)
+    np.cumsum(onehot, axis=1, dtype=np.int32, out=integral[:, 1:, 1:])
+    np.cumsum(integral[:, 1:, 1:], axis=2, out=integral[:, 1:, 1:])
+
+    return (integral[:, r1 + 1:r1 + 1 + rows, c1 + 1:c1 + 1 + cols]
+            - integral[:, r0:r0 + rows, c1 + 1:c1 + 1 + cols]
+            - integral[:, r1 + 1:r1 + 1 + rows, c0:c0 + cols]
+            + integral[:, r0:r0 + rows, c0:c0 + cols])
+
+
+def cooccurrence(qp, offset, xrad, yrad, nbbin):
+    """ symmetric grey level co-occurrence matrices for a sliding window
+
+    the window is centered on each pixel, a pair (p, p + offset) is counted when both pixels are inside the window
+
+    :param qp: quantized 2d array padded with xrad columns and yrad rows on each side (padding is -1)
+    :param offset: (x, y) offset, x is the column offset, y the row offset
+    :param xrad: window radius along the columns
+    :param yrad: window radius along the rows
+    :param nbbin: number of grey levels
+    :return: a 4d array (nbbin, nbbin, rows, cols) with the pair counts
+    """
+
+    dx, dy = offset
+    rows = qp.shape[0] - 2 * yrad
+    cols = qp.shape[1] - 2 * xrad
+
+    # code each pair (p, p + offset) as a single number, -1 if a pixel is ignored
+    second = _shift(qp, dx, dy)
+    code = qp.astype(np.int32) * nbbin + second
+    code[np.logical_or(qp < 0, second < 0)] = -1
+
+    # count each pair code inside the window
+    onehot = (code[np.newaxis] == np.arange(nbbin * nbbin, dtype=np.int32)[:, np.newaxis, np.newaxis])
+    counts = _box_sum(onehot, rows, cols,
+                      max(0, -dy), 2 * yrad - max(0, dy),
+                      max(0, -dx), 2 * xrad - max(0, dx))
+
+    counts = counts.reshape(nbbin, nbbin, rows, cols)
+    return counts + counts.transpose(1, 0, 2, 3)
+
+
+def _entropy(p, axis):
+    """ entropy (log2) of a probability array along the axes """
+    return -np.sum(np.where(p > 0, p * np.log2(np.where(p > 0, p, 1)), 0), axis=axis)
+
+
+def _safe_divide(a, b):
+    """ a / b, 0 where b == 0 """
+    return np.where(b != 0, a / np.where(b != 0, b, 1), 0)
+
+
+def glcm_features(counts, texture="simple"):
+    """ compute simple or advanced texture features from the co-occurrence matrices
+    :param counts: 4d array (nbbin, nbbin, rows, cols) with the pair counts
+    :param texture: "simple" or "advanced"
+    :return: 3d float32 array (features, rows, cols), see TEXTURES for the feature order
+    """
+
+    nbbin = counts.shape[0]
+    total = counts.sum(axis=(0, 1))
+    p = _safe_divide(counts.astype(np.float64), total)
+
+    i = np.arange(nbbin, dtype=np.float64).reshape(nbbin, 1, 1, 1)
+    j = i.reshape(1, nbbin, 1, 1)
+
+    # marginal distribution (the matrices are symmetric, px == py)
+    px = p.sum(axis=1)
+    mean = np.sum(i[:, 0] * px, axis=0)
+    variance = np.sum((i[:, 0] - mean) ** 2 * px, axis=0)
+    entropy = _entropy(p, (0, 1))
+
+    if texture == "simple":
+        features = [
+            np.sum(p ** 2, axis=(0, 1)),                                       # energy
+            entropy,                                                           # entropy
+            _safe_divide(np.sum((i - mean) * (j - mean) * p, axis=(0, 1)), variance),  # correlation
+            np.sum(p / (1 + (i - j) ** 2), axis=(0, 1)),                       # inverse difference moment
+            np.sum((i - j) ** 2 * p, axis=(0, 1)),                             # inertia
+            np.sum(((i - mean) + (j - mean)) ** 3 * p, axis=(0, 1)),           # cluster shade
+            np.sum(((i - mean) + (j - mean)) ** 4 * p, axis=(0, 1)),           # cluster prominence
+            _safe_divide(np.sum(i * j * p, axis=(0, 1)) - mean ** 2, variance)  # haralick correlation
+        ]
+
+    elif texture == "advanced":
+        flat = p.reshape(nbbin * nbbin, -1)
+        ii = np.repeat(np.arange(nbbin), nbbin)
+        jj = np.tile(np.arange(nbbin), nbbin)
+
+        # sum and difference distributions p(x+y), p(|x-y|)
+        psum = np.zeros((2 * nbbin - 1, flat.shape[1]))
+        np.add.at(psum, ii + jj, flat)
+        pdiff = np.zeros((nbbin, flat.shape[1]))
+        np.add.at(pdiff, np.abs(ii - jj), flat)
+        psum = psum.reshape((2 * nbbin - 1,) + p.shape[2:])
+        pdiff = pdiff.reshape((nbbin,) + p.shape[2:])
+
+        k = np.arange(2 * nbbin - 1, dtype=np.float64).reshape(-1, 1, 1)
+        sumaverage = np.sum(k * psum, axis=0)
+        d = np.arange(nbbin, dtype=np.float64).reshape(-1, 1, 1)
+        diffmean = np.sum(d * pdiff, axis=0)
+
+        # information measures of correlation
+        hx = _entropy(px, 0)
+        pxpy = px[:, np.newaxis] * px[np.newaxis, :]
+        logpxpy = np.log2(np.where(pxpy > 0, pxpy, 1))
+        hxy1 = -np.sum(p * logpxpy, axis=(0, 1))
+        hxy2 = -np.sum(pxpy * logpxpy, axis=(0, 1))
+
+        features = [
+            mean,                                                             # mean
+            variance,                                                         # variance
+            np.sum(np.abs(i - j) * p, axis=(0, 1)),                           # dissimilarity
+            sumaverage,                                                       # sum average
+            np.sum((k - sumaverage) ** 2 * psum, axis=0),                     # sum variance
+            _entropy(psum, 0),                                                # sum entropy
+            _entropy(pdiff, 0),                                               # difference of entropies
+            np.sum((d - diffmean) ** 2 * pdiff, axis=0),                      # difference of variances
+            _safe_divide(entropy - hxy1, hx),                                 # IC1
+            np.sqrt(np.clip(1 - np.exp(-2 * (hxy2 - entropy)), 0, None))      # IC2
+        ]
+
+    else:
+        raise ValueError("texture should be 'simple' or 'advanced'")
+
+    return np.array(features, dtype=np.float32)
+
+
+def run_length(qp, offset, xrad, yrad, nbbin):
+    """ grey level run length matrices for a sliding window
+
+    runs are followed along the offset direction and they are cut at the window border
+
+    :param qp: quantized 2d array padded with xrad columns and yrad rows on each side (padding is -1)
+    :param offset: (x, y) offset, only the direction is used
+    :param xrad: window radius along the columns
+    :param yrad: window radius along the rows
+    :param nbbin: number of grey levels
+    :return: a 4d array (nbbin, maxrun, rows, cols) with the run counts
+    """
+
+    dx, dy = int(np.sign(offset[0])), int(np.sign(offset[1]))
+    rows = qp.shape[0] - 2 * yrad
+    cols = qp.shape[1] - 2 * xrad
+
+    # the longest possible run inside the window
+    if dx and dy:
+        maxrun = min(2 * xrad + 1, 2 * yrad + 1)
+    elif dx:
+        maxrun = 2 * xrad + 1
+    else:
+        maxrun = 2 * yrad + 1
+
+    # length of the run starting at each pixel (not cut by the window)
+    length = (qp >= 0).astype(np.int16)
+    same = qp >= 0
+    for k in range(1, maxrun):
+        same &= (_shift(qp, k * dx, k * dy) == qp)
+        length += same
+
+    # a run starts where the previous pixel along the direction is different
+    differentprevious = (_shift(qp, -dx, -dy) != qp)
+
+    counts = np.zeros((nbbin * maxrun, rows * cols), dtype=np.int32)
+    pixel = np.arange(rows * cols)
+
+    # iterate the window positions; each output pixel gets one value for each position
+    for u in range(-yrad, yrad + 1):
+        for v in range(-xrad, xrad + 1):
+            window = (slice(yrad + u, yrad + u + rows), slice(xrad + v, xrad + v + cols))
+            grey = qp[window].ravel()
+
+            # is the previous pixel outside the window?
+            if abs(u - dy) > yrad or abs(v - dx) > xrad:
+                start = grey >= 0
+            else:
+                start = np.logical_and(grey >= 0, differentprevious[window].ravel())
+
+            # steps before leaving the window
+            steps = 1
+            while steps < maxrun and abs(u + steps * dy) <= yrad and abs(v + steps * dx) <= xrad:
+                steps += 1
+
+            runs = np.minimum(length[window].ravel(), steps)
+            code = grey * maxrun + runs - 1
+            counts[code[start], pixel[start]] += 1
+
+    return counts.reshape(nbbin, maxrun, rows, cols)
+
+
+def run_length_features(counts):
+    """ compute the higher order texture features from the run length matrices
+    :param counts: 4d array (nbbin, maxrun, rows, cols) with the run counts
+    :return: 3d float32 array (features, rows, cols), see TEXTURES for the feature order
+    """
+
+    nbbin, maxrun = counts.shape[:2]
+    r = counts.astype(np.float64)
+    nruns = r.sum(axis=(0, 1))
+
+    i2 = (np.arange(1, nbbin + 1, dtype=np.float64) ** 2).reshape(nbbin, 1, 1, 1)  # grey level squared
+    j2 = (np.arange(1, maxrun + 1, dtype=np.float64) ** 2).reshape(1, maxrun, 1, 1)  # run length squared
+
+    features = [
+        np.sum(r / j2, axis=(0, 1)),                   # short run emphasis
+        np.sum(r * j2, axis=(0, 1)),                   # long run emphasis
+        np.sum(r.sum(axis=1) ** 2, axis=0),            # grey level nonuniformity
+        np.sum(r.sum(axis=0) ** 2, axis=0),            # run length nonuniformity
+        np.sum(r / i2, axis=(0, 1)),                   # low grey level run emphasis
+        np.sum(r * i2, axis=(0, 1)),                   # high grey level run emphasis
+        np.sum(r / (i2 * j2), axis=(0, 1)),            # short run low grey level emphasis
+        np.sum(r * i2 / j2, axis=(0, 1)),              # short run high grey level emphasis
+        np.sum(r * j2 / i2, axis=(0, 1)),              # long run low grey level emphasis
+        np.sum(r * i2 * j2, axis=(0, 1))               # long run high grey level emphasis
+    ]
+
+    return np.array([_safe_divide(f, nruns) for f in features], dtype=np.float32)
+
+
+def texture_features(qp, offsets, texture="simple", xrad=2, yrad=2, nbbin=8, average=False):
+    """ compute the texture features for all the offsets on the same quantized array
+    :param qp: quantized 2d array padded with xrad columns and yrad rows on each side (padding is -1)
+    :param offsets: list of (x, y) offsets
+    :param texture: "simple", "advanced" or "higher"
+    :param xrad: window radius along the columns
+    :param yrad: window radius along the rows
+    :param nbbin: number of grey levels
+    :param average: average the features over the offsets (rotation invariant features)?
+    :return: a list of 3d float32 arrays (features, rows, cols), one for each offset or only one if average is True
+    """
+
+    if texture not in TEXTURES:
+        raise ValueError("texture should be one of " + str(list(TEXTURES.keys())))
+
+    out = []
+    for offset in offsets:
+        if texture == "higher":
+            features = run_length_features(run_length(qp, offset, xrad, yrad, nbbin))
+        else:
+            features = glcm_features(cooccurrence(qp, offset, xrad, yrad, nbbin), texture)
+
+        # keep a running sum, the features for each offset are not stored
+        if average and out:
+            out[0] += features
+        else:
+            out.append(features)
+
+    if average:
+        out[0] /= len(offsets)
+    return out
+
+
+def haralick_output_name(outdir, channel, texture, offset, prefix=""):
+    """ the output path for a channel/texture/offset, same names used with the Orfeo toolbox
+    :param outdir: output directory
+    :param channel: band number (starts at 1)
+    :param texture: "simple", "advanced" or "higher"
+    :param offset: (x, y) offset, None for the features averaged over the offsets
+    :param prefix: prefix for the file name
+    :return: the output path
+    """
+    if offset is None:
+        return outdir + '/' + prefix + 'HaralickChannel' + str(channel) + texture + 'average.tif'
+    return outdir + '/' + prefix + 'HaralickChannel' + str(channel) + texture + 'xoff' + str(offset[0]) + \
+        'yoff' + str(offset[1]) + '.tif'
+
+
+def haralick_band(inraster, channel, outdir, offsets=OFFSETS, texture="simple", xrad=2, yrad=2, vmin=None,
+                  vmax=None, nbbin=8, tilesize=256, prefix="", average=False):
+    """ compute the texture features for a raster band and save one multiband raster for each offset
+    (or one raster with the features averaged over the offsets)
+
+    the band is read by tiles (plus the window border), each tile is quantized once and used for all the offsets
+
+    :param inraster: input raster path
+    :param channel: band number (starts at 1)
+    :param outdir: output directory
+    :param offsets: list of (x, y) offsets
+    :param texture: "simple", "advanced" or "higher"
+    :param xrad: window radius along the columns
+    :param yrad: window radius along the rows
+    :param vmin: image minimum, if None it is computed from the band
+    :param vmax: image maximum, if None it is computed from the band
+    :param nbbin: number of grey levels
+    :param tilesize: tile size (columns and rows)
+    :param prefix: prefix for the output file names
+    :param average: save only the features averaged over the offsets (rotation invariant)?
+    :return: a list with the output paths
+    """
+
+    if texture not in TEXTURES:
+        raise ValueError("texture should be one of " + str(list(TEXTURES.keys())))
+
+    in_ds = None
+    band = None
+    outputs = []
+    out_ds = []
+    try:
+        in_ds = gdal.Open(inraster)
+        band = in_ds.GetRasterBand(channel)
+        xsize = band.XSize
+        ysize = band.YSize
+        nodata = band.GetNoDataValue()
+
+        if vmin is None or vmax is None:
+            mn, mx = band.ComputeRasterMinMax(False)
+            vmin = mn if vmin is None else vmin
+            vmax = mx if vmax is None else vmax
+
+        # one float32 output for each offset, one band for each feature
+        nfeatures = len(TEXTURES[texture])
+        driver = gdal.GetDriverByName("GTiff")
+        for offset in ([None] if average else offsets):
+            outname = haralick_output_name(outdir, channel, texture, offset, prefix)
+            ds = driver.Create(outname, xsize, ysize, nfeatures, gdal.GDT_Float32)
+            ds.SetProjection(in_ds.GetProjection())
+            ds.SetGeoTransform(in_ds.GetGeoTransform())
+            outputs.append(outname)
+            out_ds.append(ds)
+
+        for y in range(0, ysize, tilesize):
+            rows = min(tilesize, ysize - y)
+            for x in range(0, xsize, tilesize):
+                cols = min(tilesize, xsize - x)
+
+                # read the tile plus the window border, the border outside the image is ignored (-1)
+                x0, x1 = max(x - xrad, 0), min(x + cols + xrad, xsize)
+                y0, y1 = max(y - yrad, 0), min(y + rows + yrad, ysize)
+                data = gdar.BandReadAsArray(band, x0, y0, x1 - x0, y1 - y0)
+
+                qp = np.full((rows + 2 * yrad, cols + 2 * xrad), -1, dtype=np.int16)
+                qp[y0 - (y - yrad):y1 - (y - yrad), x0 - (x - xrad):x1 - (x - xrad)] = \
+                    quantize(data, vmin, vmax, nbbin, nodata)
+
+                for ds, features in zip(out_ds, texture_features(qp, offsets, texture, xrad, yrad, nbbin, average)):
+                    for k in range(nfeatures):
+                        ds.GetRasterBand(k + 1).WriteArray(features[k], x, y)
+
+        return outputs
+
+    finally:
+        # give control back to C++ to free memory (and flush the outputs to disk)
+        band = None
+        in_ds = None
+        out_ds = None
+
+
+def average_offsets(inrasters, outraster, tilesize=256):
+    """ average the texture features of many offsets, the inputs are the rasters of haralick_band() or of the
+    Orfeo toolbox for the same channel and texture (same size and number of bands)
+
+    :param inrasters: list of input raster paths, one for each offset
+    :param outraster: output raster path
+    :param tilesize: tile size (columns and rows)
+    :return: the output path
+    """
+
+    in_ds = []
+    out_ds = None
+    try:
+        in_ds = [gdal.Open(i) for i in inrasters]
+        xsize = in_ds[0].RasterXSize
+        ysize = in_ds[0].RasterYSize
+        nbands = in_ds[0].RasterCount
+        for ds in in_ds[1:]:
+            if (ds.RasterXSize, ds.RasterYSize, ds.RasterCount) != (xsize, ysize, nbands):
+                raise ValueError("the texture rasters to average should have the same size and number of bands")
+
+        out_ds = gdal.GetDriverByName("GTiff").Create(outraster, xsize, ysize, nbands, gdal.GDT_Float32)
+        out_ds.SetProjection(in_ds[0].GetProjection())
+        out_ds.SetGeoTransform(in_ds[0].GetGeoTransform())
+
+        for k in range(1, nbands + 1):
+            bands = [ds.GetRasterBand(k) for ds in in_ds]
+            for y in range(0, ysize, tilesize):
+                rows = min(tilesize, ysize - y)
+                for x in range(0, xsize, tilesize):
+                    cols = min(tilesize, xsize - x)
+                    total = np.zeros((rows, cols), dtype=np.float64)
+                    for band in bands:
+                        total += gdar.BandReadAsArray(band, x, y, cols, rows)
+                    out_ds.GetRasterBand(k).WriteArray((total / len(bands)).astype(np.float32), x, y)
+
+        return outraster
+
+    finally:
+        # give control back to C++ to free memory (and flush the output to disk)
+        in_ds = None
+        out_ds = None
@@ -36,6 +36,7 @@ setng['working_directory'] = working_directory = xxx["working_directory"]
 # mean=False to get all the multiband pixel values inside polygons
 setng['MEAN'] = MEAN = xxx["mean"]
 setng['nodatavalue'] = nodatavalue = eval(xxx["nodatavalue"])
+setng['mean_statistics'] = mean_statistics = xxx["mean_statistics"]
 
 band_combinations = xxx["band_combinations"]
 if band_combinations != '*':
@@ -43,6 +44,7 @@ if band_combinations != '*':
 setng['band_combinations'] = band_combinations
 setng['pixel_subset'] = pixel_subset = xxx["pixel_subset"]
 setng['NDI_chart_combinations'] = NDI_chart_combinations = eval(xxx["NDI_chart_combinations"])
+setng['pixel_index_cache'] = pixel_index_cache = xxx["pixel_index_cache"]
 
 #this is not necessary anymore because the haralick paths are in the json file now
 #setng['hara_dir'] = hara_dir = xxx["hara_dir"]
@@ -54,6 +56,12 @@ setng['NDI_chart_combinations'] = NDI_chart_combinations = eval(xxx["NDI_chart_c
 
 setng['skll_dir'] = skll_dir = xxx["skll_dir"]
 setng['boruta_dir'] = boruta_dir = xxx["boruta_dir"]
+# the extracted data is always saved as binary feature tables (.npy + .json) in the skll folder;
+# do we also want the text files for skll/boruta?
+setng['skll_text'] = skll_text = xxx["skll_text"]
+setng['boruta_text'] = boruta_text = xxx["boruta_text"]
+# number of processes formatting each text file
+setng['text_workers'] = text_workers = xxx["text_workers"]
 
 # shapefile field that contains the classes
 setng['fieldname'] = fieldname = xxx["field_name"]
@@ -71,6 +79,8 @@ setng['tilesize'] = tilesize =xxx["tile_size"]
 setng['parallelize'] = parallelize = xxx["parallelize"]
 setng['engine_messages'] = engine_messages = xxx["engine_messages"]
 setng["max_processes"] = max_processes = xxx["max_processes"]
+setng["parallel_mode"] = parallel_mode = xxx["parallel_mode"]
+setng["task_retries"] = task_retries = xxx["task_retries"]
 
 paths = settings.parse_json()
 
@@ -101,104 +111,402 @@ import time
 #########################
 
 
-def preparedata(imagetag):
+def table_path(imagetag, n, tag):
+    """ get the path (without extension) of the feature table that stores an extracted table
+    :param imagetag: the image key in paths
+    :param n: the content entry index
+    :param tag: the table name
+    :return: the file path
+    """
+    return skll_dir + "/" + paths[imagetag]['name'] + "/" + str(n) + "_" + tag
+
+
+def extract_mean(imagetag, n):
+    """ get the average pixel values (and the other mean_statistics) for a content entry (shape, raster, mask) of an image
+    the table is saved with fileIO.save_table(), the other processes memory map it with fileIO.load_table()
+    :param imagetag: the image key in paths
+    :param n: the content entry index
+    :return: the table path (without extension)
+    """
 
     import os
     import numpy as np
     import getPixelValues
+    import fileIO
+
+    d = paths[imagetag]
+    comb = d['content'][n]
+
+    #first we go to the directory that stores the images
+    os.chdir(d['basepath'])
 
+    data, uniqueLabels, columnNames = getPixelValues.getMeanPixelValues(comb['shape'], comb['raster'], fieldname, nodatavalue=nodatavalue, combinations=band_combinations, stats=mean_statistics)
+
+    os.makedirs(skll_dir+"/"+d['name'], exist_ok=True)
+
+    return fileIO.save_table(table_path(imagetag, n, 'dataMean'), data.astype(np.float64), columnNames)
+
+
+def export_mean(imagetag, n, table, workers=1):
+    """ output the average pixel values to the skll folder (if skll_text is True)
+    :param imagetag: the image key in paths
+    :param n: the content entry index
+    :param table: the table path returned by extract_mean()
+    :param workers: processes formatting the text, more than 1 only in the main process (the scheduler processes
+                    would start a pool each)
+    :return: True
+    """
+
+    import os
+    import fileIO
 
     d = paths[imagetag]
+    os.chdir(d['basepath'])
 
-    ####return(d['content'][0]['shape'], d['content'][0]['raster'], fieldname,d['content'][0]['mask'],band_combinations,pixel_subset)
+    # output data to skll folder, we don't export the polygonID
+    if skll_text:
+        fileIO.export_table_view(table, skll_dir+"/"+d['name'] + "/" + str(n)+ "_dataMeanComb.tsv", list(range(1, len(fileIO.load_table(table)[1]))), fmt="%.4f", delimiter="\t", workers=workers)
 
-    ##os.chdir(working_directory)
+    return True
 
-    # prepare supervised data and output it to the skll folder
-    if MEAN:
-        #first we go to the directory that stores the images
-        os.chdir(d['basepath'])
 
-        #for the same image we can have different shapes and masks
-        for n, comb in enumerate(d['content']):
+def extract_pixels(imagetag, n):
+    """ get the pixel values for a content entry (shape, raster, mask) of an image
+    the polygons are rasterized once, the pixel index is saved with fileIO.save_object() and reused to sample the
+    haralick images and the NDI chart (see getPixelValues.getPolygonPixelIndex())
+    the table is saved with fileIO.save_table(), the other processes memory map it with fileIO.load_table()
+    :param imagetag: the image key in paths
+    :param n: the content entry index
+    :return: the pixel index path (this is used to get the haralick and NDI chart values), the table path (without extension)
+    """
 
-            data, uniqueLabels, columnNames = getPixelValues.getMeanPixelValues(comb['shape'], comb['raster'], fieldname, nodatavalue=nodatavalue, combinations=band_combinations)
-            # output data to skll folder, we don't export the polygonID
+    import os
+    import getPixelValues
+    import fileIO
 
-            if not os.path.exists(skll_dir+"/"+d['name']):
-                os.mkdir(skll_dir+"/"+d['name'])
+    d = paths[imagetag]
+    comb = d['content'][n]
 
-            np.savetxt(skll_dir+"/"+d['name'] + "/" + str(n)+ "_dataMeanComb.tsv", data[:, 1:], fmt="%.4f", delimiter="\t", header="".join(columnNames[1:]),comments="")
+    #first we go to the directory that stores the images
+    os.chdir(d['basepath'])
 
-        return True
+    # the pixel index of the previous runs is reused if the shape, raster grid, mask and subset did not change
+    cachedir = skll_dir + "/" + d['name'] + "/pixelIndexCache" if pixel_index_cache else None
+    pixelindex = getPixelValues.getPolygonPixelIndex(comb['shape'], comb['raster'], fieldname, rastermask=comb['mask'], subset=pixel_subset, cachedir=cachedir)
 
-    else:
+    os.makedirs(skll_dir+"/"+d['name'], exist_ok=True)
+    indexpath = table_path(imagetag, n, 'pixelIndex') + '.pkl'
+    fileIO.save_object(indexpath, pixelindex)
+
+    data, uniqueLabels, columnNames = getPixelValues.samplePixelIndex(pixelindex, [comb['raster']], combinations=band_combinations)
+
+    return indexpath, fileIO.save_table(table_path(imagetag, n, 'dataPixels'), data, columnNames)
+
+
+def export_pixels(imagetag, n, table, workers=1):
+    """ output the pixel values as text views of the feature table to the skll folder (if skll_text is True)
+    and to the boruta folder (if boruta_text is True)
+    :param imagetag: the image key in paths
+    :param n: the content entry index
+    :param table: the table path returned by extract_pixels()
+    :param workers: processes formatting the text, more than 1 only in the main process (the scheduler processes
+                    would start a pool each)
+    :return: True
+    """
+
+    import os
+    import fileIO
+
+    d = paths[imagetag]
+    os.chdir(d['basepath'])
+    ncols = len(fileIO.load_table(table)[1])
+
+    if skll_text:
+        #output data to skll, we don't export the polygonID   |rowid,band1, band2,..., 1-2, 1-3,....,label|
+        # the first row will contain the field names
+        fileIO.export_table_view(table, skll_dir+"/"+d['name'] + "/" + str(n) + '_dataPixelsComb.tsv', list(range(1, ncols)), fmt='%.4f', delimiter='\t', workers=workers)
+
+    #############   BORUTA  #####################
+
+    if boruta_text:
+        os.makedirs(boruta_dir+"/"+d['name'], exist_ok=True)
+
+        # there is no header the field names  |band1, band2,..., 1-2, 1-3,....|
+        fileIO.export_table_view(table, boruta_dir+"/" + d['name'] +"/" + str(n) + '_dataPixelsCombX.csv', list(range(2, ncols - 1)), fmt='%.4f', delimiter=',', header=False, workers=workers)
+        # there is no header with the field names  |polyID, rowid,band1, band2,..., 1-2, 1-3,....|
+        fileIO.export_table_view(table, boruta_dir+"/" + d['name'] +"/" + str(n) + '_dataPixelsCombX+IDS.csv', list(range(0, ncols - 1)), fmt='%.4f', delimiter=',', header=False, workers=workers)
+        # there is no header with the field names  |label|
+        fileIO.export_table_view(table, boruta_dir+"/" + d['name'] +"/" + str(n) + '_dataPixelsCombY.csv', [-1], fmt='%.1f', delimiter=',', header=False, workers=workers)
+
+    ############    SKLL    ####################
+
+    if skll_text:
+        # |rowid,band1, band2,,....,label|
+        fileIO.export_table_view(table, skll_dir+"/"+d['name'] + "/" + str(n)+"_dataPixelsCombXA.tsv", list(range(1, min(10, ncols))) + [-1], fmt='%.6f', delimiter='\t', workers=workers)
+
+        # |rowid,1-2, 1-3,....,label|
+        fileIO.export_table_view(table, skll_dir+"/"+d['name'] + "/" + str(n)+"_dataPixelsCombXB.tsv", [1] + list(range(10, ncols)), fmt='%.6f', delimiter='\t', workers=workers)
+
+    return True
+
+
+def extract_haralick(imagetag, n, group, type, pixelindex):
+    """ get the haralick pixel values for a content entry (shape, raster, mask) of an image
+    the haralick images are sampled at the pixels of the pixel index, the polygons are not rasterized again
+    the table is saved with fileIO.save_table(), the other processes memory map it with fileIO.load_table()
+    :param imagetag: the image key in paths
+    :param n: the content entry index
+    :param group: 'haralick_images' or 'haralick_ndi'
+    :param type: haralick can be simple, advanced, higher
+    :param pixelindex: the pixel index path returned by extract_pixels()
+    :return: the table path (without extension)
+    """
+
+    import os
+    import getPixelValues
+    import fileIO
+
+    d = paths[imagetag]
+    comb = d['content'][n]
+    t = d[group][type]
+
+    #first we go to the directory that stores the images
+    os.chdir(d['basepath'])
+
+    data, uniqueLabels, columnNames = getPixelValues.samplePixelIndex(fileIO.load_object(pixelindex), [t["basepath"] + "/" + i for i in t["images"]], prefixes=[i + "_b" for i in t["images"]])
+
+    return fileIO.save_table(table_path(imagetag, n, group + "_" + type), data, columnNames)
+
+
+def export_haralick(imagetag, n, group, type, table, workers=1):
+    """ output the haralick pixel values to the skll folder (if skll_text is True)
+    :param imagetag: the image key in paths
+    :param n: the content entry index
+    :param group: 'haralick_images' or 'haralick_ndi'
+    :param type: haralick can be simple, advanced, higher
+    :param table: the table path returned by extract_haralick()
+    :param workers: processes formatting the text, more than 1 only in the main process (the scheduler processes
+                    would start a pool each)
+    :return: True
+    """
+
+    import os
+    import fileIO
+
+    d = paths[imagetag]
+    os.chdir(d['basepath'])
+
+    # |rowid,image1, image2,....,label|  ; XC for the heralick images, XD for the ndvi heralick images
+    suffix = "_PixelsCombXC.tsv" if group == 'haralick_images' else "_PixelsCombXD.tsv"
+    if skll_text:
+        fileIO.export_table_view(table, skll_dir+"/"+d['name'] + "/" + str(n)+ "_"+ type+ suffix, list(range(1, len(fileIO.load_table(table)[1]))), fmt='%.6f', delimiter='\t', workers=workers)
+
+    return True
+
+
+def extract_ndi_chart(imagetag, n, pixelindex):
+    """ get the NDVI values for a content entry (shape, raster, mask) of an image
+    all the pixels of the pixel index are sampled (no subset), the polygons are not rasterized again
+    the table is saved with fileIO.save_table(), the other processes memory map it with fileIO.load_table()
+    :param imagetag: the image key in paths
+    :param n: the content entry index
+    :param pixelindex: the pixel index path returned by extract_pixels()
+    :return: the table path (without extension)
+    """
+
+    import os
+    import getPixelValues
+    import fileIO
+
+    d = paths[imagetag]
+    comb = d['content'][n]
 
+    #first we go to the directory that stores the images
+    os.chdir(d['basepath'])
 
-        #first we go to the directory that stores the images
-        os.chdir(d['basepath'])
+    ############    NDV charting    ##################
+    # NDVI table (band 7 is NIR, band 5 is R)
+    data, uniqueLabels,columnNames = getPixelValues.samplePixelIndex(fileIO.load_object(pixelindex), [comb['raster']], combinations=NDI_chart_combinations, subset=False)
 
-        #for the same image we can have different shapes and masks
-        for n, comb in enumerate(d['content']):
+    os.makedirs(skll_dir+"/"+d['name'], exist_ok=True)
 
-            data, uniqueLabels,columnNames,subsetcollection = getPixelValues.getSinglePixelValues(comb['shape'], comb['raster'], fieldname,rastermask=comb['mask'],combinations=band_combinations,subset=pixel_subset, returnsubset=True)
+    return fileIO.save_table(table_path(imagetag, n, 'NDVI'), data, columnNames)
 
-            if not os.path.exists(skll_dir+"/"+d['name']):
-                os.mkdir(skll_dir+"/" + d['name'])
 
+def export_ndi_chart(imagetag, n, table, workers=1):
+    """ save the NDVI table
+    :param imagetag: the image key in paths
+    :param n: the content entry index
+    :param table: the table path returned by extract_ndi_chart()
+    :param workers: processes formatting the text, more than 1 only in the main process (the scheduler processes
+                    would start a pool each)
+    :return: True
+    """
 
-            #output data to skll, we don't export the polygonID   |rowid,band1, band2,..., 1-2, 1-3,....,label|
-            # the first row will contain the field names
-            np.savetxt(skll_dir+"/"+d['name'] + "/" + str(n) + '_dataPixelsComb.tsv', data[:,1:], fmt='%.4f', delimiter='\t', header= ''.join(columnNames[1:]), comments='')
+    import os
+    import fileIO
+
+    d = paths[imagetag]
+    os.chdir(d['basepath'])
 
-            #############   BORUTA  #####################
+    # |polygonID, NDVI, labelcode| ; then use the table with the chartNDI.py script
+    fileIO.export_table_view(table, str(n)+"_NDVI.csv", [0, -2, -1], fmt='%.4f', delimiter=',', header=False, workers=workers)
 
-            if not os.path.exists(boruta_dir+"/"+d['name']):
-                os.mkdir(boruta_dir+"/" + d['name'])
+    return True
 
-            # there is no header the field names  |band1, band2,..., 1-2, 1-3,....|
-            #np.savetxt('dataPixelsCombX.csv', data[:,2:-1], fmt='%.4f', delimiter=',')
-            np.savetxt(boruta_dir+"/" + d['name'] +"/" + str(n) + '_dataPixelsCombX.csv', data[:,2:-1], fmt='%.4f', delimiter=',')
-            # there is no header with the field names  |polyID, rowid,band1, band2,..., 1-2, 1-3,....|
-            #np.savetxt('dataPixelsCombX+IDS.csv', data[:,:-1], fmt='%.4f', delimiter=',')
-            np.savetxt(boruta_dir+"/" + d['name'] +"/" + str(n) + '_dataPixelsCombX+IDS.csv', data[:,:-1], fmt='%.4f', delimiter=',')
-            # there is no header with the field names  |label|
-            #np.savetxt('dataPixelsCombY.csv', data[:,-1:], fmt='%.1f', delimiter=',')
-            np.savetxt(boruta_dir+"/" + d['name'] +"/" + str(n) + '_dataPixelsCombY.csv', data[:,-1:], fmt='%.1f', delimiter=',')
 
-            ############    SKLL    ####################
-            # |rowid,band1, band2,,....,label|
-            #np.savetxt(r'D:\ITC\courseMaterial\module13GFM2\2015\code\STARS\processing\Skll\stars\train+dev\dataPixelsCombXA.tsv', np.hstack((data[:,1:10],data[:,-1:])), fmt='%.6f', delimiter='\t',header= ''.join(columnNames[1:10]+columnNames[-1:]), comments='')
-            np.savetxt(skll_dir+"/"+d['name'] + "/" + str(n)+"_dataPixelsCombXA.tsv", np.hstack((data[:,1:10],data[:,-1:])), fmt='%.6f', delimiter='\t',header= ''.join(columnNames[1:10]+columnNames[-1:]), comments='')
+def haralick_tasks(imagetag, n, pixelindex):
+    """ get the haralick tasks for a content entry of an image
+    :param imagetag: the image key in paths
+    :param n: the content entry index
+    :param pixelindex: the pixel index path returned by extract_pixels()
+    :return: a list of tasks (kind, arguments)
+    """
+
+    d = paths[imagetag]
+    tasks = []
+    # haralick can be simple, advanced, higher
+    for group in ('haralick_images', 'haralick_ndi'):
+        for type in d[group]:
+            if not d[group][type]: continue
+            tasks.append(('haralick', (imagetag, n, group, type, pixelindex)))
+    return tasks
+
+
+def preparedata(imagetag, workers=1):
+    """ prepare supervised data for all the content entries of an image and output it to the skll/boruta folders
+    :param imagetag: the image key in paths
+    :param workers: processes formatting the text views (use more than 1 only in the main process)
+    :return: True
+    """
 
-            # |rowid,1-2, 1-3,....,label|
-            #np.savetxt(r'D:\ITC\courseMaterial\module13GFM2\2015\code\STARS\processing\Skll\stars\train+dev\dataPixelsCombXB.tsv', np.hstack((data[:,1:2],data[:,10:] )), fmt='%.6f', delimiter='\t',header= ''.join(columnNames[1:2]+columnNames[10:]), comments='')
-            np.savetxt(skll_dir+"/"+d['name'] + "/" + str(n)+"_dataPixelsCombXB.tsv", np.hstack((data[:,1:2],data[:,10:] )), fmt='%.6f', delimiter='\t',header= ''.join(columnNames[1:2]+columnNames[10:]), comments='')
+    d = paths[imagetag]
 
+    #for the same image we can have different shapes and masks
+    for n in range(len(d['content'])):
 
-            # haralick can be simple, advanced, higher
-            for type in d['haralick_images']:
-                t = d['haralick_images'][type]
-                if not t: continue
-                # |rowid,image1, image2,....,label|  ; in this case we have the heralick images
-                data, uniqueLabels, columnNames = getPixelValues.getGeneralSinglePixelValues(comb['shape'], t["basepath"], fieldname, t["images"], rastermask=comb['mask'], subset=subsetcollection, returnsubset = False)
-                np.savetxt(skll_dir+"/"+d['name'] + "/" + str(n)+ "_"+ type+"_PixelsCombXC.tsv", data[:,1:],fmt='%.6f',delimiter='\t',header=''.join(columnNames[1:]),comments='')
+        if MEAN:
+            export_mean(imagetag, n, extract_mean(imagetag, n), workers)
+            continue
 
-            # haralick can be simple, advanced, higher
-            for type in d['haralick_ndi']:
-                t = d['haralick_ndi'][type]
-                if not t: continue
-                # |rowid,image1, image2,....,label|  ; in this case we have the ndvi heralick images
-                data, uniqueLabels, columnNames = getPixelValues.getGeneralSinglePixelValues(comb['shape'], t["basepath"], fieldname, t["images"], rastermask=comb['mask'], subset=subsetcollection, returnsubset = False)
-                np.savetxt(skll_dir+"/"+d['name'] + "/" + str(n)+ "_"+ type+ "_PixelsCombXD.tsv", data[:,1:], fmt='%.6f', delimiter='\t',header= ''.join(columnNames[1:]), comments='')
+        # the polygons are rasterized once, the haralick images and the NDI chart reuse the pixel index
+        pixelindex, table = extract_pixels(imagetag, n)
+        export_pixels(imagetag, n, table, workers)
+        for kind, args in haralick_tasks(imagetag, n, pixelindex):
+            export_haralick(*(args[:4] + (extract_haralick(*args), workers)))
+        export_ndi_chart(imagetag, n, extract_ndi_chart(imagetag, n, pixelindex), workers)
 
-            ############    NDV charting    ##################
-            # save NDVI table (band 7 is NIR, band 5 is R)
-            # |polygonID, NDVI, labelcode| ; then use the table with the chartNDI.py script
-            data, uniqueLabels,columnNames = getPixelValues.getSinglePixelValues(comb['shape'], comb['raster'], fieldname,rastermask=comb['mask'],combinations=NDI_chart_combinations,subset=None, returnsubset = False)
-            np.savetxt( str(n)+"_NDVI.csv", np.hstack((data[:,0:1], data[:, -2:])), fmt='%.4f', delimiter=',')
+    return True
 
-        return True
+###########################
+# local scheduler: the extraction is split into tasks (image, content entry, extraction kind) that are
+# load balanced on a pool of processes; the haralick and NDI chart tasks are submitted when the pixel index is available
+# the extracted tables are passed to the export tasks as feature tables (fileIO.save_table), only the paths are sent
+# between processes; the text views for skll/boruta are written only if requested in the settings
+
+TASKS = {'mean': extract_mean, 'pixels': extract_pixels, 'haralick': extract_haralick, 'ndi_chart': extract_ndi_chart,
+         'export_mean': export_mean, 'export_pixels': export_pixels, 'export_haralick': export_haralick,
+         'export_ndi_chart': export_ndi_chart}
+
+
+def run_task(kind, args):
+    """ run an extraction task and measure the elapsed time
+    :param kind: a key in TASKS
+    :param args: the task function arguments
+    :return: the task result, the elapsed seconds
+    """
+
+    t0 = time.perf_counter()
+    result = TASKS[kind](*args)
+    return result, time.perf_counter() - t0
+
+
+def task_name(kind, args):
+    """ a readable name for a task """
+    name = "%s image %s content %d" % (kind, paths[args[0]]['name'], args[1])
+    if kind in ('haralick', 'export_haralick'):
+        name += " %s %s" % (args[2], args[3])
+    return name
+
+
+def schedule(imagetags, processes=4, retries=1):
+    """ run the extraction tasks for many images on a local pool of processes
+    the tasks are submitted as soon as they can run, failed tasks are resubmitted up to retries times
+
+    :param imagetags: list of image keys in paths
+    :param processes: max number of parallel processes
+    :param retries: how many times a failed task is resubmitted
+    :return: a list of (task name, elapsed seconds or None if the task failed, attempts, error message)
+    """
+
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+    from concurrent.futures.process import BrokenProcessPool
+
+    tasks = []
+    for imagetag in imagetags:
+        for n in range(len(paths[imagetag]['content'])):
+            if MEAN:
+                tasks.append(('mean', (imagetag, n)))
+            else:
+                tasks.append(('pixels', (imagetag, n)))
+
+    report = []
+    pending = {}  # future: (kind, args, attempt)
+    executor = ProcessPoolExecutor(max_workers=processes)
+
+    def submit(kind, args, attempt=1):
+        nonlocal executor
+        try:
+            future = executor.submit(run_task, kind, args)
+        except BrokenProcessPool:  # a worker died, start a new pool
+            executor.shutdown(wait=False)
+            executor = ProcessPoolExecutor(max_workers=processes)
+            future = executor.submit(run_task, kind, args)
+        pending[future] = (kind, args, attempt)
+
+    try:
+        for kind, args in tasks:
+            submit(kind, args)
+
+        while pending:
+            done, not_done = wait(list(pending), return_when=FIRST_COMPLETED)
+            for future in done:
+                kind, args, attempt = pending.pop(future)
+                name = task_name(kind, args)
+                try:
+                    result, elapsed = future.result()
+                except Exception as e:
+                    if attempt <= retries:
+                        print("task failed, retrying: " + name + " -> " + repr(e))
+                        submit(kind, args, attempt + 1)
+                    else:
+                        print("task failed: " + name + " -> " + repr(e))
+                        report.append((name, None, attempt, repr(e)))
+                    continue
+
+                print("task done in %.1fs: %s" % (elapsed, name))
+                report.append((name, elapsed, attempt, ''))
+
+                # the haralick and NDI chart values are extracted for the same pixels
+                if kind == 'pixels':
+                    pixelindex, result = result
+                    for k, a in haralick_tasks(args[0], args[1], pixelindex):
+                        submit(k, a)
+                    submit('ndi_chart', (args[0], args[1], pixelindex))
+
+                # export the table saved by the extraction task
+                if not kind.startswith('export'):
+                    submit('export_' + kind, (args[:4] if kind == 'haralick' else args[:2]) + (result,))
+    finally:
+        executor.shutdown()
+
+    print('-' * 30)
+    print("task timings (seconds)")
+    for name, elapsed, attempt, error in sorted(report, key=lambda r: -1 if r[1] is None else r[1], reverse=True):
+        print("%10s  %s%s" % ("FAILED" if elapsed is None else "%.1f" % elapsed, name,
+                              " (attempts %d)" % attempt if attempt > 1 else ""))
+
+    return report
 
 ###########################
 
@@ -227,136 +535,150 @@ def wait_watching_stdout(ar, dt=0.1, truncate=500):
         print(ar.get())
         print("finished!")
 
-if parallelize:
-    T0 = time.perf_counter()
-    from ipyparallel import Client
-    call = True
-    while call:
-        try:
-            print('waiting for ipcluster connection....')
-            client = Client(timeout=20)
-        except Exception as e:
-            print(e)
-            print('waiting other 5 seconds for ipcluster connection....')
-            time.sleep(5)
+# the processes of the local scheduler import this module, the data extraction runs only in the main process
+if __name__ == "__main__":
+
+    if parallelize and parallel_mode == 'local':
+        T0 = time.perf_counter()
+        report = schedule(list(paths.keys()), max_processes, task_retries)
+        T1 = time.perf_counter()
+        print("parallel elapsed: ",(T1 - T0)*1000)
+
+    elif parallelize:
+        T0 = time.perf_counter()
+        from ipyparallel import Client
+        call = True
+        while call:
+            try:
+                print('waiting for ipcluster connection....')
+                client = Client(timeout=20)
+            except Exception as e:
+                print(e)
+                print('waiting other 5 seconds for ipcluster connection....')
+                time.sleep(5)
+            else:
+                print(client.ids)
+                if not client.ids:
+                    print('nearly there, waiting 20 seconds for ipcluster connection....')
+                    time.sleep(20)
+                if client.ids:
+                    call = False
+        print("there are ", len(client.ids), "clients available")
+        print("we want to use up to",max_processes , "processes")
+
+        if max_processes < len(client.ids):
+            #creating a direct view
+            dview = client[:max_processes]
         else:
-            print(client.ids)
-            if not client.ids:
-                print('nearly there, waiting 20 seconds for ipcluster connection....')
-                time.sleep(20)
-            if client.ids:
-                call = False
-    print("there are ", len(client.ids), "clients available")
-    print("we want to use up to",max_processes , "processes")
-
-    if max_processes < len(client.ids):
-        #creating a direct view
-        dview = client[:max_processes]
-    else:
+            dview = client[:]
         dview = client[:]
-    dview = client[:]
-    #pushing configurations to the workers
-    for k in setng:
-        dview[k]=setng[k]
-
-    #updating the sys.path, this is necessary, this is necessary for the engines to find the custom modules
-    mydir = os.path.dirname(os.path.abspath(__file__))
-    dview["mydir"]=mydir
-    dview["paths"]=paths
-    dview.execute("import sys")
-    dview.execute("sys.path.append(mydir)")
-
-    #calling a function asyncronously on all engines, each image in paths is assigned to one engine
-
-    ar = dview.map_async(preparedata, list(paths.keys()))
-    #ar = dview.map_async(preparedata, [0,0])
-
-    #do we want the engine stdout
-    if engine_messages:
-        wait_watching_stdout(ar)
-    else:
-        ar.wait()
-        print(ar.get())
-        print("finished!")
+        #pushing configurations to the workers
+        for k in setng:
+            dview[k]=setng[k]
+
+        #updating the sys.path, this is necessary, this is necessary for the engines to find the custom modules
+        mydir = os.path.dirname(os.path.abspath(__file__))
+        dview["mydir"]=mydir
+        dview["paths"]=paths
+        #preparedata calls the extraction functions, they must be available on the engines
+        for f in (table_path, extract_mean, extract_pixels, extract_haralick, extract_ndi_chart, export_mean,
+                  export_pixels, export_haralick, export_ndi_chart, haralick_tasks):
+            dview[f.__name__]=f
+        dview.execute("import sys")
+        dview.execute("sys.path.append(mydir)")
+
+        #calling a function asyncronously on all engines, each image in paths is assigned to one engine
+
+        ar = dview.map_async(preparedata, list(paths.keys()))
+        #ar = dview.map_async(preparedata, [0,0])
+
+        #do we want the engine stdout
+        if engine_messages:
+            wait_watching_stdout(ar)
+        else:
+            ar.wait()
+            print(ar.get())
+            print("finished!")
 
-    T1 = time.perf_counter()
-    print("parallel elapsed: ",(T1 - T0)*1000)
-
-    #dview.execute('sys.exit()')
-
-else:
-    T0 = time.perf_counter()
-    for i in  list(paths.keys()):
-    #for i in  [0,0]:
-        preparedata(i)
-    T1 = time.perf_counter()
-    print("sequential elapsed: ",(T1 - T0)*1000)
-
-#### FOR NOW EXIT THE SCRIPT#####################################
-sys.exit(1)
-##########################################################
-
-#split into training and validation data
-trainingSamples,trainingLabels,validationSamples,validationLabels, k = utility.shuffle_data(data, percentage)
-
-# redo the shuffldata[:,-1:]ing if not all the labels are not represented in the training samples
-dataOK = False
-while not dataOK:
-    for i in uniqueLabels:
-        if i not in trainingLabels:
-            trainingSamples,trainingLabels,validationSamples,validationLabels, k = utility.shuffle_data(data, percentage)
-            break  # reshuffle,go out of the for loop, and check again the data
-    dataOK = True
-
-# train classifier
-trainingLabels = trainingLabels.reshape(k,)
-
-# initialize RandomForestClassifier class and call the fit method
-print("training classifier, please wait....")
-rf = RandomForestClassifier(n_estimators=20, n_jobs=-1)
-rf.fit(trainingSamples, trainingLabels)
-
-
-# predict labels using samples
-y_predrf = rf.predict(validationSamples)
-
-print("check random forest classification...")
-
-# plot confusion matrix
-count = data.shape[0]
-validationLabels = validationLabels.reshape(count-k,)
-cm = visualization.plotconfusionmatrix(validationLabels, y_predrf)
-
-# calculate accuracy
-accuracy, userAccuracy,producerAccuracy = visualization.getAccuracy(cm)
-print("The overral accuracy is ",end="")
-print(accuracy)
-print("The user accuracy is ",end="")
-print(userAccuracy)
-print("The producer accuracy is ",end="")
-print(producerAccuracy)
-print()
-
-print(metrics.classification_report(validationLabels,y_predrf))
-
-print("Bands importances...")
-importances=rf.feature_importances_
-print(importances)
-
-indices = np.argsort(importances)[::-1]
-plt.figure()
-plt.title("Band importances")
-plt.bar(range(indices.shape[0]), importances[indices], color="b", align="center")
-plt.xticks(range(indices.shape[0]), indices)
-plt.xlim([-1, indices.shape[0]])
-plt.show()
-
-# print the charts
-if MEAN:
-    for i in range(len(uniqueLabels)):
-        plt.subplot(math.floor(len(uniqueLabels)/2), len(uniqueLabels) - math.floor(len(uniqueLabels)/2), i+1)
-        plt.plot(np.arange(1, data.shape[1]), trainingSamples[trainingLabels == i+1, :].T)
+        T1 = time.perf_counter()
+        print("parallel elapsed: ",(T1 - T0)*1000)
+
+        #dview.execute('sys.exit()')
+
+    else:
+        T0 = time.perf_counter()
+        for i in  list(paths.keys()):
+        #for i in  [0,0]:
+            preparedata(i, text_workers)
+        T1 = time.perf_counter()
+        print("sequential elapsed: ",(T1 - T0)*1000)
+
+    #### FOR NOW EXIT THE SCRIPT#####################################
+    sys.exit(1)
+    ##########################################################
+
+    #split into training and validation data
+    trainingSamples,trainingLabels,validationSamples,validationLabels, k = utility.shuffle_data(data, percentage)
+
+    # redo the shuffldata[:,-1:]ing if not all the labels are not represented in the training samples
+    dataOK = False
+    while not dataOK:
+        for i in uniqueLabels:
+            if i not in trainingLabels:
+                trainingSamples,trainingLabels,validationSamples,validationLabels, k = utility.shuffle_data(data, percentage)
+                break  # reshuffle,go out of the for loop, and check again the data
+        dataOK = True
+
+    # train classifier
+    trainingLabels = trainingLabels.reshape(k,)
+
+    # initialize RandomForestClassifier class and call the fit method
+    print("training classifier, please wait....")
+    rf = RandomForestClassifier(n_estimators=20, n_jobs=-1)
+    rf.fit(trainingSamples, trainingLabels)
+
+
+    # predict labels using samples
+    y_predrf = rf.predict(validationSamples)
+
+    print("check random forest classification...")
+
+    # plot confusion matrix
+    count = data.shape[0]
+    validationLabels = validationLabels.reshape(count-k,)
+    cm = visualization.plotconfusionmatrix(validationLabels, y_predrf)
+
+    # calculate accuracy
+    accuracy, userAccuracy,producerAccuracy = visualization.getAccuracy(cm)
+    print("The overral accuracy is ",end="")
+    print(accuracy)
+    print("The user accuracy is ",end="")
+    print(userAccuracy)
+    print("The producer accuracy is ",end="")
+    print(producerAccuracy)
+    print()
+
+    print(metrics.classification_report(validationLabels,y_predrf))
+
+    print("Bands importances...")
+    importances=rf.feature_importances_
+    print(importances)
+
+    indices = np.argsort(importances)[::-1]
+    plt.figure()
+    plt.title("Band importances")
+    plt.bar(range(indices.shape[0]), importances[indices], color="b", align="center")
+    plt.xticks(range(indices.shape[0]), indices)
+    plt.xlim([-1, indices.shape[0]])
     plt.show()
 
-# classify image using tiles
-tiledClassify.tiledClassification( img,rf, tilesize = (tilesize,tilesize), outname=outname)
\ No newline at end of file
+    # print the charts
+    if MEAN:
+        for i in range(len(uniqueLabels)):
+            plt.subplot(math.floor(len(uniqueLabels)/2), len(uniqueLabels) - math.floor(len(uniqueLabels)/2), i+1)
+            plt.plot(np.arange(1, data.shape[1]), trainingSamples[trainingLabels == i+1, :].T)
+        plt.show()
+
+    # classify image using tiles
+    # max_processes threads classify the tiles
+    tiledClassify.tiledClassification( img,rf, tilesize = (tilesize,tilesize), outname=outname, workers=max_processes)
@@ -2,6 +2,7 @@
 # -------------------------------------------------------------------------------
 # Name:
 # Purpose:  - filter a google engine file by rows/columns
+#           - convert a google engine file to a columnar cache (one .npy file for each column) keyed by the file hash
 #
 # Author:   claudio piccinini,
 #
@@ -10,8 +11,12 @@
 
 import csv
 import collections
+import hashlib
+import json
+import operator
 import os
 import random
+import time
 import numpy as np
 import pandas as pd
 from sklearn.cross_validation import KFold
@@ -24,19 +29,24 @@ VTYPES_NOBAND = ['SAVI', 'TCARI', 'EVI', 'MSAVI2'] #types independent from bands
 TEXTYPES = ['asm', 'contrast','corr','dent','diss','dvar','ent','idm','imcorr1','imcorr2','inertia','prom','savg','sent','shade','svar','var']
 
 
-def get_structure(filepath):
+def get_structure(filepath, cache=None):
     """ this function will read the structure of google engine files
         -the fist row contains the raster names
         -the second row contains many fields for each raster
     :param filepath: path to the csv file
+    :param cache: None to read the csv file, the cache directory returned by ingest() or True to ingest the file
     :return: an ordered dictionary  {raster_name: field_count} and a set with the unique raster names
     """
 
-    f = open (filepath)
-    reader = csv.reader(f)
+    if cache:
+        first = load_cache(_cache_path(filepath, cache))['headers'][0]
+    else:
+        f = open (filepath)
+        reader = csv.reader(f)
 
-    first=next(reader)
-    #print(len(first))
+        first=next(reader)
+        #print(len(first))
+        f.close()
 
     #sets are not ordered therefore I used the code below to get a unique list
     uniquefirst = []
@@ -45,7 +55,6 @@ def get_structure(filepath):
 
     #second=next(reader)
     #print(len(second)))
-    f.close()
 
     #count how many columns for each first row fields
     fieldcount = [first.count(uniquefirst[i]) for i in range(len(uniquefirst))]
@@ -61,19 +70,23 @@ def get_structure(filepath):
     return tablestructure, set(prefix)
 
 
-def field_names(filepath, outfile=None):
+def field_names(filepath, outfile=None, cache=None):
     """
     utility function to return unique field names from the second row
     :param filepath:
     :param outfile: set this if you want to output to a file
+    :param cache: None to read the csv file, the cache directory returned by ingest() or True to ingest the file
     :return: a list of unique fields
     """
 
-    f = open (filepath)
-    reader = csv.reader(f)
-    next(reader)
-    fields = next(reader)
-    f.close()
+    if cache:
+        fields = load_cache(_cache_path(filepath, cache))['headers'][1]
+    else:
+        f = open (filepath)
+        reader = csv.reader(f)
+        next(reader)
+        fields = next(reader)
+        f.close()
 
     uniquefields = []
     [uniquefields.append(item) for item in fields if item not in uniquefields]
@@ -105,6 +118,18 @@ def write_filtered_row(inputrow,indexes, csvwriter):
     csvwriter.writerow(newline)
 
 
+def row_selector(indexes):
+    """ utility function to precompile a column selection, the selector returns a tuple of items
+    :param indexes: the filter indexes
+    :return: a function that takes a row and returns the filtered row
+    """
+
+    if len(indexes) == 1:
+        index = indexes[0]
+        return lambda row: (row[index],)
+    return operator.itemgetter(*indexes)
+
+
 def clean_directory(directory, end=None):
     """ delete all the files in a directory, optionally filter the files
     :param directory: working directory
@@ -235,13 +260,218 @@ def skllifier(infile, outfile, indelimiter=',', outdelimiter='\t'):
     print('done')
 
 
+############COLUMNAR CACHE###########
+
+# caches written with a different version are ingested again
+CACHE_VERSION = 3
+
+
+def file_hash(filepath, blocksize=2**23):
+    """ get the sha1 hash of a file content
+    :param filepath: path to the file
+    :param blocksize: bytes read at once
+    :return: the hexadecimal hash
+    """
+
+    h = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def cached_file_hash(filepath, cachedir):
+    """ get the sha1 hash of a file, the hash is computed again only if the file path, size or modification time
+    are not the ones recorded in cachedir/sources.json
+    :param filepath: path to the file
+    :param cachedir: the directory for the caches
+    :return: the hexadecimal hash
+    """
+
+    stat = os.stat(filepath)
+    key = os.path.abspath(filepath)
+    record = cachedir + '/sources.json'
+
+    sources = {}
+    if os.path.exists(record):
+        try:
+            with open(record) as f:
+                sources = json.load(f)
+        except ValueError:
+            sources = {}
+
+    source = sources.get(key)
+    if source and source['size'] == stat.st_size and source['mtime'] == stat.st_mtime:
+        return source['hash']
+
+    h = file_hash(filepath)
+    sources[key] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'hash': h}
+    if not os.path.exists(cachedir):
+        os.makedirs(cachedir)
+    with open(record + '.' + str(os.getpid()) + '.tmp', 'w') as f:
+        json.dump(sources, f)
+    os.replace(record + '.' + str(os.getpid()) + '.tmp', record)
+    return h
+
+
+def _read_chunks(filepath, headerscount, ncols, chunksize):
+    """ read a csv file by chunks of rows as text, missing values are empty strings
+    :param filepath: path to the csv file
+    :param headerscount: number of header rows to skip
+    :param ncols: number of columns
+    :param chunksize: number of rows read at once
+    :return: a generator of pandas dataframes
+    """
+
+    chunks = pd.read_csv(filepath, header=None, names=list(range(ncols)), skiprows=headerscount, dtype=str,
+                         na_filter=False, chunksize=chunksize)
+    for chunk in chunks:
+        yield chunk.fillna('')
+
+
+def ingest(filepath, cachedir=None, headerscount=2, chunksize=100000):
+    """ convert a google engine csv file to a columnar cache, the file is parsed only once
+    the cache is a directory named with the file hash, it contains one .npy file for each column (col0.npy, col1.npy..)
+    with the original text as utf-8 bytes (the filters write the same text as the csv file) and a metadata.json
+    file with the header rows, the number of rows, the column data types and the numeric columns; the numeric
+    values are parsed when they are read, see cache_numeric()
+
+    if the cache for the same file content already exists it is reused, the file is hashed again only when its
+    size or modification time change (see cached_file_hash())
+
+    :param filepath: path to the csv file
+    :param cachedir: the directory for the caches (default is filepath + '_cache')
+    :param headerscount: number of header rows
+    :param chunksize: number of rows read at once
+    :return: the cache directory for this file
+    """
+
+    if cachedir is None:
+        cachedir = filepath + '_cache'
+
+    cachepath = cachedir + '/' + cached_file_hash(filepath, cachedir)
+    if os.path.exists(cachepath + '/metadata.json') and load_cache(cachepath).get('version') == CACHE_VERSION:
+        print('using cache ' + cachepath)
+        return cachepath
+
+    if not os.path.exists(cachepath):
+        os.makedirs(cachepath)
+
+    inp = open(filepath)
+    reader = csv.reader(inp)
+    headers = [next(reader) for i in range(headerscount)]
+    inp.close()
+    ncols = max(len(h) for h in headers)
+
+    # first pass: count rows and get the column types
+    print('ingesting ' + filepath + ', wait....')
+    rows = 0
+    numeric = [True] * ncols
+    width = [1] * ncols
+    for chunk in _read_chunks(filepath, headerscount, ncols, chunksize):
+        rows += chunk.shape[0]
+        for c in range(ncols):
+            text = chunk[c]
+            if numeric[c]:
+                values = pd.to_numeric(text, errors='coerce').values
+                numeric[c] = not np.any(np.logical_and(np.isnan(values), (text != '').values))
+            longest = text.str.encode('utf-8').str.len().max(skipna=True)
+            if not pd.isna(longest):
+                width[c] = max(width[c], int(longest))
+
+    # second pass: fill the columns with the utf-8 text (1 byte for each ascii character)
+    columns = []
+    for c in range(ncols):
+        columns.append(np.lib.format.open_memmap(cachepath + '/col' + str(c) + '.npy', mode='w+',
+                                                 dtype='S' + str(width[c]), shape=(rows,)))
+    start = 0
+    for chunk in _read_chunks(filepath, headerscount, ncols, chunksize):
+        end = start + chunk.shape[0]
+        for c in range(ncols):
+            columns[c][start:end] = chunk[c].str.encode('utf-8').values
+        start = end
+    for column in columns:
+        column.flush()
+    columns = None
+
+    # the metadata file is written last, an incomplete cache has no metadata
+    metadata = {'version': CACHE_VERSION, 'source': os.path.abspath(filepath), 'rows': rows, 'headers': headers,
+                'dtypes': [str(np.dtype('S' + str(width[c]))) for c in range(ncols)],
+                'numeric': [c for c in range(ncols) if numeric[c]]}
+    with open(cachepath + '/metadata.json', 'w') as f:
+        json.dump(metadata, f)
+
+    print('done')
+    return cachepath
+
+
+def _cache_path(filepath, cache):
+    """ get the cache directory, cache=True will ingest the file (or reuse an existing cache) """
+    if cache is True:
+        return ingest(filepath)
+    return cache
+
+
+def load_cache(cachepath):
+    """ get the cache metadata
+    :param cachepath: the cache directory returned by ingest()
+    :return: a dictionary with keys 'version', 'source', 'rows', 'headers', 'dtypes', 'numeric'
+    """
+
+    with open(cachepath + '/metadata.json') as f:
+        return json.load(f)
+
+
+def cache_columns(cachepath, indexes, mmap=True):
+    """ get some columns from the cache, the values are the original text as utf-8 bytes (see _column_text())
+    :param cachepath: the cache directory returned by ingest()
+    :param indexes: list of column indexes
+    :param mmap: memory map the columns (otherwise read them in memory)
+    :return: a list of 1d numpy arrays
+    """
+
+    return [np.load(cachepath + '/col' + str(i) + '.npy', mmap_mode='r' if mmap else None) for i in indexes]
+
+
+def cache_numeric(cachepath, indexes, start=0, end=None):
+    """ get the float64 values of some numeric columns from the cache, the text is parsed (empty values are nan)
+    :param cachepath: the cache directory returned by ingest()
+    :param indexes: list of column indexes, they must be in the metadata 'numeric' list
+    :param start: first row
+    :param end: last row (excluded), None for all the rows
+    :return: a list of 1d numpy arrays
+    """
+
+    numeric = load_cache(cachepath)['numeric']
+    for i in indexes:
+        if i not in numeric:
+            raise ValueError('column ' + str(i) + ' is not numeric')
+    return [pd.to_numeric(pd.Series(_column_text(column[start:end])), errors='coerce').values.astype(np.float64)
+            for column in cache_columns(cachepath, indexes)]
+
+
+def _empty_values(column):
+    """ boolean array, True where a cached column has an empty value """
+    if column.dtype.kind == 'f':
+        return np.isnan(column)
+    return np.char.str_len(column) == 0
+
+
+def _column_text(column):
+    """ get a slice of a cached column as text, empty values are empty strings """
+    column = np.asarray(column)
+    if column.dtype.kind == 'S':
+        return np.char.decode(column, 'utf-8')
+    return column.astype(str)
+
+
 ############FILTER BY ROW###########
 
 def filter_by_row(filepath, outputfile, clsfilter = 0, rows_by_class=100, skipnan=True,  **kwargs):
     """ decrease the size of the file, for each class take no more than rows_by_class rows
     the function will save the new file and print the number of pixels for each class
 
-    IMPORTANT: this function will read all the file in memory. If the file is too big use filter_by_randomized_row()
+    IMPORTANT: this function will read all the file in memory. If the file is too big use filter_by_row_streaming()
 
     don't forget to pass  header=2 for the **kwargs to skip the headers!!!
 
@@ -318,6 +548,167 @@ def filter_by_row(filepath, outputfile, clsfilter = 0, rows_by_class=100, skipna
     return countpix
 
 
+def _reservoir_update(reservoir, seen, rows, size, rng):
+    """ update a reservoir sample (algorithm R) with a new block of rows of the same class
+    :param reservoir: 2d object array with the sampled rows (or None)
+    :param seen: number of rows of this class already passed to the reservoir
+    :param rows: 2d object array with the new rows
+    :param size: the reservoir size
+    :param rng: numpy RandomState
+    :return: the updated reservoir
+    """
+
+    if reservoir is None:
+        reservoir = rows[:0]
+
+    # fill the reservoir
+    fill = max(0, min(size - reservoir.shape[0], rows.shape[0]))
+    if fill:
+        reservoir = np.vstack((reservoir, rows[:fill]))
+
+    # the row number t (starting at 1) replaces a random slot with probability size/t
+    rest = rows[fill:]
+    if rest.shape[0]:
+        t = seen + fill + np.arange(1, rest.shape[0] + 1)
+        slot = (rng.random_sample(rest.shape[0]) * t).astype(np.int64)
+        keep = slot < size
+        slot, rest = slot[keep], rest[keep]
+
+        # when a slot is replaced many times in the block only the last replacement counts
+        slot, rest = slot[::-1], rest[::-1]
+        slot, first = np.unique(slot, return_index=True)
+        reservoir[slot] = rest[first]
+
+    return reservoir
+
+
+def filter_by_row_streaming(filepath, outputfile, clsfilter=0, rows_by_class=100, skipnan=True, headerscount=2,
+                            chunksize=100000, seed=None, cache=None):
+    """ decrease the size of the file, for each class take a random sample of no more than rows_by_class rows
+    the file is read in chunks and a reservoir of rows is kept for each class; the memory usage depends on
+    the chunksize and on rows_by_class, not on the file size; no temporary files are needed
+
+    the function will save the new file (rows are shuffled) and print the number of pixels for each class
+
+    :param filepath: path to the csv file
+    :param outputfile: path to the output csv file
+    :param clsfilter: the index of the column with filter values
+    :param rows_by_class: the max number of returned rows for each class
+    :param skipnan: True if rows with empty value must be skipped (rows with an empty class are always skipped)
+    :param headerscount: number of header rows, these are copied to the output
+    :param chunksize: number of rows read at once
+    :param seed: seed for the random generator (or None)
+    :param cache: None to read the csv file, the cache directory returned by ingest() or True to ingest the file;
+                  with a cache only the class column (and the columns to check for empty values) is scanned
+    :return: the count of rows for each class
+    """
+
+    rng = np.random.RandomState(seed)
+
+    if cache:
+        return _filter_by_row_cache(_cache_path(filepath, cache), outputfile, clsfilter, rows_by_class, skipnan,
+                                    chunksize, rng)
+
+    # write headers to output
+    out = open(outputfile, 'w', newline='')
+    writer = csv.writer(out)
+    inp = open(filepath)
+    reader = csv.reader(inp)
+    for i in range(headerscount):
+        writer.writerow(next(reader))
+    inp.close()
+
+    reservoirs = {}  # class: sampled rows
+    seen = {}  # class: number of rows
+
+    # read values as text to output the same values
+    print('scanning file, wait....')
+    chunks = pd.read_csv(filepath, header=None, skiprows=headerscount, dtype=str, na_filter=False,
+                         chunksize=chunksize)
+    for n, chunk in enumerate(chunks):
+        print('scanning chunk ' + str(n + 1))
+        arr = chunk.fillna('').values
+
+        if skipnan:
+            arr = arr[(arr != '').all(axis=1)]
+        else:
+            arr = arr[arr[:, clsfilter] != '']
+
+        classes = arr[:, clsfilter]
+        for cls in pd.unique(classes):
+            rows = arr[classes == cls]
+            reservoirs[cls] = _reservoir_update(reservoirs.get(cls), seen.get(cls, 0), rows, rows_by_class, rng)
+            seen[cls] = seen.get(cls, 0) + rows.shape[0]
+
+    countpix = {cls: reservoirs[cls].shape[0] for cls in reservoirs}
+
+    if reservoirs:
+        arr = np.vstack(list(reservoirs.values()))
+        rng.shuffle(arr)
+        writer.writerows(arr.tolist())
+    out.close()
+
+    print('\nresults: ', countpix)
+    return countpix
+
+
+def _filter_by_row_cache(cachepath, outputfile, clsfilter, rows_by_class, skipnan, chunksize, rng):
+    """ filter_by_row_streaming() for a cache, the reservoirs store the row numbers and only the sampled rows are read
+    :param cachepath: the cache directory returned by ingest()
+    :param outputfile: path to the output csv file
+    :param clsfilter: the index of the column with filter values
+    :param rows_by_class: the max number of returned rows for each class
+    :param skipnan: True if rows with empty value must be skipped (rows with an empty class are always skipped)
+    :param chunksize: number of rows scanned at once
+    :param rng: numpy RandomState
+    :return: the count of rows for each class
+    """
+
+    metadata = load_cache(cachepath)
+    ncols = len(metadata['dtypes'])
+    clscolumn = cache_columns(cachepath, [clsfilter])[0]
+    columns = cache_columns(cachepath, range(ncols))
+
+    out = open(outputfile, 'w', newline='')
+    writer = csv.writer(out)
+    writer.writerows(metadata['headers'])
+
+    reservoirs = {}  # class: sampled row numbers
+    seen = {}  # class: number of rows
+
+    print('scanning cache, wait....')
+    for start in range(0, metadata['rows'], chunksize):
+        end = min(start + chunksize, metadata['rows'])
+        rownumbers = np.arange(start, end)
+        classes = _column_text(clscolumn[start:end])
+
+        if skipnan:
+            keep = np.ones(end - start, dtype=bool)
+            for column in columns:
+                keep &= ~_empty_values(column[start:end])
+        else:
+            keep = classes != ''
+        rownumbers, classes = rownumbers[keep], classes[keep]
+
+        for cls in pd.unique(classes):
+            rows = rownumbers[classes == cls].reshape(-1, 1)
+            reservoirs[cls] = _reservoir_update(reservoirs.get(cls), seen.get(cls, 0), rows, rows_by_class, rng)
+            seen[cls] = seen.get(cls, 0) + rows.shape[0]
+
+    countpix = {cls: reservoirs[cls].shape[0] for cls in reservoirs}
+
+    if reservoirs:
+        # read the sampled rows (sorted for a sequential access), then shuffle them
+        rownumbers = np.sort(np.vstack(list(reservoirs.values())).ravel())
+        arr = np.column_stack([_column_text(column[rownumbers]) for column in columns])
+        rng.shuffle(arr)
+        writer.writerows(arr.tolist())
+    out.close()
+
+    print('\nresults: ', countpix)
+    return countpix
+
+
 def split_input(filepath, outdirectory, headerscount=2, outsuffix='_tmp', splitrows=50):
     """ split a big text file info smaller pieces
     :param filepath: input file
@@ -464,7 +855,7 @@ def filter_by_randomized_row(directory, outputfile, suffix=['_tmp', '_shuffletmp
 
 ############FILTER BY COLUMN###########
 
-def linked_iteration(filepath,image_filter, type_filter,default_indexes, fields):
+def linked_iteration(filepath,image_filter, type_filter,default_indexes, fields, cache=None):
     """  define the imagenames and indexes for the output using linked types
          the vegetation index output depends on the chosen bands,
          the texture bands depend on the chosen bands
@@ -474,6 +865,7 @@ def linked_iteration(filepath,image_filter, type_filter,default_indexes, fields)
     :param type_filter: dictionary for the filter
     :param default_indexes: the left columns that stores the row indexes
     :param fields: the list of all fields (coming from the second csv row)
+    :param cache: None to read the csv file, the cache directory returned by ingest()
     :return: list of imagenames and list of filter indexes
     """
 
@@ -482,7 +874,7 @@ def linked_iteration(filepath,image_filter, type_filter,default_indexes, fields)
         return
 
     # get a tuple with an ordered dictionary {raster_name: field_count} and a set with the unique raster names
-    tablestructure = get_structure(filepath)
+    tablestructure = get_structure(filepath, cache)
 
     images = list(tablestructure[0].keys())
     counts = list(tablestructure[0].values())
@@ -613,7 +1005,7 @@ def linked_iteration(filepath,image_filter, type_filter,default_indexes, fields)
     return imagenames, indexes
 
 
-def standard_iteration(filepath,image_filter, type_filter,default_indexes, fields):
+def standard_iteration(filepath,image_filter, type_filter,default_indexes, fields, cache=None):
     """  define the imagenames and indexes for the output using linked types
          the filters are independent, for linked filters use the function linked_iteration()
     :param filepath: the input google engine csv file
@@ -621,11 +1013,12 @@ def standard_iteration(filepath,image_filter, type_filter,default_indexes, field
     :param type_filter: dictionary for the filter
     :param default_indexes: the left columns that stores the row indexes
     :param fields: the list of all fields (coming from the second csv row)
+    :param cache: None to read the csv file, the cache directory returned by ingest()
     :return: list of imagenames and list of filter indexes
     """
 
     # get a tuple with an ordered dictionary {raster_name: field_count} and a set with the unique raster names
-    tablestructure = get_structure(filepath)
+    tablestructure = get_structure(filepath, cache)
 
     images = list(tablestructure[0].keys())
     counts = list(tablestructure[0].values())
@@ -703,7 +1096,8 @@ def standard_iteration(filepath,image_filter, type_filter,default_indexes, field
     return imagenames, indexes
 
 
-def filter_by_column(filepath, outputfile, image_filter=None, type_filter=None, default_indexes=2, linked=True):
+def filter_by_column(filepath, outputfile, image_filter=None, type_filter=None, default_indexes=2, linked=True,
+                     cache=None, chunksize=100000, fast=True, buffersize=2**22):
     """ Filter the google engine files by field and output a new csv
 
     the first 2 rows are considered as headers
@@ -739,6 +1133,13 @@ def filter_by_column(filepath, outputfile, image_filter=None, type_filter=None,
 
     if linked=True or linked=False
 
+    :param cache: None to read the csv file, the cache directory returned by ingest() or True to ingest the file;
+                  with a cache only the filtered columns are read
+    :param chunksize: number of rows written at once when reading from a cache
+    :param fast: apply the column selection with a precompiled itemgetter and stream the rows to writerows()
+                 (otherwise use write_filtered_row() for each row)
+    :param buffersize: buffer size in bytes for the input and output files
+
     :return:  list of output field names, indexes of field names, list of output imagenames
     """
 
@@ -760,25 +1161,34 @@ def filter_by_column(filepath, outputfile, image_filter=None, type_filter=None,
     if 'tb' in type_filter and not type_filter['tb']: type_filter['tb'] = TEXTYPES
     if 'tvi' in type_filter and not type_filter['tvi']: type_filter['tvi'] = TEXTYPES
 
-    inp = open(filepath)
-    reader = csv.reader(inp)
-    out = open(outputfile, 'w', newline='')
-    writer = csv.writer(out)
+    inp = None
+    reader = None
+    if cache:
+        cache = _cache_path(filepath, cache)
+        metadata = load_cache(cache)
+        fields = metadata['headers'][1]  # second row with field names
+    else:
+        inp = open(filepath, buffering=buffersize)
+        reader = csv.reader(inp)
 
-    # access field row
-    next(reader)  # first row with image names
-    fields = next(reader) # second row with field names
+        # access field row
+        next(reader)  # first row with image names
+        fields = next(reader) # second row with field names
 
     # define the indexes to filter the csv rows
     if linked:
-        a = linked_iteration(filepath,image_filter, type_filter,default_indexes, fields)
+        a = linked_iteration(filepath,image_filter, type_filter,default_indexes, fields, cache)
     else:
-        a = standard_iteration(filepath,image_filter, type_filter,default_indexes, fields)
+        a = standard_iteration(filepath,image_filter, type_filter,default_indexes, fields, cache)
 
     if not a:
+        if inp: inp.close()
         print('try again!')
         return
 
+    out = open(outputfile, 'w', newline='', buffering=buffersize)
+    writer = csv.writer(out)
+
     imagenames = a[0]
     indexes = a[1]
 
@@ -787,12 +1197,27 @@ def filter_by_column(filepath, outputfile, image_filter=None, type_filter=None,
     write_filtered_row(fields, indexes, writer)
     # write filtered rows
     print('filtering lines')
-    for line in reader:
-        if not line[0]:
-            continue  # skip empty lines
-        write_filtered_row(line, indexes, writer)
+    if cache:
+        # read only the filtered columns
+        first = cache_columns(cache, [0])[0]
+        columns = cache_columns(cache, indexes)
+        for start in range(0, metadata['rows'], chunksize):
+            end = min(start + chunksize, metadata['rows'])
+            keep = ~_empty_values(first[start:end])  # skip empty lines
+            block = np.column_stack([_column_text(column[start:end]) for column in columns])
+            writer.writerows(block[keep].tolist())
+    elif fast:
+        # the selection is compiled once and the rows are streamed to the (buffered) writer
+        select = row_selector(indexes)
+        writer.writerows(select(line) for line in reader if line and line[0])  # skip empty lines
+        inp.close()
+    else:
+        for line in reader:
+            if not line or not line[0]:
+                continue  # skip empty lines
+            write_filtered_row(line, indexes, writer)
+        inp.close()
 
-    inp.close()
     out.close()
 
     print('done')
@@ -800,6 +1225,47 @@ def filter_by_column(filepath, outputfile, image_filter=None, type_filter=None,
     return [fields[i] for i in indexes], indexes, imagenames
 
 
+def benchmark_filter_by_column(filepath, outputfile, image_filter=None, type_filter=None, default_indexes=2,
+                               linked=True, cache=None, repeat=1):
+    """ compare the rows/second of filter_by_column() with write_filtered_row() (before) and with the precompiled
+    itemgetter selection (after); if a cache is passed the cache reader is also measured
+
+    :param filepath: path to the csv file
+    :param outputfile: path to the output csv file (overwritten by each run)
+    :param image_filter: see filter_by_column()
+    :param type_filter: see filter_by_column()
+    :param default_indexes: see filter_by_column()
+    :param linked: see filter_by_column()
+    :param cache: None or the cache directory returned by ingest()
+    :param repeat: number of runs for each method, the best time is used
+    :return: a dictionary {method: rows/second}
+    """
+
+    rows = count_row(filepath) - 2  # minus the headers
+
+    runs = [('write_filtered_row', {'fast': False}), ('itemgetter', {'fast': True})]
+    if cache:
+        runs.append(('cache', {'cache': cache}))
+
+    results = {}
+    for name, kwargs in runs:
+        best = None
+        for i in range(repeat):
+            # copy the filter, filter_by_column() fills the empty lists
+            tf = dict(type_filter) if type_filter else type_filter
+            start = time.perf_counter()
+            filter_by_column(filepath, outputfile, image_filter, tf, default_indexes, linked, **kwargs)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = rows / best if best else float('inf')
+
+    print('\nrows/second')
+    for name in results:
+        print(name, round(results[name]), 'x%.2f' % (results[name] / results['write_filtered_row']))
+
+    return results
+
+
 ############ cross something
 
 
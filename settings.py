@@ -8,13 +8,17 @@ else:
     sys.exit()
 
 import json
+import os
 import utility
 
+# the settings folder next to this module (the scripts may change the working directory)
+SETTINGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "settings")
+
 #################### parsing the main.ini ##########################
 
 
 
-def parse_ini(inpt = "./settings/main.ini" ):
+def parse_ini(inpt = os.path.join(SETTINGS_DIR, "main.ini")):
     """
     :param inpt:
     :return:
@@ -48,6 +52,10 @@ def parse_ini(inpt = "./settings/main.ini" ):
 
     #the nodatavalue to assign when polygons falls outside the raster (this works when mean == True)
     out["nodatavalue"] =  data_extraction.get("nodatavalue", None)
+    # the zonal statistics when mean == True
+    out["mean_statistics"] = [stat.strip() for stat in data_extraction.get("mean_statistics", "mean").split(",") if stat.strip()]
+    # reuse the rasterized polygons of the previous runs
+    out["pixel_index_cache"] = data_extraction.getboolean("pixel_index_cache", True)
 
 
     #this is not necessary anymore because now the heralick paths are in thejson file
@@ -67,9 +75,15 @@ def parse_ini(inpt = "./settings/main.ini" ):
 
     skll = p['skll']
     out["skll_dir"] = skll.get("skll_dir","." )
+    # write the text files for skll (otherwise only the binary feature tables)
+    out["skll_text"] = skll.getboolean("text_output", True)
+    # number of processes formatting the text files (only when the export runs in the main process)
+    out["text_workers"] = skll.getint("text_workers", 1)
 
     boruta = p['boruta']
     out["boruta_dir"] = boruta.get("boruta_dir","." )
+    # write the text files for boruta
+    out["boruta_text"] = boruta.getboolean("text_output", True)
 
     classification = p['classification']
     #percentage of validation data
@@ -83,6 +97,10 @@ def parse_ini(inpt = "./settings/main.ini" ):
     out["parallelize"] = ipyparallel.getboolean('parallelize', False)
     out["engine_messages"] = ipyparallel.getboolean('engine_messages', False)
     out["max_processes"] = ipyparallel.getint("max_processes", 4)
+    # 'local' -> process pool on this machine, 'ipyparallel' -> ipcluster engines
+    out["parallel_mode"] = ipyparallel.get("parallel_mode", "local")
+    # how many times a failed extraction task is resubmitted (local mode)
+    out["task_retries"] = ipyparallel.getint("task_retries", 1)
 
     return out
 
@@ -139,7 +157,7 @@ def extract_haralick_images(tag0, tag1, tag2 ):
             raise NotImplementedError("only folders are possible")
 
 
-def parse_json(inpt = "./settings/paths.json"):
+def parse_json(inpt = os.path.join(SETTINGS_DIR, "paths.json")):
     """
     :param inpt:
     :return:
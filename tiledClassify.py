@@ -8,24 +8,83 @@
 # Created:     12/09/2015
 #-------------------------------------------------------------------------------
 
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
 from osgeo import gdal
 import numpy as np
 import gdalRasterIO
 
-def tiledClassification(img,classifier,  tilesize =(256,256), outname = 'classify.tif'):
+
+def tile_windows(xsize, ysize, tilesize):
+    """ define the tiles of an image, tiles are iterated by column and by row
+    :param xsize: image columns
+    :param ysize: image rows
+    :param tilesize: tile size (columns, rows)
+    :return: a list of tuples (x, y, cols, rows, tile column number, tile row number)
+    """
+
+    block_xsize, block_ysize = tilesize
+
+    windows = []
+    for i, x in enumerate(range(0, xsize, block_xsize)):
+        cols = min(block_xsize, xsize - x)
+        for j, y in enumerate(range(0, ysize, block_ysize)):
+            rows = min(block_ysize, ysize - y)
+            windows.append((x, y, cols, rows, i, j))
+    return windows
+
+
+def classify_tile(data, classifier, nodata):
+    """ classify a multiband tile
+    :param data: the tile as a 3d numpy array (bands, rows, columns)
+    :param classifier: scikit learn trained classifier
+    :param nodata: input nodata value (if None the gdalRasterIO defaults are used)
+    :return: the classified tile as a 2d numpy array (rows, columns)
+    """
+
+    if not nodata: #if nodata is None just use the defaults
+        nodata = -3.40282e+038
+
+    # transform the multiband tile to an indexed array (pixels, bands)
+    index, r_indexed = gdalRasterIO.array_to_indexed_numpy(data, nodata, "bycolumn")
+
+    print("classify raster, wait...")
+    y_pred = classifier.predict(r_indexed)
+
+    # export back to a 2d array, the pixels outside the index get the nodata value
+    classified = np.zeros(data.shape[-2:]) + nodata
+    classified[index] = y_pred
+
+    return classified
+
+
+def tiledClassification(img,classifier,  tilesize =(256,256), outname = 'classify.tif', workers=1, readahead=None):
     """
     Tiled classification of an image given a sklearn classifier
+
+    tiles are read by the calling thread, classified by a pool of threads (gdal and numpy release the GIL)
+    and written by the calling thread as soon as they are completed (in any order)
+
     :param img: image path
     :param classifier: scikit learn trained classifier
     :param tilesize: tile size (columns, rows)
     :param outname: output path
-    :param use_indexed: use an indexed array (this is used to filter out pixels with nodata value)
+    :param workers: number of threads classifying tiles
+    :param readahead: max number of tiles read and not yet written (default is 2*workers);
+                      this bounds the memory usage to readahead tiles
     :return: None
     """
 
+    if workers < 1:
+        raise ValueError("workers should be >= 1")
+    if readahead is None:
+        readahead = 2 * workers
+    readahead = max(readahead, workers)
+
+    in_ds = None
+    in_band = None
     out_ds = None
     out_band = None
-    in_memory = None
     try:
 
         # we open the big image and get info
@@ -35,90 +94,48 @@ def tiledClassification(img,classifier,  tilesize =(256,256), outname = 'classif
         xsize = in_band.XSize
         ysize = in_band.YSize
         nodata = in_band.GetNoDataValue()
-        # how many bands is the input?
-        nbands = in_ds.RasterCount
-
+        datatype = in_band.DataType
+        geotransform = in_ds.GetGeoTransform()
+        projection = in_ds.GetProjection()
 
         # set properties of the classified image
-        out_ds = in_ds.GetDriver().Create(outname, xsize, ysize, 1, in_band.DataType)
-        out_ds.SetProjection(in_ds.GetProjection())
-        out_ds.SetGeoTransform(in_ds.GetGeoTransform())
+        out_ds = in_ds.GetDriver().Create(outname, xsize, ysize, 1, datatype)
+        out_ds.SetProjection(projection)
+        out_ds.SetGeoTransform(geotransform)
 
         # we are creating a single band image so we access only band 1
         out_band = out_ds.GetRasterBand(1)
 
-        # we set the tile size
-        block_xsize, block_ysize = tilesize
+        def write_completed(futures):
+            # add the classified tiles to the output
+            for future in futures:
+                x, y = pending.pop(future)
+                out_band.WriteArray(future.result(), x, y)
+
+        pending = {}  # future: tile upperleft coords
+        with ThreadPoolExecutor(max_workers=workers) as executor:
 
-        # we iterate the tiles by column and by row
+            # we iterate the tiles by column and by row
+            for x, y, cols, rows, i, j in tile_windows(xsize, ysize, tilesize):
 
-        i = 0
-        for x in range(0, xsize, block_xsize):
-            if x + block_xsize < xsize:
-                cols = block_xsize
-            else:
-                cols = xsize - x
+                # wait for some tile to be completed before reading more tiles
+                while len(pending) >= readahead:
+                    done, not_done = wait(list(pending), return_when=FIRST_COMPLETED)
+                    write_completed(done)
 
-            j = 0
-            for y in range(0, ysize, block_ysize):
-                if y + block_ysize < ysize:
-                    rows = block_ysize
-                else:  # C
-                    rows = ysize - y
                 print("reading tile row,col: %d %d / size row,col: %d %d / upperleft coord x,y: %d %d" % (j, i, rows,
                       cols, x, y))
 
-                j += 1
-
                 # read the multiband tile into a 3d numpy array
                 data = in_ds.ReadAsArray(x, y, cols, rows)
 
+                future = executor.submit(classify_tile, data, classifier, nodata)
+                pending[future] = (x, y)
 
-                # Create memory target raster
-                in_memory = gdal.GetDriverByName('MEM').Create('', cols, rows, nbands, in_band.DataType)
-                in_memory.SetGeoTransform(in_ds.GetGeoTransform()) #assign a geotransform
-                # Create for target raster the same projection as for the value raster
-                in_memory.SetProjection(in_ds.GetProjection())
-
-                # write data to the memory raster
-                band = None
-                for z in range(1, nbands+1):
-                    band = in_memory.GetRasterBand(z)
-                    band.WriteArray(data[z-1,:,:])
-                    band.FlushCache()
-                band = None
-
-                # transform the inmemory multiband raster to an indexed array
-                if nodata:
-                    b = gdalRasterIO.raster_dataset_to_indexed_numpy(in_memory, "inmemory", nbands, "bycolumn", nodata)
-                else: #if nodata is None just use the defaults
-                    b = gdalRasterIO.raster_dataset_to_indexed_numpy(in_memory, "inmemory", nbands, "bycolumn")
-
-                in_memory = None
-
-                # use only the indexed array b[0] is the index, b[1] the indexed array,
-                # b[2] the raster properties
-                print("classify raster, wait...")
-                y_pred = classifier.predict(b[1])
-
-                # export back to raster
-                # replace the indexed array with the classifiction result
-                b=b[:1]+(y_pred,)+b[2:]
-                # save the indexed array as an array, get a list of bands arrays,
-                # rasterdt=gdalRasterIO.indexedNumpyToRasterDataset(b, outname+'.'+suffix, workingcatalog4 ,nodata=outnodatavalue, returnlist=True)
-
-                if nodata:
-                    rasterdt = gdalRasterIO.indexed_numpy_to_list(b, nodata=nodata)
-                else:
-                    rasterdt = gdalRasterIO.indexed_numpy_to_list(b)
-
-                gg = rasterdt[0]
-
-                # add the classified tile to the output
-                out_band.WriteArray(gg, x, y)
-                out_band.FlushCache()
-
-            i += 1
+            # write the remaining tiles
+            while pending:
+                done, not_done = wait(list(pending), return_when=FIRST_COMPLETED)
+                write_completed(done)
 
         out_band.FlushCache()
         if nodata:
@@ -132,5 +149,7 @@ def tiledClassification(img,classifier,  tilesize =(256,256), outname = 'classif
             out_band = None
         if out_ds:
             out_ds = None
-        if in_memory:
-            in_memory = None
\ No newline at end of file
+        if in_band:
+            in_band = None
+        if in_ds:
+            in_ds = None
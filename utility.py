@@ -21,6 +21,7 @@
 #                    - Shuffle a 2d numpy array and split in training and validation
 #                    - Get a list of band combinations as a string
 #                    - Convert a list of band combinations to a string
+#                    - Compute the normalized difference indexes for many band combinations
 #                    - Rescale image (need orfeo installed)
 #                    - execute an external executable file
 #                    - execute an external python script
@@ -670,6 +671,41 @@ def combination_count(nbands = 8):
     return len(names), names
 
 
+def normalized_difference(samples, combinations, nodata=None, zerodenominator=None, out=None):
+    """ compute the normalized difference index (A-B)/(A+B) for many band combinations with one broadcasted
+    expression
+    :param samples: 2d numpy array (pixels, bands)
+    :param combinations: a list of tuples where each tuple is the band combination (bands start at 1) e.g [(1,2),(1,3),...]
+    :param nodata: if not None, pixels where A or B are equal to nodata get nodata
+    :param zerodenominator: if not None, the value for pixels where A+B == 0 (otherwise inf/nan)
+    :param out: optional preallocated 2d array (pixels, number of combinations), e.g. a view of the output table;
+                the NDI is computed in its data type when it is a float array
+    :return: the NDI as a 2d array (pixels, number of combinations), float32 if out is None
+    """
+
+    combinations = np.asarray(combinations, dtype=np.intp).reshape(-1, 2) - 1
+    if out is not None and np.issubdtype(out.dtype, np.floating):
+        dtype = out.dtype
+    else:
+        dtype = np.float32
+    a = samples[:, combinations[:, 0]].astype(dtype)
+    b = samples[:, combinations[:, 1]].astype(dtype)
+
+    if out is None:
+        out = np.empty(a.shape, dtype=dtype)
+
+    denominator = a + b
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.divide(a - b, denominator, out=out, casting="unsafe")
+
+    if zerodenominator is not None:
+        out[denominator == 0] = zerodenominator
+    if nodata is not None:
+        out[np.logical_or(samples[:, combinations[:, 0]] == nodata, samples[:, combinations[:, 1]] == nodata)] = nodata
+
+    return out
+
+
 def column_names_to_string(t,sep1="-", sep2="\t"):
     """
     :param t: a list of tuples, each tuple with a combination e.g [(1,2),(1,3),...]